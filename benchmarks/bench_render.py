@@ -0,0 +1,83 @@
+"""
+Микробенчмарк построения строк: линейный поиск врача и стадий против RenderContext.
+
+Запуск: python -m benchmarks.bench_render
+"""
+import random
+import time
+from datetime import timedelta
+
+from babel.dates import format_timedelta
+
+from starter.config import deal_stages
+from starter.render import RenderContext, META_FIELDS
+
+DEALS = 10_000
+USERS = 1_000
+
+
+def legacy_row(deal, stages, users, working_delta):
+    """Прежний generate_row: поиск врача и стадии перебором."""
+    user = next((u for u in users if u["ID"] == deal["ASSIGNED_BY_ID"]), {})
+    fullname = f"{user.get('NAME', '')} {user.get('LAST_NAME', '')}"
+    delta_str = format_timedelta(working_delta, locale="ru", format="long")
+    row = {"deal_id": deal["ID"], "doc_name": fullname, "delay": ""}
+    for stage in stages:
+        stage_name = stage["NAME"]
+        if stage["STATUS_ID"] == deal["STAGE_ID"]:
+            if stage_name in deal_stages and deal_stages[stage_name] and working_delta > deal_stages[stage_name]:
+                row["delay"] = "Просрочено"
+            row[stage_name] = delta_str
+        else:
+            row[stage_name] = ""
+    return row
+
+
+def make_data(rng):
+    stages = [{"STATUS_ID": f"C16:{i}", "NAME": name} for i, name in enumerate(deal_stages)]
+    users = [{"ID": str(i), "NAME": f"Имя{i}", "LAST_NAME": f"Фамилия{i}"} for i in range(USERS)]
+    deals = [
+        {
+            "ID": str(i),
+            "CATEGORY_ID": "16",
+            "ASSIGNED_BY_ID": str(rng.randrange(USERS)),
+            "STAGE_ID": rng.choice(stages)["STATUS_ID"],
+        }
+        for i in range(DEALS)
+    ]
+    deltas = [timedelta(seconds=rng.randrange(14 * 86400)) for _ in range(DEALS)]
+    return deals, stages, users, deltas
+
+
+def measure(func):
+    started = time.perf_counter()
+    result = func()
+    return time.perf_counter() - started, result
+
+
+def main():
+    deals, stages, users, deltas = make_data(random.Random(0))
+
+    legacy_time, legacy_rows = measure(
+        lambda: [legacy_row(deal, stages, users, delta) for deal, delta in zip(deals, deltas)])
+
+    def indexed():
+        context = RenderContext(stages, users)
+        return [context.render_row(deal, delta) for deal, delta in zip(deals, deltas)]
+
+    indexed_time, indexed_rows = measure(indexed)
+    # DealRow хранит только стадию сделки, прежние строки — все стадии с пустыми значениями
+    for legacy, row in zip(legacy_rows, indexed_rows):
+        data = row.to_data()
+        for field in [*META_FIELDS, "overdue_at"]:
+            del data[field]
+        assert {key: value for key, value in legacy.items() if value != "" or key in data} == data
+
+    print(f"{DEALS} сделок / {USERS} сотрудников")
+    print(f"перебор:         {legacy_time:.3f} с")
+    print(f"RenderContext:   {indexed_time:.3f} с")
+    print(f"ускорение:       x{legacy_time / indexed_time:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Клиенты Bitrix24 и gspread, которые отвечают записанными данными без сети.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qsl
+
+from bitrix_.paginator import PAGE_SIZE
+from sheet.manager import GoogleSheetManager
+
+
+class RecordedBitrix24:
+    def __init__(self, responses: dict, latency: float = 0.0):
+        """
+        Имитация Bitrix24.request по записанным данным.
+
+        Списочные методы отдают страницы по 50 записей с фильтрами >ID, <=ID и CATEGORY_ID
+        и сортировкой по ID; фильтры по DATE_MODIFY не применяются — записанный набор
+        считается измененным целиком, как при полной сверке. Поддерживается batch.
+
+        :param responses: Записи по методам: crm.deal.list и user.get — списки,
+            crm.dealcategory.stage.list — словарь {ID воронки: стадии}.
+        :param latency: Задержка каждого HTTP-запроса в секундах.
+        """
+        self.responses = responses
+        self.latency = latency
+        self.requests = 0
+        self._deals = {deal["ID"]: deal for deal in responses.get("crm.deal.list", [])}
+
+    @classmethod
+    def from_file(cls, path: str, latency: float = 0.0):
+        with open(path, encoding="utf-8") as file:
+            return cls(json.load(file), latency)
+
+    async def request(self, method: str, params):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return {"result": self._call(method, dict(params))}
+
+    def _call(self, method: str, params: dict):
+        if method == "batch":
+            results = {}
+            for key, command in params.items():
+                if key.startswith("cmd["):
+                    name = key[4:-1]
+                    command_method, _, query = command.partition("?")
+                    results[name] = self._call(command_method, dict(parse_qsl(query, keep_blank_values=True)))
+            return {"result": results, "result_error": [], "result_total": [], "result_next": []}
+        if method == "crm.dealcategory.stage.list":
+            return self.responses["crm.dealcategory.stage.list"].get(str(params.get("id", 0)), [])
+        if method == "crm.deal.get":
+            return self._deals.get(str(params["id"]))
+        if method in ("crm.deal.list", "user.get"):
+            return self._page(self.responses.get(method, []), params)
+        raise ValueError(f"Нет записанных ответов для {method}")
+
+    @staticmethod
+    def _page(items, params: dict):
+        after = int(params.get("filter[>ID]", -1))
+        until = int(params.get("filter[<=ID]", 2 ** 63))
+        category = params.get("filter[CATEGORY_ID]")
+        selected = [
+            item for item in items
+            if after < int(item["ID"]) <= until and (category is None or item.get("CATEGORY_ID") == category)
+        ]
+        descending = "DESC" in (params.get("order[ID]"), params.get("order"))
+        selected.sort(key=lambda item: int(item["ID"]), reverse=descending)
+        return selected[:PAGE_SIZE]
+
+
+class FakeWorksheet:
+    """Лист gspread в памяти: get_all_values, update, batch_update и clear."""
+
+    def __init__(self, title: str):
+        self.title = title
+        self.values = []
+        self.updated_cells = 0
+
+    def get_all_values(self):
+        return [list(row) for row in self.values]
+
+    def update(self, range_name: str, values):
+        self.batch_update([{"range": range_name, "values": values}])
+
+    def batch_update(self, data):
+        for item in data:
+            row, col = self._position(item["range"].split(":")[0])
+            for row_offset, values in enumerate(item["values"]):
+                for col_offset, value in enumerate(values):
+                    self._set(row + row_offset, col + col_offset, value)
+                self.updated_cells += len(values)
+
+    def clear(self):
+        self.values = []
+
+    def _set(self, row, col, value):
+        while len(self.values) <= row:
+            self.values.append([])
+        line = self.values[row]
+        if len(line) <= col:
+            line.extend([""] * (col + 1 - len(line)))
+        line[col] = value
+
+    @staticmethod
+    def _position(cell: str):
+        letters = "".join(c for c in cell if c.isalpha())
+        return int(cell[len(letters):]) - 1, GoogleSheetManager.column_letter_to_number(letters) - 1
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.worksheets = {}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        return self.worksheets.setdefault(title, FakeWorksheet(title))
+
+
+class OfflineSheetManager(GoogleSheetManager):
+    """GoogleSheetManager над документом в памяти, без авторизации."""
+
+    def __init__(self, spreadsheet_id: str = "benchmark"):
+        super().__init__("", spreadsheet_id)
+
+    def _authenticate(self):
+        self.sheet = FakeSpreadsheet()
@@ -0,0 +1,98 @@
+"""
+Синтетическая воронка для бенчмарков: стадии, сотрудники и сделки в формате ответов Bitrix24.
+
+Запись набора в JSON для RecordedBitrix24:
+    python -m benchmarks.synthetic --deals 10000 --output benchmarks/fixtures/funnel_10k.json
+"""
+import argparse
+import json
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from starter.config import deal_stages
+
+BITRIX_DATETIME = "%Y-%m-%dT%H:%M:%S%z"
+
+
+@dataclass
+class Funnel:
+    category_id: int
+    stages: list
+    users: list
+    deals: list = field(default_factory=list)
+
+    def to_responses(self) -> dict:
+        """Записи для RecordedBitrix24."""
+        return {
+            "crm.deal.list": self.deals,
+            "user.get": self.users,
+            "crm.dealcategory.stage.list": {str(self.category_id): self.stages},
+        }
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_responses(), file, ensure_ascii=False)
+
+
+def bitrix_time(moment: datetime) -> str:
+    # Bitrix24 отдает смещение пояса с двоеточием: 2024-10-01T10:00:00+05:00
+    value = moment.strftime(BITRIX_DATETIME)
+    return f"{value[:-2]}:{value[-2:]}"
+
+
+def generate_funnel(deals: int = 1000, users: int = 200, category_id: int = 16, seed: int = 0,
+                    max_dwell_days: int = 120, now: datetime = None) -> Funnel:
+    """
+    Воронка заданного размера.
+
+    Время на стадии распределено экспоненциально с хвостом до max_dwell_days:
+    большинство сделок на стадии часы и дни, часть — месяцы, как в застрявших воронках.
+
+    :param deals: Количество сделок.
+    :param users: Количество сотрудников.
+    :param category_id: ID воронки.
+    :param seed: Зерно генератора; одинаковые параметры дают одинаковый набор.
+    :param max_dwell_days: Максимальное время на стадии в днях.
+    :param now: Момент, от которого отсчитывается время на стадии.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now().astimezone()
+    stages = [
+        {"STATUS_ID": f"C{category_id}:{index}", "NAME": name, "SORT": str((index + 1) * 10)}
+        for index, name in enumerate(deal_stages)
+    ]
+    staff = [
+        {"ID": str(index), "NAME": f"Имя{index}", "LAST_NAME": f"Фамилия{index}", "ACTIVE": True}
+        for index in range(1, users + 1)
+    ]
+
+    funnel = Funnel(category_id, stages, staff)
+    for deal_id in range(1, deals + 1):
+        dwell = min(rng.expovariate(1 / (3 * 86400)), max_dwell_days * 86400)
+        moved = now - timedelta(seconds=dwell)
+        modified = moved + timedelta(seconds=rng.uniform(0, dwell))
+        funnel.deals.append({
+            "ID": str(deal_id),
+            "CATEGORY_ID": str(category_id),
+            "STAGE_ID": rng.choice(stages)["STATUS_ID"],
+            "ASSIGNED_BY_ID": rng.choice(staff)["ID"],
+            "MOVED_TIME": bitrix_time(moved),
+            "DATE_MODIFY": bitrix_time(modified),
+        })
+    return funnel
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запись синтетической воронки в JSON")
+    parser.add_argument("--deals", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--category", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+    generate_funnel(args.deals, args.users, args.category, args.seed).save(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import urlencode
+
+from bitrix_.paginator import flatten_params
+
+# Максимальное количество команд в одном batch-запросе
+BATCH_LIMIT = 50
+
+
+def build_command(method: str, params: dict = None) -> str:
+    """
+    Команда batch в виде "метод?параметры".
+
+    Ссылки на результаты предыдущих команд ("$result[deal][ASSIGNED_BY_ID]")
+    передаются без экранирования, чтобы Bitrix24 мог их подставить.
+    """
+    if not params:
+        return method
+    return f"{method}?{urlencode(flatten_params(params), safe='[]$')}"
+
+
+@dataclass
+class BatchResult:
+    """Результат одной команды batch-запроса."""
+    result: Any = None
+    error: Any = None
+    total: int = None
+    next: int = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @classmethod
+    def from_response(cls, response: dict, name: str):
+        def section(key):
+            # Пустые секции Bitrix24 возвращает как список, а не словарь
+            value = response.get(key)
+            return value if isinstance(value, dict) else {}
+
+        return cls(
+            result=section("result").get(name),
+            error=section("result_error").get(name),
+            total=section("result_total").get(name),
+            next=section("result_next").get(name),
+        )
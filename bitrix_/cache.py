@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    digest: str
+    expires_at: float
+
+
+class BitrixCache:
+    def __init__(self, ttls: dict = None, default_ttl: float = 0, maxsize: int = 256, store=None,
+                 clock=time.time):
+        """
+        Кэш редко меняющихся ответов Bitrix24 (сотрудники, стадии воронок).
+
+        Запись живет ttl секунд своего метода и вытесняется по LRU при превышении maxsize.
+        Одновременные запросы одного ключа выполняются один раз (single-flight).
+        При обновлении записи сравнивается хэш содержимого, изменения считаются отдельно.
+
+        :param ttls: Время жизни в секундах по имени метода REST API.
+        :param default_ttl: Время жизни для остальных методов (0 — не кэшировать).
+        :param maxsize: Максимальное количество записей.
+        :param store: Хранилище для теплого старта с методами load(key) и save(key, entry).
+        :param clock: Источник текущего времени (unix-время).
+        """
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.maxsize = maxsize
+        self.store = store
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.changes = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        # Время сброса по области (None — весь кэш, метод или ключ), чтобы не поднимать
+        # из хранилища записи, сохраненные до сброса
+        self._invalidations = {}
+
+    @staticmethod
+    def make_key(method: str, *args) -> str:
+        return ":".join([method, *map(str, args)])
+
+    @staticmethod
+    def digest(value) -> str:
+        dump = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(dump.encode()).hexdigest()
+
+    def ttl(self, method: str) -> float:
+        return self.ttls.get(method, self.default_ttl)
+
+    def peek(self, method: str, *args):
+        """
+        Значение из памяти, если оно еще не устарело.
+
+        :return: Закэшированное значение или None.
+        """
+        key = self.make_key(method, *args)
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= self.clock():
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry.value
+
+    async def get_or_load(self, method: str, args: tuple, loader):
+        """
+        Значение из кэша или результат loader() с сохранением в кэш.
+
+        Результат None (ошибка запроса) не кэшируется; в этом случае возвращается
+        устаревшее значение, если оно есть.
+
+        :param method: Метод REST API (определяет время жизни).
+        :param args: Аргументы метода, входящие в ключ.
+        :param loader: Корутинная функция без аргументов, получающая свежие данные.
+        """
+        value = self.peek(method, *args)
+        if value is not None:
+            return value
+
+        key = self.make_key(method, *args)
+        if key in self._inflight:
+            # Такой же запрос уже выполняется — ждем его результат
+            self.hits += 1
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self._load(method, key, loader)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение доставлено ожидающим; само future дальше не нужно
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _load(self, method: str, key: str, loader):
+        entry = self._entries.get(key)
+        if entry is None and self.store is not None:
+            entry = await self._restore(key)
+            if entry is not None and self._invalidated(method, key, entry):
+                entry = None
+            if entry is not None and entry.expires_at > self.clock():
+                self.hits += 1
+                self._put(key, entry)
+                return entry.value
+
+        self.misses += 1
+        value = await loader()
+        if value is None:
+            return entry.value if entry else None
+
+        digest = self.digest(value)
+        if entry is not None and entry.digest != digest:
+            self.changes += 1
+            logging.info(f"Данные {key} в Bitrix24 изменились.")
+
+        entry = CacheEntry(value, digest, self.clock() + self.ttl(method))
+        self._put(key, entry)
+        if self.store is not None:
+            await self._persist(key, entry)
+        return value
+
+    def _put(self, key: str, entry: CacheEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def _restore(self, key: str):
+        try:
+            return await self.store.load(key)
+        except Exception as e:
+            logging.warning(f"Не удалось прочитать кэш {key} из БД: {e}")
+            return None
+
+    async def _persist(self, key: str, entry: CacheEntry):
+        try:
+            await self.store.save(key, entry)
+        except Exception as e:
+            logging.warning(f"Не удалось сохранить кэш {key} в БД: {e}")
+
+    def invalidate(self, method: str = None, *args):
+        """
+        Сброс кэша: всего, всех записей метода или одной записи.
+
+        :param method: Метод REST API; если не указан, сбрасывается весь кэш.
+        :param args: Аргументы метода; если не указаны, сбрасываются все записи метода.
+        """
+        scope = self.make_key(method, *args) if args else method
+        self._invalidations[scope] = self.clock()
+        if method is None:
+            self._entries.clear()
+        elif args:
+            self._entries.pop(self.make_key(method, *args), None)
+        else:
+            for key in [key for key in self._entries if key.split(":", 1)[0] == method]:
+                del self._entries[key]
+
+    def _invalidated(self, method: str, key: str, entry: CacheEntry) -> bool:
+        stored_at = entry.expires_at - self.ttl(method)
+        return any(self._invalidations.get(scope, float("-inf")) >= stored_at for scope in (None, method, key))
+
+    def stats(self) -> dict:
+        """Счетчики попаданий, промахов и обнаруженных изменений."""
+        return {"hits": self.hits, "misses": self.misses, "changes": self.changes, "size": len(self._entries)}
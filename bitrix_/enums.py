@@ -9,4 +9,5 @@ class DealCategory(IntEnum):
 
 class Hopper(StrEnum):
     OVK = "ОВК"
-    OK = "ОК"
\ No newline at end of file
+    OK = "ОК"
+    CHE = "ЧЕК-АП"
\ No newline at end of file
@@ -3,15 +3,28 @@ import logging
 from bitrix24 import Bitrix24
 import datetime
 
+from bitrix_.batch import BATCH_LIMIT, BatchResult, build_command
+from bitrix_.cache import BitrixCache
+from bitrix_.paginator import BitrixPaginator, collect
+from starter.throttle import ServiceGuard
+
+USERS_PARAMS = {"select": ["ID", "NAME", "LAST_NAME", "SECOND_NAME", "EMAIL", "ACTIVE", "WORK_POSITION"]}
+
 
 class BitrixManager:
-    def __init__(self, api_url: str):
+    def __init__(self, api_url: str, page_concurrency: int = 4, cache: BitrixCache = None,
+                 guard: ServiceGuard = None):
         """
         Инициализация менеджера для работы с API Bitrix24.
 
         :param api_url: URL для доступа к Bitrix24 REST API.
+        :param page_concurrency: Максимальное количество одновременных запросов страниц.
+        :param cache: Кэш справочников (сотрудники, стадии); без него данные запрашиваются каждый раз.
+        :param guard: Ограничение частоты, повторы и размыкатель для запросов.
         """
         self.bitrix = Bitrix24(api_url)
+        self.cache = cache
+        self.paginator = BitrixPaginator(self.bitrix, concurrency=page_concurrency, guard=guard)
 
     async def get_deal_list(self):
         """
@@ -48,6 +61,70 @@ class BitrixManager:
             logging.error(f"Ошибка при получении списка лидов: {e}")
             return None
 
+    async def get_deals(self, ids):
+        """
+        Получение сделок по ID (crm.deal.get) batch-запросами по 50 команд.
+
+        :param ids: ID сделок.
+        :return: Список найденных сделок; удаленные и недоступные сделки пропускаются.
+        """
+        ids = list(dict.fromkeys(str(id) for id in ids))
+        deals = []
+        for offset in range(0, len(ids), BATCH_LIMIT):
+            chunk = ids[offset:offset + BATCH_LIMIT]
+            results = await self.batch({id: ('crm.deal.get', {"id": id}) for id in chunk})
+            if results is None:
+                return None
+            deals.extend(results[id].result for id in chunk if results[id].ok and results[id].result)
+        return deals
+
+    @staticmethod
+    def deals_modified_last_days_params(category_id: int, days_ago: int = 1):
+        """
+        Параметры crm.deal.list для сделок, измененных за последние несколько дней.
+
+        :param category_id: ID Воронки
+        :param days_ago: Количество дней назад для фильтрации по дате изменения.
+        """
+        now = datetime.datetime.now() - datetime.timedelta(days=days_ago)
+        filter_data = {
+            ">DATE_MODIFY": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "CATEGORY_ID": category_id
+        }
+        return {"filter": filter_data, "select": ["*"]}
+
+    @staticmethod
+    def deals_modified_since_params(category_id: int, since: datetime.datetime):
+        """
+        Параметры crm.deal.list для сделок, измененных начиная с указанного момента.
+
+        :param category_id: ID Воронки
+        :param since: Нижняя граница DATE_MODIFY (включительно) в часовом поясе портала.
+        """
+        filter_data = {
+            ">=DATE_MODIFY": since.strftime("%Y-%m-%d %H:%M:%S"),
+            "CATEGORY_ID": category_id
+        }
+        return {"filter": filter_data, "select": ["*"]}
+
+    def iter_deals(self, params: dict, first_page: list = None):
+        """
+        Постраничное получение сделок (crm.deal.list).
+
+        :param params: Параметры crm.deal.list (filter, select).
+        :param first_page: Уже полученная первая страница, например из batch.
+        :return: Асинхронный генератор страниц сделок.
+        """
+        return self.paginator.pages('crm.deal.list', params, first_page=first_page)
+
+    def iter_deals_modified_last_days(self, category_id: int, days_ago: int = 1):
+        """Постраничное получение сделок, измененных за последние несколько дней."""
+        return self.iter_deals(self.deals_modified_last_days_params(category_id, days_ago))
+
+    def iter_deals_modified_since(self, category_id: int, since: datetime.datetime):
+        """Постраничное получение сделок, измененных начиная с указанного момента."""
+        return self.iter_deals(self.deals_modified_since_params(category_id, since))
+
     async def get_deals_modified_last_days(self, category_id: int, days_ago: int = 1):
         """
         Получение списка сделок, измененных за последние несколько дней (crm.deal.list).
@@ -57,21 +134,25 @@ class BitrixManager:
         :return: Список сделок.
         """
         try:
-            now = datetime.datetime.now() - datetime.timedelta(days=days_ago)
-            filter_data = {
-                ">DATE_MODIFY": now.strftime("%Y-%m-%d %H:%M:%S"),
-                "CATEGORY_ID": category_id
-            }
-            result = await self.bitrix.callMethod(
-                method='crm.deal.list',
-                filter=filter_data,
-                select=["*"]
-            )
-            return result
+            return await collect(self.iter_deals_modified_last_days(category_id, days_ago))
         except Exception as e:
             logging.error(f"Ошибка при получении списка сделок: {e}")
             return None
 
+    async def get_deals_modified_since(self, category_id: int, since: datetime.datetime):
+        """
+        Получение списка сделок, измененных начиная с указанного момента (crm.deal.list).
+
+        :param category_id: ID Воронки
+        :param since: Нижняя граница DATE_MODIFY (включительно) в часовом поясе портала.
+        :return: Список сделок.
+        """
+        try:
+            return await collect(self.iter_deals_modified_since(category_id, since))
+        except Exception as e:
+            logging.error(f"Ошибка при получении списка измененных сделок: {e}")
+            return None
+
     async def get_deal_categories(self):
         """
         Получение списка воронок (категорий сделок).
@@ -85,39 +166,76 @@ class BitrixManager:
             logging.error(f"Ошибка при получении воронок: {e}")
             return None
 
-    async def get_stages_for_category(self, category_id):
+    async def get_stages_for_category(self, category_id, prefetched: list = None):
         """
-        Получение стадий для указанной воронки.
+        Получение стадий для указанной воронки (с кэшированием, если кэш задан).
 
         :param category_id: ID воронки.
+        :param prefetched: Уже полученные стадии, например из batch.
         :return: Список стадий воронки.
         """
-        try:
-            stages = await self.bitrix.callMethod(
-                method='crm.dealcategory.stage.list',
-                id=category_id
-            )
-            return stages
-        except Exception as e:
-            logging.error(f"Ошибка при получении стадий для воронки {category_id}: {e}")
-            return None
-
-    async def get_all_users(self):
+        async def load():
+            if prefetched is not None:
+                return prefetched
+            try:
+                return await self.paginator.request('crm.dealcategory.stage.list', {"id": category_id})
+            except Exception as e:
+                logging.error(f"Ошибка при получении стадий для воронки {category_id}: {e}")
+                return None
+
+        return await self._cached('crm.dealcategory.stage.list', (category_id,), load)
+
+    async def get_all_users(self, first_page: list = None):
         """
-        Получение списка всех сотрудников (user.get).
+        Получение списка всех сотрудников (user.get) с кэшированием, если кэш задан.
 
+        :param first_page: Уже полученная первая страница, например из batch.
         :return: Список пользователей.
         """
-        try:
-            users = await self.bitrix.callMethod(
-                method='user.get',
-                start=0,
-                order={"ID": "ASC"},
-                select=["ID", "NAME", "LAST_NAME", "SECOND_NAME", "EMAIL", "ACTIVE", "WORK_POSITION"]
-            )
+        async def load():
+            try:
+                users = await collect(self.paginator.pages('user.get', USERS_PARAMS, first_page=first_page))
+
+                logging.info(f'Всего получено пользователей: {len(users)}.')
+                return users
+            except Exception as e:
+                logging.error(f"Ошибка при получении списка пользователей: {e}")
+                return None
+
+        return await self._cached('user.get', (), load)
+
+    def cached(self, method: str, *args):
+        """Актуальное значение из кэша без запроса к Bitrix24 или None."""
+        return self.cache.peek(method, *args) if self.cache else None
+
+    async def _cached(self, method: str, args: tuple, loader):
+        if self.cache is None:
+            return await loader()
+        return await self.cache.get_or_load(method, args, loader)
+
+    async def batch(self, commands: dict, halt: bool = False):
+        """
+        Выполнение до 50 команд одним HTTP-запросом (batch).
+
+        В параметрах команды можно ссылаться на результаты предыдущих команд,
+        например {"ID": "$result[deal][ASSIGNED_BY_ID]"}.
+
+        :param commands: Словарь {имя команды: (метод, параметры)}.
+        :param halt: Прервать выполнение на первой ошибке.
+        :return: Словарь {имя команды: BatchResult} или None, если запрос не выполнен.
+        """
+        if len(commands) > BATCH_LIMIT:
+            raise ValueError(f"В batch-запросе не больше {BATCH_LIMIT} команд, передано {len(commands)}")
 
-            logging.info(f'Всего получено пользователей: {len(users)}.')
-            return users
+        cmd = {name: build_command(method, params) for name, (method, params) in commands.items()}
+        try:
+            response = await self.paginator.request('batch', {"halt": int(halt), "cmd": cmd})
         except Exception as e:
-            logging.error(f"Ошибка при получении списка пользователей: {e}")
-            return None
\ No newline at end of file
+            logging.error(f"Ошибка при выполнении batch-запроса: {e}")
+            return None
+
+        results = {name: BatchResult.from_response(response, name) for name in commands}
+        for name, result in results.items():
+            if not result.ok:
+                logging.error(f"Ошибка команды {name} в batch-запросе: {result.error}")
+        return results
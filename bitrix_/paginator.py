@@ -0,0 +1,188 @@
+import asyncio
+import re
+
+from aiohttp import ClientError
+from bitrix24 import Bitrix24
+from bitrix24.exceptions import BitrixError
+
+from starter.metrics import record_call
+from starter.throttle import ServiceGuard
+
+# Размер страницы списочных методов REST API Bitrix24
+PAGE_SIZE = 50
+
+
+def flatten_params(params, prefix: str = ""):
+    """
+    Разворачивает вложенные параметры в пары ключ-значение в формате PHP
+    (например, {"filter": {">ID": 1}} -> [("filter[>ID]", "1")]).
+
+    Пары кодируются HTTP-клиентом целиком, поэтому ключи с "=" (">=DATE_MODIFY")
+    и значения с "+" или "&" передаются без искажений.
+    """
+    pairs = []
+    items = params.items() if isinstance(params, dict) else enumerate(params)
+    for key, value in items:
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if isinstance(value, (dict, list, tuple)):
+            pairs.extend(flatten_params(value, name))
+        else:
+            pairs.append((name, "" if value is None else str(value)))
+    return pairs
+
+
+def classify_error(error: Exception):
+    """
+    Можно ли повторить запрос к Bitrix24 после ошибки.
+
+    Превышение лимита приходит как HTTP 503 (QUERY_LIMIT_EXCEEDED в теле) или 429:
+    клиент не читает тело ответа с ошибочным статусом, поэтому лимит узнается по статусу,
+    и для него запрашивается пауза. QUERY_LIMIT_EXCEEDED в ответе 200 клиент bitrix24
+    повторяет сам после паузы retry_after, и до этой функции такая ошибка не доходит.
+
+    :return: (повторять ли, пауза в секундах или None).
+    """
+    if isinstance(error, BitrixError):
+        status = re.fullmatch(r"HTTP error: (\d+)", str(error.message))
+        if status and int(status.group(1)) in (429, 503):
+            return True, 1.0
+        return bool(status and int(status.group(1)) >= 500), None
+    return isinstance(error, (ClientError, asyncio.TimeoutError)), None
+
+
+def count_items(result) -> int:
+    """Количество записей в ответе: в списке или во всех списках результатов batch."""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict) and isinstance(result.get("result"), dict):
+        return sum(len(value) for value in result["result"].values() if isinstance(value, list))
+    return 0
+
+
+class BitrixPaginator:
+    def __init__(self, bitrix: Bitrix24, concurrency: int = 4, guard: ServiceGuard = None):
+        """
+        Постраничное чтение списочных методов Bitrix24 по ID (ID > last_id).
+
+        :param bitrix: Клиент Bitrix24.
+        :param concurrency: Максимальное количество одновременных запросов.
+        :param guard: Ограничение частоты, повторы и размыкатель для запросов.
+        """
+        self.bitrix = bitrix
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.guard = guard
+
+    async def request(self, method: str, params: dict):
+        """Один запрос к REST API без автоматической догрузки страниц."""
+        pairs = flatten_params(params)
+        async with self.semaphore:
+            try:
+                if self.guard is None:
+                    response = await self.bitrix.request(method, pairs)
+                else:
+                    response = await self.guard.call(self.bitrix.request, method, pairs)
+            except Exception:
+                record_call("bitrix", method, failed=True)
+                raise
+        result = response["result"]
+        record_call("bitrix", method, count_items(result))
+        return result
+
+    @staticmethod
+    def page_params(method: str, params: dict, after: int = None, until: int = None,
+                    descending: bool = False):
+        """
+        Параметры запроса одной страницы (например, для включения первой страницы в batch).
+
+        :param method: Метод REST API.
+        :param params: Параметры метода.
+        :param after: Только записи с ID больше указанного.
+        :param until: Только записи с ID не больше указанного.
+        :param descending: Сортировка по убыванию ID.
+        """
+        filter_data = dict(params.get("filter", {}))
+        if after is not None:
+            filter_data[">ID"] = after
+        if until is not None:
+            filter_data["<=ID"] = until
+
+        direction = "DESC" if descending else "ASC"
+        page_params = {**params, "filter": filter_data}
+        if method.startswith("crm."):
+            # start=-1 отключает подсчет общего количества записей
+            page_params.update(order={"ID": direction}, start=-1)
+        else:
+            page_params.update(sort="ID", order=direction, start=0)
+        return page_params
+
+    async def _page(self, method: str, params: dict, **kwargs):
+        return await self.request(method, self.page_params(method, params, **kwargs))
+
+    async def pages(self, method: str, params: dict = None, first_page: list = None):
+        """
+        Асинхронный генератор страниц списочного метода.
+
+        Первая страница запрашивается сразу. Если записей больше, диапазон ID
+        от конца первой страницы до максимального ID делится на concurrency частей,
+        которые читаются параллельно; страницы отдаются по мере получения,
+        поэтому их порядок между частями не гарантируется.
+
+        :param method: Метод REST API (crm.deal.list, user.get, ...).
+        :param params: Параметры метода (filter, select, ...).
+        :param first_page: Уже полученная первая страница (page_params с after=0).
+        """
+        params = params or {}
+        first = first_page if first_page is not None else await self._page(method, params, after=0)
+        if first:
+            yield first
+        if len(first) < PAGE_SIZE:
+            return
+
+        last = await self._page(method, params, descending=True)
+        low, high = int(first[-1]["ID"]), int(last[0]["ID"])
+        if high <= low:
+            return
+
+        step = -(-(high - low) // self.concurrency)
+        bounds = [(start, min(start + step, high)) for start in range(low, high, step)]
+        queue = asyncio.Queue()
+
+        async def read_range(after, until):
+            try:
+                while True:
+                    page = await self._page(method, params, after=after, until=until)
+                    if page:
+                        await queue.put(page)
+                    if len(page) < PAGE_SIZE:
+                        break
+                    after = int(page[-1]["ID"])
+            finally:
+                await queue.put(None)
+
+        tasks = [asyncio.create_task(read_range(after, until)) for after, until in bounds]
+        try:
+            running = len(tasks)
+            while running:
+                page = await queue.get()
+                if page is None:
+                    running -= 1
+                    continue
+                yield page
+            for task in tasks:
+                # Пробрасываем ошибки запросов
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def collect(self, method: str, params: dict = None):
+        """Все записи списочного метода, упорядоченные по ID."""
+        return await collect(self.pages(method, params))
+
+
+async def collect(pages):
+    """Сбор страниц из генератора в один список, упорядоченный по ID."""
+    items = [item async for page in pages for item in page]
+    items.sort(key=lambda item: int(item["ID"]))
+    return items
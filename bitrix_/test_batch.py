@@ -0,0 +1,53 @@
+from urllib.parse import parse_qsl
+
+import pytest
+
+from bitrix_.batch import BatchResult, build_command
+from bitrix_.manager import BitrixManager
+
+
+def test_build_command_keeps_result_references():
+    command = build_command('user.get', {"filter": {"ID": "$result[deal][ASSIGNED_BY_ID]"},
+                                         "note": "a+b&c"})
+    method, query = command.split("?", 1)
+    assert method == 'user.get'
+    assert "$result[deal][ASSIGNED_BY_ID]" in query
+    assert parse_qsl(query) == [("filter[ID]", "$result[deal][ASSIGNED_BY_ID]"), ("note", "a+b&c")]
+
+
+def test_batch_result_from_response():
+    response = {
+        "result": {"deal": {"ID": "1"}},
+        "result_error": {"user": {"error": "NOT_FOUND"}},
+        "result_total": [],
+        "result_next": [],
+    }
+    deal = BatchResult.from_response(response, "deal")
+    user = BatchResult.from_response(response, "user")
+    assert deal.ok and deal.result == {"ID": "1"}
+    assert not user.ok and user.result is None
+
+
+@pytest.mark.asyncio
+async def test_batch_packs_commands_into_one_request():
+    manager = BitrixManager("https://example.bitrix24.ru/rest/1/token/")
+    requests = []
+
+    async def request(method, params):
+        requests.append((method, dict(params)))
+        return {"result": {"result": {"stages": [], "deal": {"ID": "5"}}, "result_error": []}}
+
+    manager.bitrix.request = request
+    results = await manager.batch({
+        "stages": ('crm.dealcategory.stage.list', {"id": 16}),
+        "deal": ('crm.deal.get', {"id": 5}),
+    })
+
+    assert len(requests) == 1
+    method, params = requests[0]
+    assert method == 'batch'
+    assert params["cmd[stages]"] == 'crm.dealcategory.stage.list?id=16'
+    assert results["deal"].result == {"ID": "5"}
+
+    with pytest.raises(ValueError):
+        await manager.batch({str(i): ('crm.deal.get', {"id": i}) for i in range(51)})
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from bitrix_.cache import BitrixCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class MemoryStore:
+    def __init__(self):
+        self.entries = {}
+
+    async def load(self, key):
+        return self.entries.get(key)
+
+    async def save(self, key, entry):
+        self.entries[key] = entry
+
+
+def make_loader(values, calls):
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return values[min(len(calls), len(values)) - 1]
+    return loader
+
+
+@pytest.mark.asyncio
+async def test_ttl_and_change_detection():
+    clock = Clock()
+    cache = BitrixCache(ttls={'user.get': 60}, clock=clock)
+    calls = []
+    loader = make_loader([["a"], ["a"], ["b"]], calls)
+
+    assert await cache.get_or_load('user.get', (), loader) == ["a"]
+    assert await cache.get_or_load('user.get', (), loader) == ["a"]
+    assert len(calls) == 1
+
+    clock.now += 61
+    assert await cache.get_or_load('user.get', (), loader) == ["a"]
+    clock.now += 61
+    assert await cache.get_or_load('user.get', (), loader) == ["b"]
+    assert cache.stats() == {"hits": 1, "misses": 3, "changes": 1, "size": 1}
+
+
+@pytest.mark.asyncio
+async def test_single_flight():
+    cache = BitrixCache(ttls={'user.get': 60})
+    calls = []
+    loader = make_loader([["a"]], calls)
+
+    results = await asyncio.gather(*(cache.get_or_load('user.get', (), loader) for _ in range(5)))
+
+    assert results == [["a"]] * 5
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_lru_bound_and_invalidate():
+    cache = BitrixCache(ttls={'crm.dealcategory.stage.list': 60}, maxsize=2)
+    calls = []
+    loader = make_loader([["stage"]], calls)
+
+    for category_id in (14, 16, 17):
+        await cache.get_or_load('crm.dealcategory.stage.list', (category_id,), loader)
+    assert cache.peek('crm.dealcategory.stage.list', 14) is None
+    assert cache.peek('crm.dealcategory.stage.list', 17) == ["stage"]
+
+    cache.invalidate('crm.dealcategory.stage.list')
+    assert cache.stats()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_load_keeps_stale_value():
+    clock = Clock()
+    cache = BitrixCache(ttls={'user.get': 60}, clock=clock)
+    calls = []
+
+    assert await cache.get_or_load('user.get', (), make_loader([["a"]], calls)) == ["a"]
+    clock.now += 61
+    assert await cache.get_or_load('user.get', (), make_loader([None], calls)) == ["a"]
+
+
+@pytest.mark.asyncio
+async def test_warm_start_from_store():
+    clock = Clock()
+    store = MemoryStore()
+    calls = []
+    loader = make_loader([["a"]], calls)
+
+    await BitrixCache(ttls={'user.get': 60}, store=store, clock=clock).get_or_load('user.get', (), loader)
+    restarted = BitrixCache(ttls={'user.get': 60}, store=store, clock=clock)
+    assert await restarted.get_or_load('user.get', (), loader) == ["a"]
+    assert len(calls) == 1
+
+    restarted.invalidate('user.get')
+    await restarted.get_or_load('user.get', (), loader)
+    assert len(calls) == 2
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+from aiohttp import ClientError
+from bitrix24.exceptions import BitrixError
+
+from bitrix_.paginator import BitrixPaginator, classify_error, collect, flatten_params
+
+
+class FakeBitrix24:
+    """Имитация Bitrix24.request для списочного метода с фильтрами >ID и <=ID."""
+
+    def __init__(self, ids):
+        self.ids = sorted(ids)
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+
+    async def request(self, method, params):
+        self.requests.append(params)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0)
+        self.active -= 1
+
+        params = dict(params)
+        after = int(params.get("filter[>ID]", -1))
+        until = int(params.get("filter[<=ID]", 10 ** 9))
+        ids = [id for id in self.ids if after < id <= until]
+        if params["order[ID]"] == "DESC":
+            ids.reverse()
+        return {"result": [{"ID": str(id)} for id in ids[:50]]}
+
+
+def test_flatten_params():
+    assert flatten_params({"filter": {">=DATE_MODIFY": "2024-10-01 10:00:00", "CATEGORY_ID": 16},
+                           "select": ["*", "UF_*"], "start": -1}) == [
+        ("filter[>=DATE_MODIFY]", "2024-10-01 10:00:00"),
+        ("filter[CATEGORY_ID]", "16"),
+        ("select[0]", "*"),
+        ("select[1]", "UF_*"),
+        ("start", "-1"),
+    ]
+
+
+def test_classify_error():
+    # Лимит узнается по статусу ответа; ответ с ошибкой в теле клиент повторяет сам
+    assert classify_error(BitrixError("HTTP error: 503")) == (True, 1.0)
+    assert classify_error(BitrixError("HTTP error: 429")) == (True, 1.0)
+    assert classify_error(BitrixError("HTTP error: 502")) == (True, None)
+    assert classify_error(BitrixError("HTTP error: 400")) == (False, None)
+    assert classify_error(BitrixError("Not found", "NOT_FOUND")) == (False, None)
+    assert classify_error(ClientError()) == (True, None)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("count", [0, 1, 50, 51, 1234])
+async def test_collect_returns_every_item_once(count):
+    ids = range(7, 7 + 3 * count, 3)
+    client = FakeBitrix24(ids)
+    paginator = BitrixPaginator(client, concurrency=3)
+
+    items = await paginator.collect('crm.deal.list', {"filter": {"CATEGORY_ID": 16}})
+
+    assert [int(item["ID"]) for item in items] == list(ids)
+    assert client.max_active <= 3
+    assert all(("start", "-1") in request for request in client.requests)
+
+
+@pytest.mark.asyncio
+async def test_pages_stream_before_completion():
+    paginator = BitrixPaginator(FakeBitrix24(range(1, 501)), concurrency=2)
+    pages = paginator.pages('crm.deal.list')
+
+    first = await pages.__anext__()
+    assert [item["ID"] for item in first] == [str(id) for id in range(1, 51)]
+    rest = await collect(pages)
+    assert len(rest) == 450
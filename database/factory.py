@@ -1,5 +1,21 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.asyncio import create_async_engine
+from weakref import WeakKeyDictionary
+
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+# Одна фабрика сессий на движок, общая для всех репозиториев
+_session_makers = WeakKeyDictionary()
+
+
+def session_factory(engine: AsyncEngine) -> async_sessionmaker:
+    """
+    Фабрика сессий движка; создается один раз и переиспользуется репозиториями.
+
+    :param engine: Асинхронный движок БД.
+    """
+    session_maker = _session_makers.get(engine)
+    if session_maker is None:
+        session_maker = _session_makers[engine] = async_sessionmaker(engine, expire_on_commit=False)
+    return session_maker
 
 
 class DatabaseFactory:
@@ -7,15 +23,19 @@ class DatabaseFactory:
         self.config = config
 
     async def get_async_engine(self, echo=False):
+        """
+        Единственный движок приложения (asyncpg) с настройками пула из конфигурации.
+
+        Количество соединений процесса не превышает DB_POOL_SIZE + DB_MAX_OVERFLOW.
+        """
         async_engine = create_async_engine(
             url=self.config.asyncpg_url(),
-            echo=echo
-        )
-        return async_engine
-
-    def get_engine(self):
-        async_engine = create_engine(
-            url=self.config.psycopg_url(),
-            echo=False
+            echo=echo,
+            pool_size=self.config.DB_POOL_SIZE,
+            max_overflow=self.config.DB_MAX_OVERFLOW,
+            pool_timeout=self.config.DB_POOL_TIMEOUT,
+            pool_recycle=self.config.DB_POOL_RECYCLE,
+            pool_pre_ping=self.config.DB_POOL_PRE_PING,
+            connect_args={"prepared_statement_cache_size": self.config.DB_STATEMENT_CACHE_SIZE},
         )
         return async_engine
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+# Пространство ключей рекомендательных блокировок приложения (первый аргумент pg_try_advisory_lock)
+LOCK_NAMESPACE = 0x4448
+# Разделяемая блокировка, которую держит каждый живой процесс: по ней считаются процессы (ID воронок > 0)
+PRESENCE_KEY = 0
+
+
+class LockConnection:
+    def __init__(self, engine: AsyncEngine, owner: str):
+        """
+        Выделенное соединение процесса, которое держит все его сессионные рекомендательные блокировки.
+
+        Соединение открывается вне пула движка (NullPool): количество блокировок не зависит
+        от DB_POOL_SIZE, и запросы репозиториев не ждут соединений, занятых блокировками.
+        Если процесс или соединение падает, PostgreSQL снимает все блокировки сессии сам.
+        Соединению задается application_name = owner, чтобы было видно, кто держит блокировки.
+
+        :param engine: Асинхронный движок БД (берется адрес БД).
+        :param owner: Идентификатор процесса-владельца.
+        """
+        self.owner = owner
+        self._engine = create_async_engine(engine.url, poolclass=NullPool,
+                                           connect_args={"server_settings": {"application_name": owner}})
+        self._connection: AsyncConnection = None
+        # Соединение, на котором взята блокировка присутствия процесса
+        self._present_on: AsyncConnection = None
+        # Запросы блокировок идут по одному соединению строго по очереди
+        self._mutex = asyncio.Lock()
+
+    @property
+    def current(self) -> AsyncConnection:
+        """Открытое соединение или None; блокировки, взятые на прежнем соединении, потеряны."""
+        return self._connection
+
+    @asynccontextmanager
+    async def use(self):
+        """
+        Соединение для запросов блокировок; открывается при первом обращении.
+
+        Транзакция автозапуска фиксируется после запросов (блокировки сессионные),
+        при ошибке соединение закрывается вместе со всеми блокировками.
+        """
+        async with self._mutex:
+            if self._connection is None:
+                self._connection = await self._engine.connect()
+            try:
+                yield self._connection
+                await self._connection.commit()
+            except BaseException:
+                await self._discard()
+                raise
+
+    async def live_workers(self, namespace: int = LOCK_NAMESPACE) -> int:
+        """
+        Количество живых процессов: каждый держит разделяемую блокировку присутствия
+        на своем соединении, и она снимается вместе с сессией упавшего процесса.
+
+        :param namespace: Пространство ключей.
+        :return: Количество процессов, включая этот.
+        """
+        params = {"namespace": namespace, "key": PRESENCE_KEY}
+        async with self.use() as connection:
+            if self._present_on is not connection:
+                await connection.execute(text("SELECT pg_advisory_lock_shared(:namespace, :key)"), params)
+                self._present_on = connection
+            return await connection.scalar(text(
+                "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND granted "
+                "AND classid = :namespace AND objid = :key AND objsubid = 2"
+            ), params)
+
+    async def close(self):
+        """Закрытие соединения (со снятием оставшихся блокировок) и движка."""
+        async with self._mutex:
+            await self._discard()
+        await self._engine.dispose()
+
+    async def _discard(self):
+        connection, self._connection = self._connection, None
+        if connection is None:
+            return
+        try:
+            await connection.close()
+        except Exception:
+            # Соединение уже оборвано: блокировки сняты вместе с сессией
+            pass
+
+
+class AdvisoryLock:
+    def __init__(self, connection: LockConnection, key: int, name: str, namespace: int = LOCK_NAMESPACE):
+        """
+        Сессионная рекомендательная блокировка PostgreSQL (pg_try_advisory_lock).
+
+        Блокировка удерживается выделенным соединением процесса (LockConnection) до release
+        или до обрыва соединения; после этого ее может взять другой процесс.
+
+        :param connection: Соединение блокировок процесса.
+        :param key: Ключ блокировки (например, ID воронки).
+        :param name: Имя для журнала.
+        :param namespace: Пространство ключей.
+        """
+        self.connection = connection
+        self.key = key
+        self.name = name
+        self.namespace = namespace
+        self.acquired_at = None
+        # Соединение, на котором взята блокировка
+        self._session: AsyncConnection = None
+
+    @property
+    def owner(self) -> str:
+        return self.connection.owner
+
+    @property
+    def held(self) -> bool:
+        return self._session is not None and self._session is self.connection.current
+
+    def held_seconds(self) -> float:
+        return time.monotonic() - self.acquired_at if self.held else 0.0
+
+    async def acquire(self) -> bool:
+        """
+        Попытка взять блокировку без ожидания.
+
+        :return: True, если блокировка взята (или уже удерживается этим объектом).
+        """
+        if self.held:
+            return True
+        self._session = self.acquired_at = None
+        async with self.connection.use() as connection:
+            acquired = await connection.scalar(text("SELECT pg_try_advisory_lock(:namespace, :key)"),
+                                               {"namespace": self.namespace, "key": self.key})
+            holder = None if acquired else await self._holder(connection)
+        if not acquired:
+            logging.info(f"Блокировка {self.name} занята: {holder or 'владелец неизвестен'}.")
+            return False
+
+        self._session = connection
+        self.acquired_at = time.monotonic()
+        logging.info(f"Блокировка {self.name} взята процессом {self.owner}.")
+        return True
+
+    async def check(self) -> bool:
+        """
+        Проверка, что соединение с блокировкой живо; при обрыве блокировка считается потерянной.
+
+        :return: True, если блокировка по-прежнему удерживается.
+        """
+        if not self.held:
+            if self._session is not None:
+                # Соединение закрыто при проверке другой блокировки
+                self._lost("соединение переоткрыто")
+            return False
+        try:
+            async with self.connection.use() as connection:
+                await connection.execute(text("SELECT 1"))
+            return True
+        except Exception as e:
+            self._lost(e)
+            return False
+
+    async def release(self):
+        """Снятие блокировки; соединение остается открытым для других блокировок процесса."""
+        if not self.held:
+            self._session = self.acquired_at = None
+            return
+        seconds = self.held_seconds()
+        try:
+            async with self.connection.use() as connection:
+                await connection.execute(text("SELECT pg_advisory_unlock(:namespace, :key)"),
+                                         {"namespace": self.namespace, "key": self.key})
+        except Exception as e:
+            logging.warning(f"Не удалось снять блокировку {self.name}: {e}")
+        self._session = self.acquired_at = None
+        logging.info(f"Блокировка {self.name} снята процессом {self.owner}, удерживалась {seconds:.0f} с.")
+
+    def _lost(self, reason):
+        seconds = time.monotonic() - self.acquired_at if self.acquired_at is not None else 0.0
+        logging.warning(f"Блокировка {self.name} потеряна через {seconds:.0f} с: {reason}")
+        self._session = self.acquired_at = None
+
+    async def _holder(self, connection: AsyncConnection):
+        """application_name и pid сессии, которая держит блокировку."""
+        result = await connection.execute(text(
+            "SELECT a.application_name, l.pid FROM pg_locks l JOIN pg_stat_activity a ON a.pid = l.pid "
+            "WHERE l.locktype = 'advisory' AND l.granted AND l.classid = :namespace AND l.objid = :key "
+            "AND l.objsubid = 2"
+        ), {"namespace": self.namespace, "key": self.key})
+        row = result.first()
+        return f"{row.application_name or '?'} (pid {row.pid})" if row else None
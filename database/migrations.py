@@ -0,0 +1,89 @@
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database.models import Base
+
+# Изменения схемы для таблиц, созданных предыдущими версиями.
+# Каждая миграция применяется один раз; номер записывается в schema_migrations.
+# Выражения должны быть безопасны и для новой БД, где create_all уже создал актуальную схему.
+MIGRATIONS = [
+    (1, [
+        # Уникальный индекс по deal_id для INSERT ... ON CONFLICT; дубликаты, если они есть,
+        # схлопываются до самой свежей записи
+        "DELETE FROM deals a USING deals b WHERE a.deal_id = b.deal_id AND a.id < b.id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_deals_deal_id ON deals (deal_id)",
+    ]),
+    (2, [
+        # data: Text с json.dumps -> JSONB
+        """
+        DO $$
+        BEGIN
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'deals' AND column_name = 'data') <> 'jsonb' THEN
+                ALTER TABLE deals ALTER COLUMN data TYPE JSONB USING data::jsonb;
+            END IF;
+        END $$
+        """,
+        "ALTER TABLE deals ADD COLUMN IF NOT EXISTS stage_id TEXT "
+        "GENERATED ALWAYS AS (data->>'stage_id') STORED",
+        "ALTER TABLE deals ADD COLUMN IF NOT EXISTS category_id INTEGER "
+        "GENERATED ALWAYS AS ((data->>'category_id')::integer) STORED",
+        "ALTER TABLE deals ADD COLUMN IF NOT EXISTS assigned_by_id INTEGER "
+        "GENERATED ALWAYS AS ((data->>'assigned_by_id')::integer) STORED",
+        "ALTER TABLE deals ADD COLUMN IF NOT EXISTS is_overdue BOOLEAN "
+        "GENERATED ALWAYS AS (coalesce(data->>'delay', '') = 'Просрочено') STORED",
+        "CREATE INDEX IF NOT EXISTS ix_deals_category_stage ON deals (category_id, stage_id)",
+        "CREATE INDEX IF NOT EXISTS ix_deals_assigned_by_id ON deals (assigned_by_id)",
+        "CREATE INDEX IF NOT EXISTS ix_deals_overdue ON deals (category_id, stage_id) WHERE is_overdue",
+    ]),
+    (3, [
+        # DATE_MODIFY для выборки отслеживаемых сделок из БД
+        "ALTER TABLE deals ADD COLUMN IF NOT EXISTS modified_at TIMESTAMP WITH TIME ZONE",
+        "CREATE INDEX IF NOT EXISTS ix_deals_category_modified ON deals (category_id, modified_at)",
+    ]),
+    (4, [
+        # Хэш строки для пропуска неизмененных сделок
+        "ALTER TABLE deals ADD COLUMN IF NOT EXISTS fingerprint TEXT",
+    ]),
+    (5, [
+        # Срок стадии для выборки сделок, которые станут просроченными, по диапазону времени
+        "ALTER TABLE deals ADD COLUMN IF NOT EXISTS overdue_at TIMESTAMP WITH TIME ZONE",
+        "CREATE INDEX IF NOT EXISTS ix_deals_overdue_at ON deals (overdue_at) WHERE overdue_at IS NOT NULL",
+    ]),
+    (6, [
+        # Время последней записи в deals — версия данных для API чтения
+        "CREATE INDEX IF NOT EXISTS ix_deals_updated_at ON deals (updated_at)",
+    ]),
+]
+
+
+async def create_schema(engine: AsyncEngine):
+    """
+    Создание отсутствующих таблиц и индексов через асинхронный движок (без синхронного драйвера).
+
+    :param engine: Асинхронный движок БД.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+async def run_migrations(engine: AsyncEngine):
+    """
+    Применение непримененных миграций схемы.
+
+    :param engine: Асинхронный движок БД.
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY)"))
+        applied = set((await conn.scalars(text("SELECT version FROM schema_migrations"))).all())
+
+        for version, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            logging.info(f"Применяем миграцию схемы {version}...")
+            for statement in statements:
+                await conn.execute(text(statement))
+            await conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"),
+                               {"version": version})
@@ -1,7 +1,8 @@
 from datetime import datetime
 from typing import Annotated
 
-from sqlalchemy import Column, Integer, BigInteger, Text, text
+from sqlalchemy import Column, Integer, BigInteger, Boolean, DateTime, Float, Text, text, Computed, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -16,8 +17,89 @@ class Deal(Base):
     __tablename__ = 'deals'
 
     id = Column(BigInteger, primary_key=True)
-    deal_id = Column(Integer, nullable=False)
-    data = Column(Text)
+    deal_id = Column(Integer, nullable=False, unique=True, index=True)
+    data = Column(JSONB)
+
+    # Поля для фильтрации в SQL, вычисляемые из data
+    stage_id = Column(Text, Computed("data->>'stage_id'", persisted=True))
+    category_id = Column(Integer, Computed("(data->>'category_id')::integer", persisted=True))
+    assigned_by_id = Column(Integer, Computed("(data->>'assigned_by_id')::integer", persisted=True))
+    is_overdue = Column(Boolean, Computed("coalesce(data->>'delay', '') = 'Просрочено'", persisted=True))
+    # DATE_MODIFY сделки в Bitrix24
+    modified_at = Column(DateTime(timezone=True))
+    # Хэш строки таблицы (DealRow.fingerprint); NULL — данные изменены в обход строки
+    fingerprint = Column(Text)
+    # Момент просрочки на текущей стадии по рабочему календарю; NULL — допустимое время не задано
+    overdue_at = Column(DateTime(timezone=True))
+
+    created_at: Mapped[created_at_pk]
+    updated_at: Mapped[updated_at_pk]
+
+    __table_args__ = (
+        Index('ix_deals_category_stage', 'category_id', 'stage_id'),
+        Index('ix_deals_assigned_by_id', 'assigned_by_id'),
+        Index('ix_deals_overdue', 'category_id', 'stage_id', postgresql_where=text('is_overdue')),
+        Index('ix_deals_category_modified', 'category_id', 'modified_at'),
+        Index('ix_deals_overdue_at', 'overdue_at', postgresql_where=text('overdue_at IS NOT NULL')),
+        Index('ix_deals_updated_at', 'updated_at'),
+    )
+
+
+class SyncState(Base):
+    __tablename__ = 'sync_state'
+
+    category_id = Column(Integer, primary_key=True)
+    # Максимальный DATE_MODIFY среди полученных сделок и ID сделок с этим значением
+    watermark = Column(DateTime(timezone=True))
+    last_ids = Column(JSONB, nullable=False, server_default=text("'[]'::jsonb"))
+    # Время последней полной сверки
+    full_sync_at = Column(DateTime(timezone=True))
+
+    created_at: Mapped[created_at_pk]
+    updated_at: Mapped[updated_at_pk]
+
+
+class BitrixCacheEntry(Base):
+    __tablename__ = 'bitrix_cache'
+
+    key = Column(Text, primary_key=True)
+    value = Column(JSONB)
+    digest = Column(Text, nullable=False)
+    # Unix-время окончания срока жизни записи
+    expires_at = Column(Float, nullable=False)
+
+    created_at: Mapped[created_at_pk]
+    updated_at: Mapped[updated_at_pk]
+
+
+class DealStageEvent(Base):
+    """История стадий сделки: одна запись на каждое попадание на стадию, только добавление."""
+    __tablename__ = 'deal_stage_events'
+
+    deal_id = Column(Integer, primary_key=True)
+    # MOVED_TIME сделки: ключ секционирования по месяцам
+    entered_at = Column(DateTime(timezone=True), primary_key=True)
+    category_id = Column(Integer, nullable=False)
+    stage_id = Column(Text, nullable=False)
+    assigned_by_id = Column(Integer)
+    # Время перехода на следующую стадию; NULL — сделка еще на этой стадии
+    left_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index('ix_deal_stage_events_category_stage', 'category_id', 'stage_id', 'entered_at'),
+        Index('ix_deal_stage_events_open', 'deal_id', postgresql_where=text('left_at IS NULL')),
+        # Секции по месяцам создает StageEventRepo перед записью
+        {'postgresql_partition_by': 'RANGE (entered_at)'},
+    )
+
+
+class SheetLayoutState(Base):
+    """Последние колонки листа воронки (SheetLayout) и их версия."""
+    __tablename__ = 'sheet_layouts'
+
+    worksheet = Column(Text, primary_key=True)
+    version = Column(Text, nullable=False)
+    layout = Column(JSONB, nullable=False)
 
     created_at: Mapped[created_at_pk]
     updated_at: Mapped[updated_at_pk]
@@ -0,0 +1,35 @@
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from bitrix_.cache import CacheEntry
+from database.factory import session_factory
+from database.models import BitrixCacheEntry
+
+
+class BitrixCacheRepo:
+    """Хранилище BitrixCache в БД для теплого старта."""
+
+    def __init__(self, engine: AsyncEngine):
+        self.session = session_factory(engine)
+
+    async def load(self, key: str):
+        async with self.session() as session:
+            row = await session.get(BitrixCacheEntry, key)
+            return CacheEntry(row.value, row.digest, row.expires_at) if row else None
+
+    async def save(self, key: str, entry: CacheEntry):
+        stmt = insert(BitrixCacheEntry).values(key=key, value=entry.value, digest=entry.digest,
+                                               expires_at=entry.expires_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[BitrixCacheEntry.key],
+            set_={
+                "value": stmt.excluded.value,
+                "digest": stmt.excluded.digest,
+                "expires_at": stmt.excluded.expires_at,
+                "updated_at": text("TIMEZONE('utc', now())"),
+            }
+        )
+        async with self.session() as session:
+            await session.execute(stmt)
+            await session.commit()
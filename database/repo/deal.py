@@ -1,15 +1,23 @@
-import json
+from datetime import datetime
 
-from sqlalchemy import update, delete
-from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from sqlalchemy import update, delete, text, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.future import select
 
+from database.factory import session_factory
 from database.models import Deal
 
 
 class DealRepo:
+    # Поля текущего состояния сделки: пустое значение тоже перезаписывает сохраненное
+    STATE_FIELDS = frozenset({"delay", "overdue_at"})
+    # Хэши строк, записанных в БД этим процессом или прочитанных из нее, по воронкам:
+    # ID воронки -> {ID сделки -> fingerprint}
+    _fingerprints = {}
+
     def __init__(self, engine: AsyncEngine):
-        self.session = async_sessionmaker(engine)
+        self.session = session_factory(engine)
 
     async def get_all(self):
         async with self.session() as session:
@@ -19,7 +27,171 @@ class DealRepo:
     async def get_data_by_deal_id(self, id: int):
         async with self.session() as session:
             deal = await session.scalar(select(Deal).filter_by(deal_id=id))
-            return json.loads(deal.data) if deal else None
+            return deal.data if deal else None
+
+    async def get_overdue(self, category_id: int, stage_id: str = None):
+        """
+        Просроченные сделки воронки (по частичному индексу ix_deals_overdue).
+
+        :param category_id: ID воронки.
+        :param stage_id: STATUS_ID стадии, если нужна только одна стадия.
+        :return: Список сделок.
+        """
+        stmt = select(Deal).where(Deal.is_overdue, Deal.category_id == category_id)
+        if stage_id is not None:
+            stmt = stmt.where(Deal.stage_id == stage_id)
+        async with self.session() as session:
+            result = await session.scalars(stmt)
+            return result.all()
+
+    async def get_due(self, until: datetime, since: datetime = None, category_id: int = None):
+        """
+        Сделки, срок стадии которых наступает до until (по частичному индексу ix_deals_overdue_at).
+
+        Например, станут просроченными в ближайший час: get_due(now + timedelta(hours=1), since=now).
+
+        :param until: Верхняя граница overdue_at включительно.
+        :param since: Нижняя граница overdue_at (не включительно); без нее в выборку попадут и уже просроченные.
+        :param category_id: ID воронки, если нужна только одна воронка.
+        :return: Список сделок в порядке наступления срока.
+        """
+        stmt = select(Deal).where(Deal.overdue_at <= until)
+        if since is not None:
+            stmt = stmt.where(Deal.overdue_at > since)
+        if category_id is not None:
+            stmt = stmt.where(Deal.category_id == category_id)
+        async with self.session() as session:
+            result = await session.scalars(stmt.order_by(Deal.overdue_at))
+            return result.all()
+
+    async def get_page(self, limit: int, after: int = 0, category_id: int = None, stage_id: str = None,
+                       assigned_by_id: int = None, overdue: bool = None, modified_since: datetime = None):
+        """
+        Страница сделок по возрастанию ID (keyset-пагинация по ix_deals_deal_id).
+
+        Следующая страница запрашивается с after = ID последней сделки: без OFFSET,
+        и в памяти не больше limit строк. Сделки, снятые с воронок, не выдаются.
+
+        :param limit: Количество сделок на странице.
+        :param after: ID сделки, после которой начинается страница.
+        :param category_id: ID воронки.
+        :param stage_id: STATUS_ID стадии.
+        :param assigned_by_id: ID ответственного (врача).
+        :param overdue: Только просроченные (True) или только непросроченные (False).
+        :param modified_since: Нижняя граница DATE_MODIFY.
+        :return: Список пар (ID сделки, Deal.data).
+        """
+        stmt = select(Deal.deal_id, Deal.data).where(Deal.deal_id > after, Deal.category_id.is_not(None))
+        if category_id is not None:
+            stmt = stmt.where(Deal.category_id == category_id)
+        if stage_id is not None:
+            stmt = stmt.where(Deal.stage_id == stage_id)
+        if assigned_by_id is not None:
+            stmt = stmt.where(Deal.assigned_by_id == assigned_by_id)
+        if overdue is not None:
+            # Условие в том же виде, что у частичного индекса ix_deals_overdue
+            stmt = stmt.where(Deal.is_overdue if overdue else ~Deal.is_overdue)
+        if modified_since is not None:
+            stmt = stmt.where(Deal.modified_at >= modified_since)
+        async with self.session() as session:
+            result = await session.execute(stmt.order_by(Deal.deal_id).limit(limit))
+            return result.tuples().all()
+
+    async def get_version(self):
+        """Время последней записи в deals (по индексу ix_deals_updated_at) или None для пустой таблицы."""
+        async with self.session() as session:
+            return await session.scalar(select(func.max(Deal.updated_at)))
+
+    async def iter_tracked(self, category_id: int, since: datetime, chunk_size: int = 500):
+        """
+        Данные сделок воронки, измененных в Bitrix24 начиная с since, пачками по chunk_size.
+
+        Пачки читаются keyset-страницами get_page: в памяти не больше одной пачки.
+
+        :param category_id: ID воронки.
+        :param since: Нижняя граница DATE_MODIFY.
+        :param chunk_size: Количество сделок в пачке.
+        :return: Асинхронный генератор списков словарей Deal.data в порядке ID сделки.
+        """
+        after = 0
+        while True:
+            rows = await self.get_page(chunk_size, after, category_id=category_id, modified_since=since)
+            if rows:
+                yield [data for _, data in rows]
+            if len(rows) < chunk_size:
+                return
+            after = rows[-1][0]
+
+    async def detach_from_category(self, category_id: int, ids):
+        """
+        Снятие привязки к воронке у сделок, которые из нее ушли или были удалены.
+
+        :param category_id: ID воронки.
+        :param ids: ID сделок; сделки других воронок не затрагиваются.
+        :return: ID сделок, снятых с воронки.
+        """
+        ids = [int(id) for id in ids]
+        if not ids:
+            return []
+        async with self.session() as session:
+            stmt = (update(Deal)
+                    .where(Deal.category_id == category_id, Deal.deal_id.in_(ids))
+                    .values(data=Deal.data.op("-")("category_id"), fingerprint=None, overdue_at=None)
+                    .returning(Deal.deal_id)
+                    .execution_options(synchronize_session=False))
+            detached = (await session.scalars(stmt)).all()
+            await session.commit()
+        # Хэши остальных сделок (например, записанных другой воронкой) остаются верными
+        self._forget(detached)
+        return detached
+
+    async def changed(self, category_id: int, fingerprints: dict) -> list:
+        """
+        Сделки воронки, строки которых отличаются от записанных в БД.
+
+        Хэши сравниваются с картой процесса; хэши сделок, которых в ней нет
+        (например, после перезапуска), один раз читаются из БД.
+
+        :param category_id: ID воронки, к которой относятся строки.
+        :param fingerprints: Словарь {ID сделки: DealRow.fingerprint()}.
+        :return: ID измененных и новых сделок в исходном порядке.
+        """
+        known = self._fingerprints.setdefault(int(category_id), {})
+        unknown = [int(id) for id in fingerprints if int(id) not in known]
+        if unknown:
+            stmt = select(Deal.deal_id, Deal.fingerprint).where(Deal.deal_id.in_(unknown),
+                                                                Deal.category_id == int(category_id),
+                                                                Deal.fingerprint.is_not(None))
+            async with self.session() as session:
+                result = await session.execute(stmt)
+                known.update(result.tuples().all())
+        return [id for id, fingerprint in fingerprints.items() if known.get(int(id)) != fingerprint]
+
+    @classmethod
+    def forget_category(cls, category_id: int):
+        """Сброс хэшей воронки: ее сделки могли быть записаны другим процессом."""
+        cls._fingerprints.pop(int(category_id), None)
+
+    @classmethod
+    def forget_all(cls):
+        """Сброс карты хэшей всех воронок."""
+        cls._fingerprints.clear()
+
+    @classmethod
+    def _forget(cls, ids):
+        # Данные сделок меняются в обход строк: хэши больше не соответствуют БД
+        ids = [int(id) for id in ids]
+        for known in cls._fingerprints.values():
+            for id in ids:
+                known.pop(id, None)
+
+    @staticmethod
+    def _parse_datetime(value):
+        return datetime.fromisoformat(value) if value else None
+
+    @classmethod
+    def _filter_empty(cls, data: dict):
+        return {k: v for k, v in data.items() if v or k in cls.STATE_FIELDS}
 
     async def create(self, **data):
         async with self.session() as session:
@@ -29,9 +201,10 @@ class DealRepo:
             await session.refresh(deal)
             return deal
 
-    async def update_by_deal_id(self, id: int, data: str):
+    async def update_by_deal_id(self, id: int, data: dict):
+        self._forget([id])
         async with self.session() as session:
-            stmt = update(Deal).filter_by(deal_id=id).values(data=data).execution_options(
+            stmt = update(Deal).filter_by(deal_id=id).values(data=data, fingerprint=None).execution_options(
                 synchronize_session="fetch")
             await session.execute(stmt)
             await session.commit()
@@ -54,23 +227,79 @@ class DealRepo:
             deal = await session.scalar(select(Deal).filter_by(deal_id=id))
 
             # Фильтруем пустые значения из входных данных
-            filtered_data = {k: v for k, v in data.items() if v}
+            filtered_data = self._filter_empty(data)
 
+            self._forget([id])
             if deal:
-                # Преобразуем существующие данные из JSON-строки в словарь
-                existing_data = json.loads(deal.data)
-                # Обновляем словарь новыми данными, исключив пустые значения
-                existing_data.update(filtered_data)
-                # Преобразуем обновленный словарь обратно в JSON-строку и сохраняем
-                deal.data = json.dumps(existing_data, ensure_ascii=False)
+                # Обновляем сохраненные данные новыми, исключив пустые значения
+                deal.data = {**deal.data, **filtered_data}
+                deal.fingerprint = None
             else:
                 # Если сделки с таким id нет, создаем новую с фильтрованными данными
-                new_data = json.dumps(filtered_data, ensure_ascii=False)  # Преобразуем входные данные в JSON
-                deal = Deal(deal_id=id, data=new_data)
+                deal = Deal(deal_id=id, data=filtered_data)
                 session.add(deal)
 
             # Сохраняем изменения в базе данных
             await session.commit()
             # Обновляем объект сделки после сохранения
             await session.refresh(deal)
-            return deal
\ No newline at end of file
+            return deal
+
+    @classmethod
+    def _upsert_values(cls, rows: dict, fingerprints: dict = None) -> list:
+        """Значения колонок для bulk_upsert: пустые значения данных отброшены, хэши приведены к ID сделки."""
+        fingerprints = {int(id): fingerprint for id, fingerprint in (fingerprints or {}).items()}
+        values = []
+        for id, data in rows.items():
+            data = cls._filter_empty(data)
+            values.append({"deal_id": int(id), "data": data,
+                           "modified_at": cls._parse_datetime(data.get("date_modify")),
+                           "overdue_at": cls._parse_datetime(data.get("overdue_at")),
+                           "fingerprint": fingerprints.get(int(id))})
+        return values
+
+    @staticmethod
+    def _upsert_statements(values: list, chunk_size: int):
+        """INSERT ... ON CONFLICT по chunk_size сделок в каждом."""
+        for start in range(0, len(values), chunk_size):
+            stmt = insert(Deal).values(values[start:start + chunk_size])
+            yield stmt.on_conflict_do_update(
+                index_elements=[Deal.deal_id],
+                set_={
+                    "data": Deal.data.op("||")(stmt.excluded.data),
+                    "modified_at": func.coalesce(stmt.excluded.modified_at, Deal.modified_at),
+                    "overdue_at": stmt.excluded.overdue_at,
+                    "fingerprint": stmt.excluded.fingerprint,
+                    "updated_at": text("TIMEZONE('utc', now())"),
+                }
+            )
+
+    async def bulk_upsert(self, rows: dict, chunk_size: int = 500, fingerprints: dict = None):
+        """
+        Массовое создание/обновление сделок одной транзакцией (INSERT ... ON CONFLICT).
+
+        Пустые значения отбрасываются, остальные сливаются с уже сохраненными данными
+        на стороне БД оператором JSONB ||, как в create_update_deal. Объекты после записи
+        не перечитываются.
+
+        :param rows: Словарь {ID сделки: данные строки}.
+        :param chunk_size: Количество сделок в одном INSERT.
+        :param fingerprints: Хэши строк {ID сделки: fingerprint}; сохраняются вместе с данными
+            и после записи попадают в карту процесса (см. changed).
+        :return: Количество записанных сделок.
+        """
+        values = self._upsert_values(rows, fingerprints)
+        if not values:
+            return 0
+
+        async with self.session() as session:
+            for stmt in self._upsert_statements(values, chunk_size):
+                await session.execute(stmt)
+            await session.commit()
+        # Сделки без хэша записаны с fingerprint NULL; сделка могла перейти из другой воронки
+        self._forget(item["deal_id"] for item in values)
+        for item in values:
+            category_id = item["data"].get("category_id")
+            if item["fingerprint"] and category_id:
+                self._fingerprints.setdefault(int(category_id), {})[item["deal_id"]] = item["fingerprint"]
+        return len(values)
@@ -0,0 +1,38 @@
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database.factory import session_factory
+from database.models import SheetLayoutState
+from sheet.layout import SheetLayout
+
+
+class SheetLayoutRepo:
+    def __init__(self, engine: AsyncEngine):
+        self.session = session_factory(engine)
+
+    async def get_version(self, worksheet: str):
+        """Версия последних сохраненных колонок листа или None."""
+        async with self.session() as session:
+            state = await session.get(SheetLayoutState, worksheet)
+            return state.version if state else None
+
+    async def save(self, worksheet: str, layout: SheetLayout):
+        """
+        Сохранение колонок листа.
+
+        :param worksheet: Имя листа.
+        :param layout: Колонки листа.
+        """
+        stmt = insert(SheetLayoutState).values(worksheet=worksheet, version=layout.version, layout=layout.to_data())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SheetLayoutState.worksheet],
+            set_={
+                "version": stmt.excluded.version,
+                "layout": stmt.excluded.layout,
+                "updated_at": text("TIMEZONE('utc', now())"),
+            },
+        )
+        async with self.session() as session:
+            await session.execute(stmt)
+            await session.commit()
@@ -0,0 +1,147 @@
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.future import select
+
+from database.factory import session_factory
+from database.models import DealStageEvent
+
+
+def month_start(moment: datetime) -> date:
+    """Первый день месяца (по UTC), в секцию которого попадает момент."""
+    moment = moment.astimezone(timezone.utc)
+    return date(moment.year, moment.month, 1)
+
+
+def next_month(day: date) -> date:
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def stage_entries(rows: dict) -> dict:
+    """
+    Попадания на текущие стадии по строкам сделок; строки без стадии, воронки или времени перехода пропускаются.
+
+    :param rows: Словарь {ID сделки: данные строки} со служебными полями (см. META_FIELDS).
+    :return: Словарь {ID сделки: значения новой записи deal_stage_events}.
+    """
+    entries = {}
+    for id, data in rows.items():
+        if not data.get("stage_id") or not data.get("moved_time") or not data.get("category_id"):
+            continue
+        entries[int(id)] = {
+            "deal_id": int(id),
+            "entered_at": datetime.fromisoformat(data["moved_time"]),
+            "category_id": int(data["category_id"]),
+            "stage_id": data["stage_id"],
+            "assigned_by_id": int(data["assigned_by_id"]) if data.get("assigned_by_id") else None,
+        }
+    return entries
+
+
+def plan_transitions(entries: dict, open_entered: dict):
+    """
+    Переходы, которые нужно записать: для сделки с более поздним временем перехода,
+    чем у незакрытой записи, прежняя запись закрывается и добавляется новая.
+
+    :param entries: Попадания на текущие стадии (см. stage_entries).
+    :param open_entered: ID сделки -> entered_at незакрытой записи.
+    :return: Пара (закрытия {deal_id, entered_at, left_at}, новые записи).
+    """
+    closes, inserts = [], []
+    for deal_id, entry in entries.items():
+        entered_at = open_entered.get(deal_id)
+        if entered_at is not None:
+            if entered_at >= entry["entered_at"]:
+                # Та же стадия или данные старше сохраненных
+                continue
+            closes.append({"deal_id": deal_id, "entered_at": entered_at, "left_at": entry["entered_at"]})
+        inserts.append(entry)
+    return closes, inserts
+
+
+class StageEventRepo:
+    # Месяцы, секции которых уже созданы этим процессом
+    _partitions = set()
+
+    def __init__(self, engine: AsyncEngine):
+        self.session = session_factory(engine)
+
+    async def ensure_partitions(self, session, months):
+        """
+        Создание месячных секций deal_stage_events, если их еще нет.
+
+        :param session: Сессия, в транзакции которой выполняется запись.
+        :param months: Первые дни месяцев.
+        :return: Месяцы, секции которых создавались; отмечаются созданными после фиксации транзакции.
+        """
+        missing = sorted(set(months) - self._partitions)
+        if not missing:
+            return missing
+        # Воронки пишут параллельно: секции создаются по очереди до конца транзакции
+        await session.execute(text("SELECT pg_advisory_xact_lock(hashtext('deal_stage_events'))"))
+        for month in missing:
+            name = f"deal_stage_events_{month:%Y_%m}"
+            await session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF deal_stage_events "
+                f"FOR VALUES FROM ('{month.isoformat()} 00:00+00') TO ('{next_month(month).isoformat()} 00:00+00')"
+            ))
+        return missing
+
+    async def get_open(self, session, ids):
+        """Текущие (незакрытые) стадии сделок по частичному индексу ix_deal_stage_events_open."""
+        stmt = select(DealStageEvent).where(DealStageEvent.left_at.is_(None), DealStageEvent.deal_id.in_(ids))
+        result = await session.scalars(stmt)
+        return {event.deal_id: event for event in result.all()}
+
+    async def record(self, rows: dict):
+        """
+        Запись смен стадий по строкам сделок текущего цикла.
+
+        Для сделки, у которой стадия или время перехода (moved_time) отличаются от
+        незакрытой записи, прежняя запись закрывается моментом перехода и добавляется новая.
+        Строки без стадии или времени перехода и устаревшие данные пропускаются.
+
+        :param rows: Словарь {ID сделки: данные строки} со служебными полями (см. META_FIELDS).
+        :return: Количество добавленных записей.
+        """
+        entries = stage_entries(rows)
+        if not entries:
+            return 0
+
+        async with self.session() as session:
+            open_events = await self.get_open(session, list(entries))
+            closes, inserts = plan_transitions(entries, {deal_id: event.entered_at
+                                                         for deal_id, event in open_events.items()})
+            if not inserts:
+                return 0
+
+            created = await self.ensure_partitions(session, {month_start(entry["entered_at"]) for entry in inserts})
+            if closes:
+                # Обновление по первичному ключу, включающему ключ секционирования:
+                # каждая запись затрагивает одну секцию
+                await session.execute(update(DealStageEvent), closes)
+            await session.execute(insert(DealStageEvent).values(inserts).on_conflict_do_nothing())
+            await session.commit()
+        self._partitions.update(created)
+        return len(inserts)
+
+    async def get_events(self, category_id: int, since: datetime, until: datetime = None):
+        """
+        Записи о попаданиях на стадии воронки за период.
+
+        Выборка идет по индексу (category_id, stage_id, entered_at) и только по секциям периода.
+
+        :param category_id: ID воронки.
+        :param since: Начало периода (по времени попадания на стадию).
+        :param until: Конец периода, не включительно; по умолчанию без ограничения.
+        :return: Список DealStageEvent.
+        """
+        stmt = select(DealStageEvent).where(DealStageEvent.category_id == category_id,
+                                            DealStageEvent.entered_at >= since)
+        if until is not None:
+            stmt = stmt.where(DealStageEvent.entered_at < until)
+        async with self.session() as session:
+            result = await session.scalars(stmt.order_by(DealStageEvent.entered_at))
+            return result.all()
@@ -0,0 +1,40 @@
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database.factory import session_factory
+from database.models import SyncState
+
+
+class SyncStateRepo:
+    def __init__(self, engine: AsyncEngine):
+        self.session = session_factory(engine)
+
+    async def get(self, category_id: int):
+        async with self.session() as session:
+            return await session.get(SyncState, category_id)
+
+    async def save(self, category_id: int, watermark, last_ids, full_sync_at=None):
+        """
+        Сохранение отметки синхронизации воронки.
+
+        :param category_id: ID воронки.
+        :param watermark: Максимальный DATE_MODIFY среди полученных сделок.
+        :param last_ids: ID сделок с DATE_MODIFY, равным watermark.
+        :param full_sync_at: Время полной сверки, если она была в этом цикле.
+        """
+        values = {"category_id": category_id, "watermark": watermark, "last_ids": list(last_ids)}
+        if full_sync_at is not None:
+            values["full_sync_at"] = full_sync_at
+
+        stmt = insert(SyncState).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SyncState.category_id],
+            set_={
+                **{key: stmt.excluded[key] for key in values if key != "category_id"},
+                "updated_at": text("TIMEZONE('utc', now())"),
+            },
+        )
+        async with self.session() as session:
+            await session.execute(stmt)
+            await session.commit()
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from database.repo.deal import DealRepo
+
+MODIFIED = datetime(2024, 10, 1, 12, 0, tzinfo=timezone(timedelta(hours=5)))
+
+
+def row(deal_id, **data):
+    return {"deal_id": str(deal_id), "doc_name": "Иванов", "delay": "", "overdue_at": None,
+            "date_modify": MODIFIED.isoformat(), **data}
+
+
+def compile(stmt):
+    return stmt.compile(dialect=postgresql.dialect())
+
+
+def test_upsert_values_drop_empty_fields_and_keep_fingerprints():
+    values = DealRepo._upsert_values({"1": row(1, doc_name=""), 2: row(2, date_modify=None)}, {"1": "abc"})
+
+    first, second = values
+    assert first["deal_id"] == 1 and first["fingerprint"] == "abc"
+    assert "doc_name" not in first["data"]
+    assert first["modified_at"] == MODIFIED and first["overdue_at"] is None
+    assert second["modified_at"] is None and second["fingerprint"] is None
+
+
+def test_upsert_statements_are_chunked():
+    values = DealRepo._upsert_values({id: row(id) for id in range(1, 6)})
+
+    statements = list(DealRepo._upsert_statements(values, chunk_size=2))
+
+    assert len(statements) == 3
+    chunks = [sorted(value for key, value in compile(stmt).params.items() if key.startswith("deal_id"))
+              for stmt in statements]
+    assert chunks == [[1, 2], [3, 4], [5]]
+
+
+def test_state_fields_overwrite_stored_values_when_empty():
+    (value,) = DealRepo._upsert_values({"1": row(1, doc_name="")})
+    # Пустая задержка и снятый срок стадии заменяют сохраненные, пустое ФИО — нет
+    assert {"delay": "", "overdue_at": None}.items() <= value["data"].items()
+
+
+def test_conflict_merges_data_and_updates_row_columns():
+    (stmt,) = DealRepo._upsert_statements(DealRepo._upsert_values({"1": row(1)}), chunk_size=500)
+
+    sql = " ".join(str(compile(stmt)).split())
+    assert "ON CONFLICT (deal_id) DO UPDATE SET" in sql
+    assert "data = (deals.data || excluded.data)" in sql
+    # Без DATE_MODIFY в строке сохраненное время изменения остается
+    assert "modified_at = coalesce(excluded.modified_at, deals.modified_at)" in sql
+    assert "fingerprint = excluded.fingerprint" in sql and "overdue_at = excluded.overdue_at" in sql
+    assert "updated_at = TIMEZONE('utc', now())" in sql
+
+
+class FakeSession:
+    """Сессия, которая возвращает заданные ID на UPDATE ... RETURNING."""
+
+    def __init__(self, returned):
+        self.returned = returned
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def scalars(self, stmt):
+        return SimpleNamespace(all=lambda: self.returned)
+
+    async def commit(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_detach_forgets_only_detached_deals(monkeypatch):
+    repo = DealRepo.__new__(DealRepo)
+    repo.session = lambda: FakeSession([2])
+    monkeypatch.setitem(DealRepo._fingerprints, 16, {2: "abc"})
+    monkeypatch.setitem(DealRepo._fingerprints, 17, {1: "abc"})
+
+    # Сделка 1 в другой воронке: UPDATE ее не затронул, и ее хэш остается
+    assert await repo.detach_from_category(16, ["1", "2"]) == [2]
+    assert DealRepo._fingerprints[16] == {} and DealRepo._fingerprints[17] == {1: "abc"}
+
+
+@pytest.mark.asyncio
+async def test_iter_tracked_reads_keyset_pages():
+    repo = DealRepo.__new__(DealRepo)
+    calls = []
+
+    async def get_page(limit, after, category_id=None, modified_since=None):
+        calls.append(after)
+        return [(id, {"deal_id": str(id)}) for id in (1, 4, 6, 9, 12) if id > after][:limit]
+    repo.get_page = get_page
+
+    chunks = [chunk async for chunk in repo.iter_tracked(16, MODIFIED, chunk_size=2)]
+
+    assert [[data["deal_id"] for data in chunk] for chunk in chunks] == [["1", "4"], ["6", "9"], ["12"]]
+    assert calls == [0, 4, 9]
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta, timezone
+
+from database.repo.stage_event import month_start, next_month, plan_transitions, stage_entries
+
+MOVED = datetime(2024, 10, 1, 10, 0, tzinfo=timezone(timedelta(hours=5)))
+
+
+def row(stage_id="C16:NEW", moved=MOVED, assigned_by_id="7"):
+    return {"stage_id": stage_id, "category_id": "16", "assigned_by_id": assigned_by_id,
+            "moved_time": moved.isoformat() if moved else None}
+
+
+def test_stage_entries_skip_incomplete_rows():
+    entries = stage_entries({"1": row(), "2": row(moved=None), "3": row(stage_id=""), "4": row(assigned_by_id="")})
+    assert sorted(entries) == [1, 4]
+    assert entries[1] == {"deal_id": 1, "entered_at": MOVED, "category_id": 16, "stage_id": "C16:NEW",
+                          "assigned_by_id": 7}
+    assert entries[4]["assigned_by_id"] is None
+
+
+def test_new_deal_opens_an_event():
+    closes, inserts = plan_transitions(stage_entries({"1": row()}), {})
+    assert closes == [] and [entry["deal_id"] for entry in inserts] == [1]
+
+
+def test_transition_closes_the_open_event():
+    later = MOVED + timedelta(hours=3)
+    closes, inserts = plan_transitions(stage_entries({"1": row("C16:WON", later)}), {1: MOVED})
+    assert closes == [{"deal_id": 1, "entered_at": MOVED, "left_at": later}]
+    assert [(entry["stage_id"], entry["entered_at"]) for entry in inserts] == [("C16:WON", later)]
+
+
+def test_unchanged_or_stale_stage_is_skipped():
+    entries = stage_entries({"1": row(), "2": row(moved=MOVED - timedelta(hours=1))})
+    assert plan_transitions(entries, {1: MOVED, 2: MOVED}) == ([], [])
+
+
+def test_month_partitions():
+    # 01.10 02:00 по Екатеринбургу — еще сентябрь по UTC
+    assert month_start(datetime(2024, 10, 1, 2, 0, tzinfo=MOVED.tzinfo)).isoformat() == "2024-09-01"
+    assert next_month(month_start(MOVED)).isoformat() == "2024-11-01"
+    assert next_month(datetime(2024, 12, 1).date()).isoformat() == "2025-01-01"
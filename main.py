@@ -1,12 +1,16 @@
 import asyncio
 import logging
+from datetime import datetime
 
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from bitrix_.enums import Hopper, DealCategory
 from database.factory import DatabaseFactory
-from database.models import Base
-from starter.bunch import update_data
+from database.migrations import create_schema, run_migrations
+from database.repo.deal import DealRepo
+from starter import api, metrics
+from starter.pipeline import run_cycle, shutdown, sync_deals
+from starter.webhook import DealEventQueue, create_app, start_server
 from starter.config import DotEnv
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(name)s - %(funcName)s - %(message)s')
@@ -20,24 +24,54 @@ async def main():
     config = DotEnv()
     factory = DatabaseFactory(config)
     engine = await factory.get_async_engine()
-    sync_engine = factory.get_engine()
-    Base.metadata.create_all(sync_engine)
-
-    scheduler.add_job(update_data, 'interval', seconds=60, max_instances=1,
-                      kwargs={"engine": engine, "hopper_id": Hopper.OVK, "list_name": DealCategory.OVK})
-    scheduler.add_job(update_data, 'interval', seconds=60, max_instances=1,
-                      kwargs={"engine": engine, "hopper_id": Hopper.OK, "list_name": DealCategory.OK})
-    # await update_data(engine, Hopper.OVK, DealCategory.OVK)
-    # await update_data(engine, Hopper.OK, DealCategory.OK)
+    await create_schema(engine)
+    await run_migrations(engine)
+
+    runners = []
+    if config.METRICS_ENABLED:
+        runners.append(await start_server(metrics.create_app(), config.METRICS_HOST, config.METRICS_PORT))
+
+    if config.API_ENABLED:
+        app = api.create_app(DealRepo(engine), config.FUNNELS, cache_size=config.API_CACHE_SIZE)
+        runners.append(await start_server(app, config.API_HOST, config.API_PORT))
+
+    interval = config.SYNC_INTERVAL_SECONDS
+    if config.WEBHOOK_ENABLED:
+        async def handle_events(ids):
+            with metrics.trace_cycle("webhook"):
+                await sync_deals(engine, ids, config.FUNNELS)
+
+        # Сделки обновляются по событиям Bitrix24, цикл остается редкой сверкой
+        queue = DealEventQueue(handle_events, debounce=config.WEBHOOK_DEBOUNCE_SECONDS)
+        runners.append(await start_server(create_app(queue, config.WEBHOOK_TOKEN),
+                                          config.WEBHOOK_HOST, config.WEBHOOK_PORT))
+        interval = config.RECONCILE_INTERVAL_SECONDS
+
+    def on_skipped(event):
+        # Предыдущий цикл еще выполняется: запуск по расписанию пропущен
+        metrics.cycles_skipped.inc()
+        logging.warning("Цикл синхронизации пропущен: предыдущий еще не завершен.")
+
+    # Один цикл на все воронки из FUNNELS: общие справочники, воронки обрабатываются параллельно
+    scheduler.add_job(run_cycle, 'interval', seconds=interval, max_instances=1, next_run_time=datetime.now(),
+                      kwargs={"engine": engine, "funnels": config.FUNNELS})
+    scheduler.add_listener(on_skipped, EVENT_JOB_MAX_INSTANCES)
+    # await run_cycle(engine, config.FUNNELS)
     scheduler.start()
 
     # Ожидаем, чтобы цикл событий работал бесконечно
     try:
         while True:
             await asyncio.sleep(1)
-    except (KeyboardInterrupt, SystemExit):
+    except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
         print("Остановка планировщика...")
+    finally:
+        # asyncio.run отменяет задачу по Ctrl+C: пул процессов, блокировки воронок
+        # и HTTP-серверы освобождаются при любом выходе
         scheduler.shutdown()
+        await shutdown()
+        for runner in runners:
+            await runner.cleanup()
 
 
 if __name__ == '__main__':
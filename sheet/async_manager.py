@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from gspread.exceptions import APIError
+from requests.exceptions import ConnectionError, Timeout
+
+from sheet.manager import GoogleSheetManager
+from starter.metrics import record_call
+from starter.throttle import ServiceGuard
+
+
+def classify_error(error: Exception):
+    """
+    Можно ли повторить запрос к Google Sheets после ошибки.
+
+    :return: (повторять ли, пауза из Retry-After в секундах или None).
+    """
+    if isinstance(error, APIError):
+        status = error.response.status_code
+        if status == 429:
+            return True, float(error.response.headers.get("Retry-After") or 10)
+        return status >= 500, None
+    return isinstance(error, (ConnectionError, Timeout)), None
+
+
+class AsyncGoogleSheetManager:
+    # Общие менеджеры процесса по (файл ключа, ID документа)
+    _shared = {}
+
+    def __init__(self, service_account_file: str, spreadsheet_id: str, max_workers: int = 2,
+                 guard: ServiceGuard = None):
+        """
+        Асинхронный фасад над GoogleSheetManager.
+
+        gspread работает синхронно, поэтому вызовы выполняются в ограниченном пуле потоков
+        и не блокируют цикл событий: пока Google отвечает, продолжаются запросы к Bitrix24
+        и запись в БД. Авторизация выполняется при первом вызове, тоже в пуле.
+
+        :param service_account_file: Путь к JSON-файлу с ключом сервисного аккаунта.
+        :param spreadsheet_id: ID Google Sheets документа.
+        :param max_workers: Максимальное количество одновременных запросов к Google Sheets.
+        :param guard: Ограничение частоты (квоты Sheets в минуту), повторы и размыкатель.
+        """
+        self.service_account_file = service_account_file
+        self.spreadsheet_id = spreadsheet_id
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sheets")
+        self._manager = None
+        self._lock = asyncio.Lock()
+        self.guard = guard
+
+    @classmethod
+    def shared(cls, service_account_file: str, spreadsheet_id: str, max_workers: int = 2,
+               guard: ServiceGuard = None):
+        """Фасад, общий для всего процесса."""
+        key = (service_account_file, spreadsheet_id)
+        if key not in cls._shared:
+            cls._shared[key] = cls(service_account_file, spreadsheet_id, max_workers, guard)
+        return cls._shared[key]
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def _call(self, func, *args, cells: int = 0):
+        # Запросы к API проходят через лимит и повторы; авторизация — без них
+        try:
+            if self.guard is None:
+                result = await self._run(func, *args)
+            else:
+                result = await self.guard.call(self._run, func, *args)
+        except Exception:
+            record_call("sheets", func.__name__, failed=True)
+            raise
+        record_call("sheets", func.__name__, cells)
+        return result
+
+    async def manager(self) -> GoogleSheetManager:
+        """Синхронный менеджер; создается один раз, авторизация выполняется в пуле потоков."""
+        if self._manager is None:
+            async with self._lock:
+                if self._manager is None:
+                    logging.info("Авторизуюсь в google sheets")
+                    self._manager = await self._run(
+                        GoogleSheetManager.shared, self.service_account_file, self.spreadsheet_id
+                    )
+        return self._manager
+
+    async def update_range(self, worksheet_name: str, start_cell: str, data: dict):
+        manager = await self.manager()
+        return await self._call(manager.update_range, worksheet_name, start_cell, data)
+
+    async def get_values(self, worksheet_name: str, start_cell: str = "A1"):
+        manager = await self.manager()
+        return await self._call(manager.get_values, worksheet_name, start_cell)
+
+    async def batch_update(self, worksheet_name: str, data: list):
+        manager = await self.manager()
+        cells = sum(len(row) for item in data for row in item["values"])
+        return await self._call(manager.batch_update, worksheet_name, data, cells=cells)
+
+    async def clear_all_data(self, worksheet_name: str):
+        manager = await self.manager()
+        return await self._call(manager.clear_all_data, worksheet_name)
+
+    def close(self):
+        """Остановка пула потоков; дожидается уже отправленных запросов."""
+        self._executor.shutdown(wait=True)
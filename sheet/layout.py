@@ -0,0 +1,40 @@
+import hashlib
+import json
+
+# Колонки листа перед стадиями
+HEADERS = ("ID", "Ответственный врач", "Просрочка")
+
+
+class SheetLayout:
+    def __init__(self, stages):
+        """
+        Расположение колонок листа воронки: базовые колонки и стадии в порядке SORT Bitrix24.
+
+        Порядок не зависит от состава сделок, поэтому строки сразу пишутся в позиции колонок,
+        а изменение стадий воронки определяется сравнением version.
+
+        :param stages: Стадии воронки (crm.dealcategory.stage.list) с полями STATUS_ID, NAME и SORT.
+        """
+        # Сортировка устойчивая: стадии с одинаковым SORT остаются в порядке ответа Bitrix24
+        stages = sorted(stages, key=lambda stage: int(stage.get("SORT") or 0))
+        self.stage_ids = tuple(stage["STATUS_ID"] for stage in stages)
+        self.header = HEADERS + tuple(stage["NAME"] for stage in stages)
+        # STATUS_ID стадии -> номер колонки на листе (с нуля)
+        self.columns = {stage_id: len(HEADERS) + index for index, stage_id in enumerate(self.stage_ids)}
+        self.version = hashlib.sha1(
+            json.dumps([self.stage_ids, self.header], ensure_ascii=False).encode()
+        ).hexdigest()[:16]
+
+    @property
+    def width(self) -> int:
+        return len(self.header)
+
+    def to_data(self) -> dict:
+        """Данные для сохранения в БД."""
+        return {"stage_ids": list(self.stage_ids), "header": list(self.header)}
+
+    def __eq__(self, other):
+        return isinstance(other, SheetLayout) and self.version == other.version
+
+    def __repr__(self):
+        return f"SheetLayout({self.version}, {list(self.header[len(HEADERS):])!r})"
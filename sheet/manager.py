@@ -2,30 +2,78 @@ import logging
 import re
 
 import gspread
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2.service_account import Credentials
+from gspread.exceptions import APIError, WorksheetNotFound
+from requests.adapters import HTTPAdapter
+
+from sheet.layout import HEADERS
+from starter.render import BASE_FIELDS, META_FIELDS
 
 
 class GoogleSheetManager:
-    def __init__(self, service_account_file: str, spreadsheet_id: str):
+    # Общие менеджеры процесса по (файл ключа, ID документа)
+    _shared = {}
+
+    def __init__(self, service_account_file: str, spreadsheet_id: str, timeout: float = 60):
         """
         Инициализация менеджера для работы с Google Sheets.
 
         :param service_account_file: Путь к JSON-файлу с ключом сервисного аккаунта.
         :param spreadsheet_id: ID Google Sheets документа.
+        :param timeout: Таймаут HTTP-запросов в секундах.
         """
         self.service_account_file = service_account_file
         self.spreadsheet_id = spreadsheet_id
+        self.timeout = timeout
         self.client = None
         self.sheet = None
+        self._worksheets = {}
         self._authenticate()
 
+    @classmethod
+    def shared(cls, service_account_file: str, spreadsheet_id: str):
+        """
+        Менеджер, общий для всего процесса: авторизация и открытие документа выполняются
+        один раз, дальше переиспользуются сессия и объекты листов.
+        """
+        key = (service_account_file, spreadsheet_id)
+        if key not in cls._shared:
+            cls._shared[key] = cls(service_account_file, spreadsheet_id)
+        return cls._shared[key]
+
     def _authenticate(self):
         """Авторизация с использованием сервисного аккаунта."""
         scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
         creds = Credentials.from_service_account_file(self.service_account_file, scopes=scopes)
-        self.client = gspread.authorize(creds)
+        # Постоянная сессия с keep-alive; AuthorizedSession сама обновляет истекший токен
+        session = AuthorizedSession(creds)
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.client = gspread.authorize(creds, session=session)
+        self.client.set_timeout(self.timeout)
         self.sheet = self.client.open_by_key(self.spreadsheet_id)
 
+    def worksheet(self, worksheet_name: str):
+        """Объект листа из кэша по имени; метаданные запрашиваются только при первом обращении."""
+        worksheet = self._worksheets.get(worksheet_name)
+        if worksheet is None:
+            worksheet = self._worksheets[worksheet_name] = self.sheet.worksheet(worksheet_name)
+        return worksheet
+
+    def _on_worksheet(self, worksheet_name: str, action):
+        """
+        Выполнение действия над листом из кэша. Если лист удален или переименован,
+        объект сбрасывается из кэша и действие повторяется один раз со свежим листом.
+        """
+        try:
+            return action(self.worksheet(worksheet_name))
+        except (WorksheetNotFound, APIError) as e:
+            if isinstance(e, APIError) and "Unable to parse range" not in str(e):
+                raise
+            logging.warning(f"Лист {worksheet_name} не найден, обновляем данные листа: {e}")
+            self._worksheets.pop(worksheet_name, None)
+            return action(self.worksheet(worksheet_name))
+
     def update_range(self, worksheet_name: str, start_cell: str, data: dict):
         """
         Обновление данных в диапазоне ячеек Google Sheets с заголовками и значениями из словаря.
@@ -34,17 +82,13 @@ class GoogleSheetManager:
         :param start_cell: Начальная ячейка диапазона для заголовков (например, 'A1').
         :param data: Данные для обновления в виде словаря.
         """
-        worksheet = self.sheet.worksheet(worksheet_name)
-
         # Определяем заголовки для столбцов
-        headers = ["ID", "Ответственный врач", "Просрочка"]
+        headers = list(HEADERS)
 
-        # Определение всех возможных стадий из данных (включаем уникальные стадии из всех записей)
-        stages = set()
-        for deal_data in data.values():
-            stages.update(deal_data.keys())
-        # Исключаем базовые поля из стадий
-        stages.difference_update({"deal_id", "doc_name", "delay"})
+        # Стадии из данных в порядке первого появления (без базовых и служебных полей);
+        # порядок стадий воронки задает SheetLayout, см. SheetDiffWriter
+        stages = [key for key in dict.fromkeys(key for deal_data in data.values() for key in deal_data)
+                  if key not in BASE_FIELDS and key not in META_FIELDS]
 
         # Добавляем стадии в заголовки
         headers.extend(stages)
@@ -60,7 +104,6 @@ class GoogleSheetManager:
         # Вставляем заголовки в первую строку (например, A2)
         headers_range = f"{start_col_letter}{start_row_number}:{self.column_number_to_letter(start_col_number + len(headers) - 1)}{start_row_number}"
         logging.debug(f"Диапазон заголовков: {headers_range}")
-        worksheet.update(headers_range, [headers])
 
         # Формируем строки данных
         rows = []
@@ -86,8 +129,34 @@ class GoogleSheetManager:
         data_range = f"{data_start_cell}:{end_col_letter}{end_row_number}"
         logging.debug(f"Диапазон для данных: {data_range}")
 
-        # Вставляем данные в диапазон под заголовками
-        worksheet.update(data_range, rows)
+        def write(worksheet):
+            # Вставляем заголовки и данные под ними; при повторе со свежим листом пишется и то, и другое
+            worksheet.update(headers_range, [headers])
+            worksheet.update(data_range, rows)
+
+        self._on_worksheet(worksheet_name, write)
+
+    def get_values(self, worksheet_name: str, start_cell: str = "A1"):
+        """
+        Чтение всех значений листа начиная с указанной ячейки.
+
+        :param worksheet_name: Имя листа (Sheet).
+        :param start_cell: Левая верхняя ячейка (например, 'A1').
+        :return: Список строк со строковыми значениями ячеек.
+        """
+        start_col_letter, start_row_number = re.match(r"([A-Z]+)(\d+)", start_cell).groups()
+        start_col_number = self.column_letter_to_number(start_col_letter)
+        values = self._on_worksheet(worksheet_name, lambda worksheet: worksheet.get_all_values())
+        return [row[start_col_number - 1:] for row in values[int(start_row_number) - 1:]]
+
+    def batch_update(self, worksheet_name: str, data: list):
+        """
+        Обновление нескольких диапазонов листа одним запросом.
+
+        :param worksheet_name: Имя листа (Sheet).
+        :param data: Список словарей {"range": "A1:C1", "values": [[...]]}.
+        """
+        self._on_worksheet(worksheet_name, lambda worksheet: worksheet.batch_update(data))
 
     def clear_all_data(self, worksheet_name: str):
         """
@@ -95,8 +164,7 @@ class GoogleSheetManager:
 
         :param worksheet_name: Имя листа (Sheet).
         """
-        worksheet = self.sheet.worksheet(worksheet_name)
-        worksheet.clear()  # Очищаем все данные на листе
+        self._on_worksheet(worksheet_name, lambda worksheet: worksheet.clear())  # Очищаем все данные на листе
 
     @staticmethod
     def column_number_to_letter(number: int) -> str:
@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+import pytest
+
+from sheet.async_manager import AsyncGoogleSheetManager
+
+
+class SlowSheetManager:
+    """Синхронный менеджер, который отвечает, как медленный Google Sheets."""
+
+    def __init__(self):
+        self.updates = []
+
+    def batch_update(self, worksheet_name, data):
+        time.sleep(0.2)
+        self.updates.append((worksheet_name, data))
+
+
+@pytest.mark.asyncio
+async def test_calls_do_not_block_event_loop():
+    manager = AsyncGoogleSheetManager('service_account.json', 'spreadsheet', max_workers=2)
+    manager._manager = SlowSheetManager()
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    ticker_task = asyncio.create_task(ticker())
+    started = time.monotonic()
+    await asyncio.gather(manager.batch_update("ОВК", []), manager.batch_update("ОК", []))
+    elapsed = time.monotonic() - started
+    ticker_task.cancel()
+    manager.close()
+
+    # Два запроса выполнились параллельно, а цикл событий продолжал работать
+    assert elapsed < 0.35
+    assert len(ticks) > 5
+    assert sorted(name for name, _ in manager._manager.updates) == ["ОВК", "ОК"]
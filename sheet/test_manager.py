@@ -0,0 +1,40 @@
+from gspread.exceptions import WorksheetNotFound
+
+from sheet.layout import HEADERS
+from sheet.manager import GoogleSheetManager
+
+
+class FakeWorksheet:
+    def __init__(self, deleted=False):
+        self.deleted = deleted
+        self.updates = []
+
+    def update(self, cell_range, values):
+        if self.deleted:
+            raise WorksheetNotFound("ОВК")
+        self.updates.append((cell_range, values))
+
+
+class FakeSpreadsheet:
+    def __init__(self, *worksheets):
+        self.worksheets = list(worksheets)
+
+    def worksheet(self, name):
+        return self.worksheets.pop(0)
+
+
+def manager(sheet):
+    manager = GoogleSheetManager.__new__(GoogleSheetManager)
+    manager.sheet, manager._worksheets = sheet, {}
+    return manager
+
+
+def test_update_range_retries_with_a_fresh_worksheet():
+    stale, fresh = FakeWorksheet(deleted=True), FakeWorksheet()
+    sheet_manager = manager(FakeSpreadsheet(stale, fresh))
+
+    sheet_manager.update_range("ОВК", "A1", {"1": {"deal_id": "1", "doc_name": "Иванов", "delay": "", "Новая": "1ч"}})
+
+    # Лист из кэша был удален: заголовки и данные записаны на заново полученный лист
+    assert fresh.updates == [("A1:D1", [[*HEADERS, "Новая"]]), ("A2:D2", [["1", "Иванов", "", "1ч"]])]
+    assert sheet_manager._worksheets == {"ОВК": fresh}
@@ -0,0 +1,126 @@
+import pytest
+
+from sheet.layout import SheetLayout
+from sheet.writer import SheetDiffWriter, build_grid, dense
+from starter.render import DealRow
+
+
+class FakeSheetManager:
+    """Лист в памяти с интерфейсом AsyncGoogleSheetManager."""
+
+    def __init__(self, values=None):
+        self.values = values or []
+        self.calls = []
+
+    async def get_values(self, worksheet_name, start_cell="A1"):
+        self.calls.append("get_values")
+        return [list(row) for row in self.values]
+
+    async def batch_update(self, worksheet_name, data):
+        self.calls.append(("batch_update", [item["range"] for item in data]))
+        for item in data:
+            start, end = item["range"].split(":")
+            row, col = self._position(start)
+            for row_offset, values in enumerate(item["values"]):
+                for col_offset, value in enumerate(values):
+                    self._set(row + row_offset, col + col_offset, value)
+
+    def _set(self, row, col, value):
+        while len(self.values) <= row:
+            self.values.append([])
+        line = self.values[row]
+        line.extend([""] * (col + 1 - len(line)))
+        line[col] = value
+
+    @staticmethod
+    def _position(cell):
+        letters = "".join(c for c in cell if c.isalpha())
+        col = 0
+        for c in letters:
+            col = col * 26 + ord(c) - ord('A') + 1
+        return int(cell[len(letters):]) - 1, col - 1
+
+    def grid(self):
+        # Как в Google Sheets: пустые хвосты строк и пустые строки в конце не возвращаются
+        rows = [list(row) for row in self.values]
+        for row in rows:
+            while row and row[-1] == "":
+                row.pop()
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+
+LAYOUT = SheetLayout([{"STATUS_ID": "C16:OPD", "NAME": "ОПД", "SORT": "20"},
+                      {"STATUS_ID": "C16:NEW", "NAME": "Новая заявка", "SORT": "10"}])
+
+
+def row(deal_id, doctor, delay="", **stages):
+    (stage_name, stage_value), = stages.items() or [(None, "")]
+    stage_id = {"Новая заявка": "C16:NEW", "ОПД": "C16:OPD"}.get(stage_name)
+    return DealRow(deal_id, doctor, delay, stage_name, LAYOUT.columns.get(stage_id), stage_value, stage_id=stage_id)
+
+
+def trimmed(data, layout=LAYOUT):
+    manager = FakeSheetManager([list(layout.header)] + [dense(row, layout.width) for row in build_grid(data)])
+    return manager.grid()
+
+
+def test_layout_follows_stage_sort_and_versions():
+    assert LAYOUT.header == ("ID", "Ответственный врач", "Просрочка", "Новая заявка", "ОПД")
+    assert LAYOUT.columns == {"C16:NEW": 3, "C16:OPD": 4}
+
+    same = SheetLayout([{"STATUS_ID": "C16:NEW", "NAME": "Новая заявка", "SORT": 10},
+                        {"STATUS_ID": "C16:OPD", "NAME": "ОПД", "SORT": 20}])
+    renamed = SheetLayout([{"STATUS_ID": "C16:NEW", "NAME": "Заявка", "SORT": 10},
+                           {"STATUS_ID": "C16:OPD", "NAME": "ОПД", "SORT": 20}])
+    assert same.version == LAYOUT.version
+    assert renamed.version != LAYOUT.version
+
+
+@pytest.mark.asyncio
+async def test_first_write_and_unchanged_cycle():
+    manager = FakeSheetManager()
+    writer = SheetDiffWriter("ОВК")
+    data = {"1": row("1", "Иванов", **{"Новая заявка": "3 часа"}), "2": row("2", "Петров", **{"ОПД": "1 день"})}
+
+    assert await writer.write(manager, data, LAYOUT) == 1
+    assert manager.grid() == trimmed(data)
+
+    manager.calls.clear()
+    assert await writer.write(manager, data, LAYOUT) == 0
+    assert manager.calls == []
+
+
+@pytest.mark.asyncio
+async def test_changed_cells_added_and_removed_rows():
+    manager = FakeSheetManager()
+    writer = SheetDiffWriter("ОВК")
+    await writer.write(manager, {str(i): row(str(i), "Иванов", **{"Новая заявка": "1 час"}) for i in range(1, 6)},
+                       LAYOUT)
+
+    data = {str(i): row(str(i), "Иванов", **{"Новая заявка": "1 час"}) for i in range(1, 4)}
+    data["2"].stage_value = "2 часа"
+    data["3"].delay = "Просрочено"
+    manager.calls.clear()
+    await writer.write(manager, data, LAYOUT)
+
+    assert manager.grid() == trimmed(data)
+    (call, ranges), = manager.calls
+    assert call == "batch_update"
+    assert ranges == ["D3:D3", "C4:C4", "A5:D6"]
+
+
+@pytest.mark.asyncio
+async def test_seeds_from_existing_sheet_and_rewrites_on_header_change():
+    existing = [["ID", "Ответственный врач", "Просрочка", "Старая стадия"], ["1", "Иванов", "", "x"],
+                ["9", "Сидоров", "", "y"]]
+    manager = FakeSheetManager(existing)
+    writer = SheetDiffWriter("ОВК")
+    data = {"1": row("1", "Иванов")}
+
+    await writer.write(manager, data, LAYOUT)
+
+    assert manager.calls[0] == "get_values"
+    assert manager.calls[1] == ("batch_update", ["A1:E3"])
+    assert manager.grid() == trimmed(data)
@@ -0,0 +1,145 @@
+import logging
+import re
+
+from sheet.async_manager import AsyncGoogleSheetManager
+from sheet.layout import SheetLayout
+from sheet.manager import GoogleSheetManager
+
+
+def build_grid(data: dict):
+    """
+    Строки листа в разреженном виде.
+
+    :param data: Словарь {ID сделки: DealRow}, построенных по одному SheetLayout.
+    :return: Список строк, каждая — кортеж пар (номер колонки, значение) только для непустых ячеек.
+    """
+    return [row.cells() for row in data.values()]
+
+
+def sparse(values) -> tuple:
+    """Разреженная строка из списка значений ячеек."""
+    return tuple((col, value) for col, value in enumerate(values) if value != "")
+
+
+def dense(row, width: int, start: int = 0) -> list:
+    """Значения ячеек разреженной строки в колонках [start, width)."""
+    values = [""] * (width - start)
+    for col, value in row:
+        if start <= col < width:
+            values[col - start] = value
+    return values
+
+
+class SheetDiffWriter:
+    def __init__(self, worksheet_name: str, start_cell: str = "A1", max_rows_per_request: int = 5000):
+        """
+        Запись таблицы на лист только измененными диапазонами.
+
+        Последняя записанная таблица хранится в памяти в разреженном виде (только непустые
+        ячейки) вместе с версией SheetLayout; при первом запуске она читается с листа.
+        Измененные ячейки, добавленные и удаленные строки отправляются через batch_update,
+        лист при этом не очищается. При смене версии колонок лист перезаписывается целиком.
+
+        :param worksheet_name: Имя листа (Sheet).
+        :param start_cell: Левая верхняя ячейка таблицы.
+        :param max_rows_per_request: Максимальное количество строк диапазонов в одном batch_update.
+        """
+        self.worksheet_name = worksheet_name
+        start_col_letter, start_row_number = re.match(r"([A-Z]+)(\d+)", start_cell).groups()
+        self.start_row = int(start_row_number)
+        self.start_col = GoogleSheetManager.column_letter_to_number(start_col_letter)
+        self.max_rows_per_request = max_rows_per_request
+        # Версия колонок, ширина заголовка и разреженные строки последней записанной таблицы
+        self.previous = None
+
+    async def write(self, sheet_manager: AsyncGoogleSheetManager, data: dict, layout: SheetLayout):
+        """
+        Запись данных на лист.
+
+        :param sheet_manager: Асинхронный менеджер Google Sheets.
+        :param data: Словарь {ID сделки: DealRow}.
+        :param layout: Колонки листа, по которым построены строки.
+        :return: Количество отправленных диапазонов (0 — лист не изменился).
+        """
+        rows = build_grid(data)
+        if self.previous is None:
+            values = await sheet_manager.get_values(self.worksheet_name, self._cell(0, 0))
+            if values:
+                # Версия листа неизвестна: она совпадает с текущей, только если совпал заголовок
+                version = layout.version if tuple(values[0]) == layout.header else None
+                self.previous = (version, len(values[0]), [sparse(row) for row in values[1:]])
+
+        if self.previous is None or self.previous[0] != layout.version:
+            logging.info(f"Колонки листа {self.worksheet_name} изменились, перезаписываем лист целиком.")
+            ranges = self._full_ranges(layout.header, rows)
+        else:
+            ranges = self.diff(self.previous[2], rows, row_offset=1)
+
+        count = 0
+        batch, batch_rows = [], 0
+        for row, col_from, col_to, values in ranges:
+            batch.append({"range": f"{self._cell(row, col_from)}:{self._cell(row + len(values) - 1, col_to)}",
+                          "values": values})
+            batch_rows += len(values)
+            count += 1
+            if batch_rows >= self.max_rows_per_request:
+                await sheet_manager.batch_update(self.worksheet_name, batch)
+                batch, batch_rows = [], 0
+        if batch:
+            await sheet_manager.batch_update(self.worksheet_name, batch)
+
+        logging.info(f"Лист {self.worksheet_name}: обновлено диапазонов {count}.")
+        self.previous = (layout.version, layout.width, rows)
+        return count
+
+    def _full_ranges(self, header, rows):
+        # Новая таблица целиком плюс пустые значения на месте прежней, если она была шире или длиннее;
+        # строки материализуются частями, чтобы не держать весь лист в памяти
+        _, previous_width, previous_rows = self.previous or (None, 0, [])
+        height = max(len(rows), len(previous_rows)) + 1
+        width = max([len(header), previous_width] + [row[-1][0] + 1 for row in previous_rows if row])
+
+        def line(index):
+            if index == 0:
+                return list(header) + [""] * (width - len(header))
+            return dense(rows[index - 1] if index <= len(rows) else (), width)
+
+        for start in range(0, height, self.max_rows_per_request):
+            stop = min(start + self.max_rows_per_request, height)
+            yield start, 0, width - 1, [line(index) for index in range(start, stop)]
+
+    @staticmethod
+    def diff(old, new, row_offset: int = 0):
+        """
+        Минимальные диапазоны для перехода от строк old к строкам new (разреженные строки).
+
+        В каждой строке берется отрезок от первой до последней измененной ячейки;
+        соседние строки с одинаковым отрезком объединяются в один диапазон.
+
+        :param row_offset: Номер строки листа, с которой начинаются строки (1 — после заголовка).
+        :return: Список (строка, первая колонка, последняя колонка, значения).
+        """
+        ranges = []
+        for row in range(max(len(old), len(new))):
+            old_row = old[row] if row < len(old) else ()
+            new_row = new[row] if row < len(new) else ()
+            if old_row == new_row:
+                continue
+            old_cells, new_cells = dict(old_row), dict(new_row)
+            changed = sorted(col for col in old_cells.keys() | new_cells.keys()
+                             if old_cells.get(col, "") != new_cells.get(col, ""))
+            if not changed:
+                continue
+            col_from, col_to = changed[0], changed[-1]
+            values = dense(new_row, col_to + 1, col_from)
+
+            if ranges:
+                last_row, last_from, last_to, last_values = ranges[-1]
+                if (last_from, last_to) == (col_from, col_to) and last_row + len(last_values) == row + row_offset:
+                    last_values.append(values)
+                    continue
+            ranges.append((row + row_offset, col_from, col_to, [values]))
+        return ranges
+
+    def _cell(self, row, col):
+        return f"{GoogleSheetManager.column_number_to_letter(self.start_col + col)}{self.start_row + row}"
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+import numpy as np
+
+from database.repo.stage_event import StageEventRepo
+from starter.working_hours import WorkingCalendar
+
+
+def stage_stats(events, stage_table: dict, calendar: WorkingCalendar, now: datetime):
+    """
+    Время на стадиях по стадиям и врачам в рабочих часах.
+
+    Перцентили считаются по завершенным пребываниям на стадии; просрочкой считается
+    любое пребывание (и текущее), рабочее время которого превысило допустимое.
+
+    :param events: Записи DealStageEvent (или объекты с теми же полями).
+    :param stage_table: STATUS_ID стадии -> (название, допустимое время или None), см. RenderContext.
+    :param calendar: Рабочий календарь.
+    :param now: Текущий момент для незавершенных пребываний.
+    :return: Список словарей stage_id, stage_name, assigned_by_id, count, p50, p95 (секунды или None)
+        и breach_rate (доля просроченных или None, если допустимое время не задано).
+    """
+    events = list(events)
+    if not events:
+        return []
+
+    seconds = calendar.working_seconds_batch([event.entered_at for event in events],
+                                             [event.left_at or now for event in events])
+    groups = {}
+    for event, duration in zip(events, seconds):
+        groups.setdefault((event.stage_id, event.assigned_by_id), []).append((duration, event.left_at is not None))
+
+    stats = []
+    for (stage_id, assigned_by_id), items in groups.items():
+        durations = np.array([duration for duration, _ in items])
+        closed = np.array([duration for duration, finished in items if finished])
+        stage_name, limit = stage_table.get(stage_id, (stage_id, None))
+        p50, p95 = np.percentile(closed, [50, 95]) if closed.size else (None, None)
+        stats.append({
+            "stage_id": stage_id,
+            "stage_name": stage_name,
+            "assigned_by_id": assigned_by_id,
+            "count": len(items),
+            "p50": None if p50 is None else float(p50),
+            "p95": None if p95 is None else float(p95),
+            "breach_rate": float(np.mean(durations > limit.total_seconds())) if limit else None,
+        })
+    return stats
+
+
+async def stage_report(repo: StageEventRepo, category_id: int, stage_table: dict, calendar: WorkingCalendar,
+                       since: datetime, until: datetime = None, now: datetime = None):
+    """
+    Отчет по стадиям воронки за период: читаются только записи периода (секции по месяцам
+    и индекс по категории, стадии и времени входа), без просмотра всей истории.
+
+    :param repo: Репозиторий истории стадий.
+    :param category_id: ID воронки.
+    :param stage_table: STATUS_ID стадии -> (название, допустимое время или None).
+    :param calendar: Рабочий календарь.
+    :param since: Начало периода по времени попадания на стадию.
+    :param until: Конец периода, не включительно.
+    :param now: Текущий момент (по умолчанию сейчас).
+    """
+    events = await repo.get_events(category_id, since, until)
+    return stage_stats(events, stage_table, calendar, now or datetime.now(tz=calendar.tz))
@@ -0,0 +1,136 @@
+import hashlib
+import json
+from collections import OrderedDict
+
+from aiohttp import web
+
+from database.repo.deal import DealRepo
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = 256):
+        """
+        Ответы API для текущей версии данных с вытеснением по LRU.
+
+        Версия — время последней записи в deals; она перечитывается в конце цикла
+        синхронизации, и при ее изменении кэш сбрасывается целиком.
+
+        :param maxsize: Максимальное количество ответов.
+        """
+        self.maxsize = maxsize
+        self.version = None
+        self._responses = OrderedDict()
+
+    def set_version(self, version: str):
+        if version != self.version:
+            self.version = version
+            self._responses.clear()
+
+    def get(self, key):
+        body = self._responses.get(key)
+        if body is not None:
+            self._responses.move_to_end(key)
+        return body
+
+    def put(self, key, body: bytes):
+        self._responses[key] = body
+        self._responses.move_to_end(key)
+        while len(self._responses) > self.maxsize:
+            self._responses.popitem(last=False)
+
+
+response_cache = ResponseCache()
+
+
+async def refresh_version(deal_repo: DealRepo):
+    """Обновление версии данных после цикла синхронизации; если сделки записывались, кэш ответов сбрасывается."""
+    updated_at = await deal_repo.get_version()
+    response_cache.set_version(hashlib.sha1(str(updated_at).encode()).hexdigest()[:16])
+
+
+def parse_query(query, hoppers: dict) -> dict:
+    """
+    Параметры запроса GET /api/deals.
+
+    :param query: Параметры строки запроса: hopper, stage, doctor, overdue, after, limit.
+    :param hoppers: Лист (значение или имя Hopper) -> ID воронки.
+    :return: Аргументы DealRepo.get_page.
+    """
+    def integer(name, default=None):
+        value = query.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise web.HTTPBadRequest(text=f"{name}: ожидается целое число")
+
+    params = {
+        "limit": integer("limit", DEFAULT_LIMIT),
+        "after": integer("after", 0),
+        "stage_id": query.get("stage"),
+        "assigned_by_id": integer("doctor"),
+    }
+    if not 0 < params["limit"] <= MAX_LIMIT:
+        raise web.HTTPBadRequest(text=f"limit: от 1 до {MAX_LIMIT}")
+
+    hopper = query.get("hopper")
+    if hopper is not None:
+        if hopper not in hoppers:
+            raise web.HTTPBadRequest(text=f"hopper: неизвестный лист {hopper}")
+        params["category_id"] = hoppers[hopper]
+
+    overdue = query.get("overdue")
+    if overdue is not None:
+        if overdue.lower() not in ("true", "1", "false", "0"):
+            raise web.HTTPBadRequest(text="overdue: ожидается true или false")
+        params["overdue"] = overdue.lower() in ("true", "1")
+    return params
+
+
+def create_app(deal_repo: DealRepo, funnels: list, cache_size: int = 256) -> web.Application:
+    """
+    Приложение aiohttp с данными сделок из БД на GET /api/deals, без запросов к Bitrix24 и Google Sheets.
+
+    Ответ — страница сделок по возрастанию ID и курсор next_after для следующей страницы.
+    ETag — версия данных: пока цикл синхронизации ничего не записал, If-None-Match
+    получает 304 без обращения к БД, а повторные запросы отдаются из кэша.
+
+    :param deal_repo: Репозиторий сделок.
+    :param funnels: Пары (лист, воронка) для фильтра hopper.
+    :param cache_size: Максимальное количество ответов в кэше.
+    """
+    hoppers = {}
+    for hopper_id, category_id in funnels:
+        hoppers[str(hopper_id)] = hoppers[hopper_id.name] = int(category_id)
+    response_cache.maxsize = cache_size
+
+    async def list_deals(request: web.Request):
+        version = response_cache.version
+        headers = {"ETag": f'"{version}"', "Cache-Control": "no-cache"} if version else {}
+        if version and any(etag.value in (version, "*") for etag in request.if_none_match or ()):
+            return web.Response(status=304, headers=headers)
+
+        params = parse_query(request.query, hoppers)
+        key = tuple(sorted(params.items()))
+        body = response_cache.get(key) if version else None
+        if body is None:
+            rows = await deal_repo.get_page(**params)
+            next_after = rows[-1][0] if len(rows) == params["limit"] else None
+            body = json.dumps({"items": [data for _, data in rows], "next_after": next_after},
+                              ensure_ascii=False).encode()
+            # Версия могла смениться во время запроса: такой ответ не кэшируется
+            if version and response_cache.version == version:
+                response_cache.put(key, body)
+        return web.Response(body=body, content_type="application/json", charset="utf-8", headers=headers)
+
+    async def on_startup(app):
+        await refresh_version(deal_repo)
+
+    app = web.Application()
+    app.router.add_get("/api/deals", list_deals)
+    app.on_startup.append(on_startup)
+    return app
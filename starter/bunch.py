@@ -1,134 +1,138 @@
-import logging
 from datetime import datetime, timedelta
+from functools import cached_property
 
-import pytz
-from babel.dates import format_timedelta
-from pytz import FixedOffset
-from sqlalchemy.ext.asyncio import AsyncEngine
-
-from bitrix_.enums import DealCategory, Hopper
+from bitrix_.cache import BitrixCache
 from bitrix_.manager import BitrixManager
-from database.repo.deal import DealRepo
-from sheet.manager import GoogleSheetManager
-from starter import config
-from starter.config import DotEnv, deal_stages
+from bitrix_.paginator import classify_error as classify_bitrix_error
+from sheet.async_manager import classify_error as classify_sheets_error
+from starter.config import DotEnv
+from starter.render import RenderContext, SlaDeadlines
+from starter.throttle import CircuitBreaker, RetryPolicy, ServiceGuard, TokenBucket
+from starter.working_hours import WorkingCalendar
+
+
+def _bitrix_guard(config):
+    return ServiceGuard(
+        'Bitrix24',
+        TokenBucket(config.BITRIX_RATE_LIMIT, config.BITRIX_RATE_BURST),
+        RetryPolicy(attempts=config.RETRY_ATTEMPTS, max_delay=config.RETRY_MAX_DELAY),
+        CircuitBreaker(config.BREAKER_FAILURES, config.BREAKER_RESET_SECONDS),
+        classify=classify_bitrix_error,
+    )
 
-config = DotEnv()
 
+def _sheets_guard(config):
+    return ServiceGuard(
+        'Google Sheets',
+        TokenBucket(config.SHEETS_RATE_PER_MINUTE / 60, config.SHEETS_RATE_BURST),
+        RetryPolicy(attempts=config.RETRY_ATTEMPTS, max_delay=config.RETRY_MAX_DELAY),
+        CircuitBreaker(config.BREAKER_FAILURES, config.BREAKER_RESET_SECONDS),
+        classify=classify_sheets_error,
+    )
 
-async def fetch_data(list_name):
-    logging.info("Подключаемся к Bitrix...")
-    bitrix_manager = BitrixManager(config.BITRIX_REST_API)
-    logging.info("Получаем данные сделок из Bitrix24...")
-    deals = await bitrix_manager.get_deals_modified_last_days(list_name, days_ago=1)
-    logging.info("Получаем стадии сделок из Bitrix24...")
-    stages = await bitrix_manager.get_stages_for_category(list_name)
-    logging.info("Получаем сотрудников из Bitrix24...")
-    users = await bitrix_manager.get_all_users()
-    return deals, stages, users
 
+def _bitrix_cache(config):
+    # Кэш справочников живет весь процесс и общий для всех воронок
+    return BitrixCache(
+        ttls={
+            'user.get': config.BITRIX_CACHE_USERS_TTL,
+            'crm.dealcategory.stage.list': config.BITRIX_CACHE_STAGES_TTL,
+        },
+        maxsize=config.BITRIX_CACHE_MAXSIZE,
+    )
 
-def calculate_working_hours(delta, start_time, working_start=10, working_end=20):
-    """
-    Рассчитывает количество времени, прошедшего в рамках рабочих часов.
-    delta - разница времени между сейчас и временем перехода сделки на стадию.
-    start_time - время перехода на стадию.
-    working_start - начало рабочего времени (часы).
-    working_end - конец рабочего времени (часы).
-    """
-    total_hours = 0
-    current_time = start_time
 
-    # Перебираем каждый день в диапазоне
-    for day in range(delta.days + 1):
-        day_start = datetime(current_time.year, current_time.month, current_time.day, working_start,
-                             tzinfo=FixedOffset(300))
-        day_end = datetime(current_time.year, current_time.month, current_time.day, working_end,
-                           tzinfo=FixedOffset(300))
+class Services:
+    def __init__(self, **overrides):
+        """
+        Общие объекты процесса, создаваемые при первом обращении: модуль импортируется
+        без настроек окружения (например, в тестах).
 
-        if current_time < day_start:
-            # Если время старта раньше рабочего дня, то начнем с рабочего времени
-            current_time = day_start
-        if current_time > day_end:
-            # Если время старта позже конца рабочего дня, то начнем со следующего дня
-            continue
+        Лимиты и размыкатели общие для всех воронок и вебхука, сроки стадий пересчитываются
+        только при переходе сделки или изменении допустимого времени.
 
-        # Считаем количество рабочих часов за день
-        if current_time < day_end:
-            total_hours += min(delta.total_seconds() / 3600, (day_end - current_time).total_seconds() / 3600)
+        :param overrides: Готовые объекты вместо создаваемых (например, config в тестах).
+        """
+        self.__dict__.update(overrides)
 
-        # Переход на следующий день
-        current_time = day_start + timedelta(days=1)
-        delta -= timedelta(days=1)
+    @cached_property
+    def config(self):
+        return DotEnv()
 
-    return timedelta(hours=total_hours)
+    @cached_property
+    def working_calendar(self):
+        return WorkingCalendar.from_config(self.config)
 
+    @cached_property
+    def bitrix_cache(self):
+        return _bitrix_cache(self.config)
 
-# Обновляем функцию generate_row, чтобы учитывать рабочие часы
-def generate_row(deal, stages, users, now):
-    # Поиск врача
-    user = next((u for u in users if u["ID"] == deal["ASSIGNED_BY_ID"]), {})
-    fullname = f"{user.get('NAME', '')} {user.get('LAST_NAME', '')}"
+    @cached_property
+    def bitrix_guard(self):
+        return _bitrix_guard(self.config)
 
-    # Обработка времени движения по стадии
-    moved_datetime = datetime.fromisoformat(deal["MOVED_TIME"])
-    delta = now - moved_datetime  # Время, прошедшее с момента перехода на стадию
+    @cached_property
+    def sheets_guard(self):
+        return _sheets_guard(self.config)
 
-    # Перерасчет времени с учетом рабочих часов
-    working_delta = calculate_working_hours(delta, moved_datetime)
-    delta_str = format_timedelta(working_delta, locale="ru", format="long")
-
-    # Генерация строки
-    row = {
-        "deal_id": deal["ID"],
-        "doc_name": fullname,
-        "delay": ""
-    }
+    @cached_property
+    def bitrix_manager(self):
+        return BitrixManager(self.config.BITRIX_REST_API, cache=self.bitrix_cache, guard=self.bitrix_guard)
+
+    @cached_property
+    def sla_deadlines(self):
+        return SlaDeadlines(self.working_calendar)
 
-    # Добавляем стадии
-    for stage in stages:
-        stage_name = stage["NAME"]
-        stage_id = stage["STATUS_ID"]
 
-        # Если это текущая стадия сделки
-        if stage_id == deal["STAGE_ID"]:
-            # Проверка, просрочена ли стадия с учетом рабочих часов
-            if stage_name in deal_stages and deal_stages[stage_name] and working_delta > deal_stages[stage_name]:
-                row["delay"] = "Просрочено"
+services = Services()
 
-            # Запись времени, проведенного на стадии
-            row[stage_name] = delta_str
-        else:
-            # Для остальных стадий пустое значение
-            row[stage_name] = ""
 
-    return row
+def calculate_working_hours(delta, start_time, calendar=None):
+    """
+    Рассчитывает количество времени, прошедшего в рамках рабочих часов.
+    delta - разница времени между сейчас и временем перехода сделки на стадию.
+    start_time - время перехода на стадию.
+    calendar - рабочий календарь (по умолчанию из настроек).
+    """
+    calendar = calendar or services.working_calendar
+    return calendar.working_time(start_time, start_time + delta)
 
 
-def generate_matrix(deals, stages, users):
-    now = datetime.now(tz=pytz.FixedOffset(300))
+def generate_row(deal, context: RenderContext, now, working_delta=None, overdue_at=None):
+    # Перерасчет времени с учетом рабочих часов
+    if working_delta is None:
+        moved_datetime = datetime.fromisoformat(deal["MOVED_TIME"])
+        working_delta = calculate_working_hours(now - moved_datetime, moved_datetime)
+    return context.render_row(deal, working_delta, overdue_at, now)
 
-    # Генерация словаря, где ключи — это ID сделки
-    matrix = {deal["ID"]: generate_row(deal, stages, users, now) for deal in deals}
 
-    return matrix
+def generate_rows(deals, context: RenderContext, now, calendar: WorkingCalendar = None, deadlines: list = None):
+    """
+    Строки таблицы для пачки сделок.
 
+    calendar и deadlines передаются при построении в пуле процессов: сроки стадий считаются
+    в процессе планировщика, где живет их кэш, а в пул уходит только построение строк.
 
-async def update_data(engine: AsyncEngine, hopper_id, list_name):
-    logging.info("Составляю таблицу...")
-    deal_repo = DealRepo(engine)
-    deals, stages, users = await fetch_data(list_name)
-    matrix = generate_matrix(deals, stages, users)
+    :param calendar: Рабочий календарь (по умолчанию из настроек).
+    :param deadlines: Моменты просрочки сделок (см. SlaDeadlines.get); по умолчанию из общего кэша процесса.
+    """
+    calendar = calendar or services.working_calendar
+    # Рабочее время на стадии для всей пачки сделок считаем одним проходом
+    moved_times = [datetime.fromisoformat(deal["MOVED_TIME"]) for deal in deals]
+    working_seconds = calendar.working_seconds_batch(moved_times, now)
+    # Просрочка — сравнение с заранее посчитанным сроком стадии
+    if deadlines is None:
+        deadlines = services.sla_deadlines.get(deals, moved_times, context)
 
-    logging.info("Авторизуюсь в google sheets")
+    # Генерация словаря, где ключи — это ID сделки
+    return {
+        deal["ID"]: generate_row(deal, context, now, timedelta(seconds=float(seconds)), deadline)
+        for deal, seconds, deadline in zip(deals, working_seconds, deadlines)
+    }
 
-    google_sheet_manager = GoogleSheetManager(
-        'service_account.json',
-        config.SPREADSHEET_ID
-    )
 
-    for id, data in matrix.items():
-        await deal_repo.create_update_deal(int(id), data)
-    google_sheet_manager.clear_all_data(hopper_id)
-    google_sheet_manager.update_range(hopper_id, "A1", matrix)
-    logging.info("Данные успешно обновлены в Google Sheets.")
+def generate_matrix(deals, stages, users):
+    now = datetime.now(tz=services.working_calendar.tz)
+    # Справочники сотрудников и стадий собираем один раз на цикл
+    context = RenderContext(stages, users)
+    return generate_rows(deals, context, now)
@@ -1,7 +1,11 @@
 import datetime
+import os
+import socket
 
 from environs import Env
 
+from bitrix_.enums import DealCategory, Hopper
+
 
 class DotEnv:
     def __init__(self):
@@ -12,12 +16,73 @@ class DotEnv:
         self.DB_PASSWORD = env.str('DB_PASSWORD')
         self.DB_USER = env.str('DB_USER')
         self.DB_PORT = env.str('DB_PORT')
+        # Пул соединений: размер, переполнение, ожидание и пересоздание в секундах,
+        # проверка соединения перед выдачей и кэш подготовленных выражений asyncpg
+        self.DB_POOL_SIZE = env.int('DB_POOL_SIZE', 5)
+        self.DB_MAX_OVERFLOW = env.int('DB_MAX_OVERFLOW', 5)
+        self.DB_POOL_TIMEOUT = env.float('DB_POOL_TIMEOUT', 30)
+        self.DB_POOL_RECYCLE = env.int('DB_POOL_RECYCLE', 1800)
+        self.DB_POOL_PRE_PING = env.bool('DB_POOL_PRE_PING', True)
+        self.DB_STATEMENT_CACHE_SIZE = env.int('DB_STATEMENT_CACHE_SIZE', 100)
         self.BITRIX_REST_API = env.str('BITRIX_REST_API')
         self.SHEET_KEY = env.str('SHEET_KEY')
         self.SPREADSHEET_ID = env.str("SPREADSHEET_ID")
-
-    def psycopg_url(self):
-        return f"postgresql+psycopg2://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+        # Синхронизируемые воронки: имена из DealCategory, лист — одноименный Hopper
+        self.FUNNELS = [(Hopper[name], DealCategory[name]) for name in env.list('FUNNELS', ["OVK", "OK"])]
+        self.DB_UPSERT_CHUNK_SIZE = env.int('DB_UPSERT_CHUNK_SIZE', 500)
+        # Размер пачки сделок, которая проходит построение строк и запись в БД за раз
+        self.SYNC_CHUNK_SIZE = env.int('SYNC_CHUNK_SIZE', 500)
+        # Потоки для синхронных запросов к Google Sheets
+        self.SHEETS_MAX_WORKERS = env.int('SHEETS_MAX_WORKERS', 2)
+        # Кэш справочников Bitrix24: время жизни в секундах, размер и хранение в БД
+        self.BITRIX_CACHE_USERS_TTL = env.int('BITRIX_CACHE_USERS_TTL', 3600)
+        self.BITRIX_CACHE_STAGES_TTL = env.int('BITRIX_CACHE_STAGES_TTL', 3600)
+        self.BITRIX_CACHE_MAXSIZE = env.int('BITRIX_CACHE_MAXSIZE', 256)
+        self.BITRIX_CACHE_PERSIST = env.bool('BITRIX_CACHE_PERSIST', False)
+        # Лимиты запросов: Bitrix24 — в секунду, Google Sheets — в минуту; повторы и размыкатель
+        self.BITRIX_RATE_LIMIT = env.float('BITRIX_RATE_LIMIT', 2.0)
+        self.BITRIX_RATE_BURST = env.float('BITRIX_RATE_BURST', 10)
+        self.SHEETS_RATE_PER_MINUTE = env.float('SHEETS_RATE_PER_MINUTE', 60)
+        self.SHEETS_RATE_BURST = env.float('SHEETS_RATE_BURST', 10)
+        self.RETRY_ATTEMPTS = env.int('RETRY_ATTEMPTS', 5)
+        self.RETRY_MAX_DELAY = env.float('RETRY_MAX_DELAY', 30)
+        self.BREAKER_FAILURES = env.int('BREAKER_FAILURES', 5)
+        self.BREAKER_RESET_SECONDS = env.float('BREAKER_RESET_SECONDS', 60)
+        # Период цикла синхронизации; при включенном вебхуке цикл становится редкой сверкой
+        self.SYNC_INTERVAL_SECONDS = env.int('SYNC_INTERVAL_SECONDS', 60)
+        self.RECONCILE_INTERVAL_SECONDS = env.int('RECONCILE_INTERVAL_SECONDS', 600)
+        # Прием исходящих вебхуков Bitrix24 (ONCRMDEALADD, ONCRMDEALUPDATE); при включенном вебхуке
+        # WEBHOOK_TOKEN обязателен. HTTP-серверы по умолчанию слушают только локальный интерфейс
+        self.WEBHOOK_ENABLED = env.bool('WEBHOOK_ENABLED', False)
+        self.WEBHOOK_HOST = env.str('WEBHOOK_HOST', "127.0.0.1")
+        self.WEBHOOK_PORT = env.int('WEBHOOK_PORT', 8080)
+        self.WEBHOOK_TOKEN = env.str('WEBHOOK_TOKEN') if self.WEBHOOK_ENABLED else env.str('WEBHOOK_TOKEN', None)
+        self.WEBHOOK_DEBOUNCE_SECONDS = env.float('WEBHOOK_DEBOUNCE_SECONDS', 2.0)
+        # Метрики Prometheus на GET /metrics (отдельный порт)
+        self.METRICS_ENABLED = env.bool('METRICS_ENABLED', False)
+        self.METRICS_HOST = env.str('METRICS_HOST', "127.0.0.1")
+        self.METRICS_PORT = env.int('METRICS_PORT', 9100)
+        # Режим нескольких процессов: воронку обрабатывает процесс, взявший ее рекомендательную
+        # блокировку PostgreSQL (все блокировки процесса на одном соединении вне пула); каждый процесс
+        # держит не больше ceil(воронки / живые процессы). WORKER_ID — имя процесса в журнале и pg_stat_activity
+        self.WORKER_MODE = env.bool('WORKER_MODE', False)
+        self.WORKER_ID = env.str('WORKER_ID', f"{socket.gethostname()}:{os.getpid()}")
+        # Процессы для построения строк; 0 — в процессе планировщика
+        self.ROW_WORKERS = env.int('ROW_WORKERS', 0)
+        # API чтения сделок из БД (GET /api/deals) и размер кэша ответов
+        self.API_ENABLED = env.bool('API_ENABLED', False)
+        self.API_HOST = env.str('API_HOST', "127.0.0.1")
+        self.API_PORT = env.int('API_PORT', 8081)
+        self.API_CACHE_SIZE = env.int('API_CACHE_SIZE', 256)
+        # Период полной сверки сделок с Bitrix24 при инкрементальной синхронизации
+        self.SYNC_FULL_SWEEP_MINUTES = env.int('SYNC_FULL_SWEEP_MINUTES', 60)
+        # Рабочий календарь: окно в часах, смещение пояса в минутах,
+        # выходные (0 — понедельник) и праздники в формате YYYY-MM-DD
+        self.WORKING_START = env.int('WORKING_START', 10)
+        self.WORKING_END = env.int('WORKING_END', 20)
+        self.TZ_OFFSET = env.int('TZ_OFFSET', 300)
+        self.WEEKEND_DAYS = env.list('WEEKEND_DAYS', [], subcast=int)
+        self.HOLIDAYS = [datetime.date.fromisoformat(day) for day in env.list('HOLIDAYS', [])]
 
     def asyncpg_url(self):
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
@@ -0,0 +1,83 @@
+from datetime import timedelta
+from functools import lru_cache
+
+from babel import Locale
+from babel.dates import TIMEDELTA_UNITS
+
+
+class TimedeltaFormatter:
+    def __init__(self, locale: str = "ru", format: str = "long", threshold: float = .85,
+                 granularity: str = "second", cache_size: int = 1024):
+        """
+        Форматирование длительностей с тем же результатом, что babel.dates.format_timedelta.
+
+        Данные локали (шаблоны единиц и правила множественного числа) разбираются один раз.
+        Длительность сводится к корзине (единица, округленное количество), как в Babel,
+        и строка для корзины берется из LRU-кэша: различных строк немного, а вызовов —
+        по одному на сделку в каждом цикле.
+
+        :param locale: Локаль.
+        :param format: Формат: narrow, short или long.
+        :param threshold: Порог перехода к следующей единице, как в Babel.
+        :param granularity: Наименьшая единица.
+        :param cache_size: Размер LRU-кэша строк.
+        """
+        if format not in ("narrow", "short", "long"):
+            raise TypeError('Format must be one of "narrow", "short" or "long"')
+        self.locale = Locale.parse(locale)
+        self.granularity = granularity
+
+        # Единица -> шаблоны по формам множественного числа в порядке поиска Babel:
+        # сначала format, для long и narrow затем short
+        self._patterns = {}
+        for unit, _ in TIMEDELTA_UNITS:
+            unit_patterns = self.locale._data["unit_patterns"].get(f"duration-{unit}", {})
+            formats = (format, "short") if format in ("long", "narrow") else (format,)
+            self._patterns[unit] = [unit_patterns[name] for name in formats if unit_patterns.get(name) is not None]
+
+        self.threshold = threshold
+        # (единица, длительность единицы в секундах) от крупной к мелкой; после granularity единицы не рассматриваются
+        self._units = []
+        for unit, seconds_per_unit in TIMEDELTA_UNITS:
+            self._units.append((unit, seconds_per_unit))
+            if unit == granularity:
+                break
+
+        self._label = lru_cache(maxsize=cache_size)(self._render)
+
+    def format(self, delta) -> str:
+        """
+        Длительность словами, например "3 дня".
+
+        :param delta: timedelta или количество секунд.
+        :return: Строка, совпадающая с format_timedelta для тех же параметров.
+        """
+        if isinstance(delta, timedelta):
+            seconds = int(delta.days * 86400 + delta.seconds)
+        else:
+            seconds = delta
+        seconds = abs(seconds)
+
+        for unit, seconds_per_unit in self._units:
+            # Сравнение в долях единицы, как в Babel: порог, умноженный на секунды, округляется иначе
+            value = seconds / seconds_per_unit
+            if value >= self.threshold or unit == self.granularity:
+                if unit == self.granularity and value > 0:
+                    value = max(1, value)
+                return self._label(unit, int(round(value)))
+        return ""
+
+    def _render(self, unit: str, value: int) -> str:
+        plural_form = self.locale.plural_form(value)
+        for patterns in self._patterns[unit]:
+            pattern = patterns.get(plural_form) or patterns.get("other")
+            if pattern:
+                return pattern.replace("{0}", str(value))
+        return ""
+
+    def cache_info(self):
+        return self._label.cache_info()
+
+
+# Время на стадии в таблице: format_timedelta(..., locale="ru", format="long")
+timedelta_formatter = TimedeltaFormatter(locale="ru", format="long")
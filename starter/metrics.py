@@ -0,0 +1,246 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiohttp import web
+
+# Трассировка текущего цикла и этап, которому засчитываются запросы к API
+current_trace = ContextVar("current_trace", default=None)
+current_phase = ContextVar("current_phase", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels=(), registry=None):
+        """
+        Метрика Prometheus с набором меток.
+
+        :param name: Имя метрики.
+        :param documentation: Описание для # HELP.
+        :param labels: Имена меток.
+        :param registry: Реестр; по умолчанию общий реестр процесса.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        """Пары (суффикс имени, значения меток, значение) для вывода."""
+        for key, value in self._values.items():
+            yield "", key, value
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Summary(Metric):
+    """Сумма и количество наблюдений (summary без квантилей)."""
+    type = "summary"
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        total, count = self._values.get(key, (0, 0))
+        self._values[key] = (total + value, count + 1)
+
+    def samples(self):
+        for key, (total, count) in self._values.items():
+            yield "_sum", key, total
+            yield "_count", key, count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Метрики в текстовом формате Prometheus 0.0.4."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, key, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(metric.labels, key)} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+phase_seconds = Summary("dh_sync_phase_seconds", "Длительность этапов синхронизации", ("phase", "hopper"))
+phase_last_seconds = Gauge("dh_sync_phase_last_seconds", "Длительность этапа в последнем цикле", ("phase", "hopper"))
+phase_rows = Counter("dh_sync_phase_rows_total", "Строки (сделки), обработанные этапом", ("phase", "hopper"))
+dirty_rows = Counter("dh_sync_dirty_rows_total", "Строки, изменившиеся с последней записи в БД", ("hopper",))
+api_calls = Counter("dh_api_calls_total", "Запросы к внешним API", ("service", "method"))
+api_items = Counter("dh_api_items_total", "Записи в ответах Bitrix24 и ячейки в запросах Google Sheets",
+                    ("service", "method"))
+api_errors = Counter("dh_api_errors_total", "Неудачные запросы к внешним API", ("service", "method"))
+cycles = Counter("dh_sync_cycles_total", "Циклы синхронизации по результату", ("kind", "status"))
+cycle_seconds = Summary("dh_sync_cycle_seconds", "Длительность циклов синхронизации", ("kind",))
+funnel_owned = Gauge("dh_worker_funnel_owned", "Воронка обрабатывается этим процессом (WORKER_MODE)", ("hopper",))
+funnel_lock_seconds = Gauge("dh_worker_funnel_lock_seconds", "Время удержания блокировки воронки", ("hopper",))
+cycles_skipped = Counter("dh_sync_cycles_skipped_total",
+                         "Пропущенные запуски цикла: предыдущий еще выполнялся (max_instances=1)")
+
+
+class PhaseRecord:
+    """Итоги одного этапа по одной воронке за цикл."""
+
+    def __init__(self, phase: str, hopper: str):
+        self.phase = phase
+        self.hopper = hopper
+        self.seconds = 0.0
+        self.rows = 0
+        self.calls = {}
+        self.items = {}
+
+    def add_rows(self, count: int):
+        self.rows += count
+        phase_rows.inc(count, phase=self.phase, hopper=self.hopper)
+
+    def to_dict(self) -> dict:
+        return {"phase": self.phase, "hopper": self.hopper, "seconds": round(self.seconds, 3), "rows": self.rows,
+                "calls": self.calls, "items": self.items}
+
+
+class CycleTrace:
+    def __init__(self, kind: str = "cycle"):
+        """
+        Трассировка одного цикла: длительность, строки и запросы к API по этапам и воронкам.
+
+        Этапы одной воронки с одинаковым именем (например, пачки записи в БД) суммируются.
+
+        :param kind: Вид цикла для меток: cycle — регулярный, webhook — по событиям.
+        """
+        self.kind = kind
+        self.records = {}
+        self.started = time.perf_counter()
+        self.status = "ok"
+
+    def record(self, phase: str, hopper) -> PhaseRecord:
+        key = (phase, str(hopper))
+        if key not in self.records:
+            self.records[key] = PhaseRecord(phase, str(hopper))
+        return self.records[key]
+
+    def summary(self) -> dict:
+        return {
+            "kind": self.kind,
+            "status": self.status,
+            "seconds": round(time.perf_counter() - self.started, 3),
+            "phases": [record.to_dict() for record in self.records.values()],
+        }
+
+
+@contextmanager
+def trace_cycle(kind: str = "cycle"):
+    """
+    Трассировка цикла: в конце пишется итоговая строка журнала и метрики цикла.
+
+    Трассировка доступна этапам через контекст, в том числе в задачах, созданных внутри цикла.
+    """
+    trace = CycleTrace(kind)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    except BaseException:
+        trace.status = "error"
+        raise
+    finally:
+        current_trace.reset(token)
+        summary = trace.summary()
+        cycles.inc(kind=kind, status=trace.status)
+        cycle_seconds.observe(summary["seconds"], kind=kind)
+        logging.info(f"Итоги цикла: {json.dumps(summary, ensure_ascii=False)}", extra={"cycle": summary})
+
+
+@contextmanager
+def phase(name: str, hopper="*"):
+    """
+    Замер этапа синхронизации по воронке; запросы к API внутри этапа засчитываются ему.
+
+    :param name: Имя этапа (fetch_data, generate_matrix, db_write, sheets_write, ...).
+    :param hopper: Лист воронки или "*" для общих этапов.
+    :return: PhaseRecord, в который этап добавляет количество строк.
+    """
+    trace = current_trace.get()
+    record = trace.record(name, hopper) if trace is not None else PhaseRecord(name, str(hopper))
+    token = current_phase.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - started
+        current_phase.reset(token)
+        record.seconds += seconds
+        phase_seconds.observe(seconds, phase=record.phase, hopper=record.hopper)
+        phase_last_seconds.set(record.seconds, phase=record.phase, hopper=record.hopper)
+
+
+def record_call(service: str, method: str, items: int = 0, failed: bool = False):
+    """
+    Учет запроса к внешнему API в метриках и в текущем этапе цикла.
+
+    :param service: bitrix или sheets.
+    :param method: Метод API.
+    :param items: Записи в ответе (Bitrix24) или ячейки в запросе (Google Sheets).
+    :param failed: Запрос завершился ошибкой.
+    """
+    api_calls.inc(service=service, method=method)
+    if items:
+        api_items.inc(items, service=service, method=method)
+    if failed:
+        api_errors.inc(service=service, method=method)
+    record = current_phase.get()
+    if record is not None:
+        record.calls[service] = record.calls.get(service, 0) + 1
+        record.items[service] = record.items.get(service, 0) + items
+
+
+def create_app(registry: MetricsRegistry = None) -> web.Application:
+    """Приложение aiohttp с метриками на GET /metrics."""
+    registry = registry or REGISTRY
+
+    async def metrics(request: web.Request):
+        return web.Response(body=registry.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    return app
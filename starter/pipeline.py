@@ -0,0 +1,485 @@
+import asyncio
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from bitrix_.manager import BitrixManager, USERS_PARAMS
+from database.locks import AdvisoryLock, LockConnection
+from database.repo.bitrix_cache import BitrixCacheRepo
+from database.repo.deal import DealRepo
+from database.repo.sheet_layout import SheetLayoutRepo
+from database.repo.stage_event import StageEventRepo
+from sheet.async_manager import AsyncGoogleSheetManager
+from sheet.layout import SheetLayout
+from sheet.writer import SheetDiffWriter
+from starter.api import refresh_version
+from starter import bunch
+from starter.bunch import generate_rows
+from starter.metrics import dirty_rows, funnel_lock_seconds, funnel_owned, phase, trace_cycle
+from starter.render import RenderContext
+from starter.sync import DealSync
+
+# Писатели листов хранят последнюю записанную таблицу между циклами
+sheet_writers = {}
+# Незавершенная запись листа по воронке: выполняется в фоне, параллельно следующей выгрузке
+sheet_tasks = {}
+sheet_locks = {}
+# Последняя таблица и ее колонки для каждого листа: события вебхука обновляют в ней отдельные строки
+sheet_matrices = {}
+# Колонки листов, уже сверенные с сохраненными в БД
+sheet_layouts = {}
+# Синхронизация воронки в процессе: получение сделок, запись в БД и постановка записи листа
+sync_locks = {}
+# Блокировки воронок в режиме нескольких процессов (WORKER_MODE) и соединение, которое их держит
+funnel_locks = {}
+lock_connection = None
+# Пул процессов для построения строк (ROW_WORKERS): создается при первой пачке, останавливается в shutdown
+row_executor = None
+
+
+def get_sheet_manager() -> AsyncGoogleSheetManager:
+    return AsyncGoogleSheetManager.shared(
+        'service_account.json',
+        bunch.services.config.SPREADSHEET_ID,
+        max_workers=bunch.services.config.SHEETS_MAX_WORKERS,
+        guard=bunch.services.sheets_guard,
+    )
+
+
+async def fetch_data(bitrix_manager: BitrixManager, deal_sync: DealSync, categories: list):
+    """
+    Получение справочников и потоков сделок всех воронок.
+
+    Первые страницы сделок всех воронок и устаревшие в кэше справочники запрашиваются
+    одним batch-запросом; сотрудники получаются один раз на цикл для всех воронок.
+
+    :param bitrix_manager: Менеджер Bitrix24.
+    :param deal_sync: Синхронизация сделок.
+    :param categories: ID воронок.
+    :return: Сотрудники и словарь {ID воронки: (стадии, асинхронный генератор страниц сделок)}.
+    """
+    deal_params = await asyncio.gather(*(deal_sync.prepare(category_id) for category_id in categories))
+    paginator = bitrix_manager.paginator
+
+    commands = {}
+    stages = {}
+    for category_id, params in zip(categories, deal_params):
+        commands[f"deals_{category_id}"] = (
+            'crm.deal.list', paginator.page_params('crm.deal.list', params, after=0)
+        )
+        stages[category_id] = bitrix_manager.cached('crm.dealcategory.stage.list', category_id)
+        if stages[category_id] is None:
+            commands[f"stages_{category_id}"] = ('crm.dealcategory.stage.list', {"id": category_id})
+    users = bitrix_manager.cached('user.get')
+    if users is None:
+        commands["users"] = ('user.get', paginator.page_params('user.get', USERS_PARAMS, after=0))
+
+    logging.info(f"Получаем из Bitrix24: {', '.join(commands)}...")
+    results = await bitrix_manager.batch(commands) or {}
+
+    def first_page(name):
+        result = results.get(name)
+        return result.result if result and result.ok else None
+
+    async def load_stages(category_id):
+        if stages[category_id] is not None:
+            return stages[category_id]
+        return await bitrix_manager.get_stages_for_category(
+            category_id, prefetched=first_page(f"stages_{category_id}")
+        )
+
+    if users is None:
+        # Остальные страницы догружаются, только если первая заполнена целиком
+        users = await bitrix_manager.get_all_users(first_page=first_page("users"))
+    all_stages = await asyncio.gather(*(load_stages(category_id) for category_id in categories))
+    streams = {}
+    for category_id, category_stages in zip(categories, all_stages):
+        deal_pages = deal_sync.stream(category_id, first_page=first_page(f"deals_{category_id}"))
+        streams[category_id] = (category_stages, deal_pages)
+    return users, streams
+
+
+@asynccontextmanager
+async def holding_funnels(funnels: list):
+    """
+    Исключительная синхронизация воронок в процессе: регулярный цикл и события вебхука
+    по одной воронке выполняются по очереди от получения сделок до постановки записи листа.
+
+    Блокировки берутся в порядке имен листов, поэтому одновременные вызовы не ждут друг друга по кругу.
+    """
+    async with AsyncExitStack() as stack:
+        for hopper_id in sorted({str(hopper_id) for hopper_id, _ in funnels}):
+            await stack.enter_async_context(sync_locks.setdefault(hopper_id, asyncio.Lock()))
+        yield
+
+
+def forget_funnel(hopper_id, category_id):
+    """
+    Сброс состояния листа воронки в процессе: пока воронку обрабатывал другой процесс,
+    лист, его колонки и строки сделок в БД могли измениться.
+    """
+    sheet_writers.pop(hopper_id, None)
+    sheet_matrices.pop(hopper_id, None)
+    sheet_layouts.pop(hopper_id, None)
+    DealRepo.forget_category(category_id)
+
+
+def owns_funnel(hopper_id) -> bool:
+    lock = funnel_locks.get(hopper_id)
+    return lock is not None and lock.held
+
+
+async def owned_funnels(engine: AsyncEngine, funnels: list) -> list:
+    """
+    Воронки, которые обрабатывает этот процесс в режиме WORKER_MODE.
+
+    Блокировка воронки удерживается между циклами, пока процесс и его соединение живы:
+    лист пишет один процесс, и состояние писателя и хэши строк остаются верными.
+    Процесс держит не больше справедливой доли воронок — ceil(воронки / живые процессы):
+    свободные воронки (их процесс остановился) берутся в начале цикла до этой доли,
+    а воронки сверх доли (запустился новый процесс) отпускаются, и их берут другие процессы.
+
+    :param engine: Асинхронный движок БД.
+    :param funnels: Пары (лист, воронка).
+    :return: Пары (лист, воронка), блокировки которых удерживает процесс.
+    """
+    global lock_connection
+    if lock_connection is None:
+        lock_connection = LockConnection(engine, bunch.services.config.WORKER_ID)
+    workers = await lock_connection.live_workers()
+    share = math.ceil(len(funnels) / max(workers, 1))
+
+    held = []
+    for hopper_id, category_id in funnels:
+        lock = funnel_locks.get(hopper_id)
+        if lock is None:
+            lock = funnel_locks[hopper_id] = AdvisoryLock(lock_connection, int(category_id), f"воронки {hopper_id}")
+        if lock.held and not await lock.check():
+            forget_funnel(hopper_id, category_id)
+        if lock.held:
+            held.append((hopper_id, category_id))
+
+    owned = held[:share]
+    for hopper_id, category_id in held[share:]:
+        # Событие вебхука по воронке дорабатывает до конца, прежде чем ее возьмет другой процесс
+        async with holding_funnels([(hopper_id, category_id)]):
+            await funnel_locks[hopper_id].release()
+        forget_funnel(hopper_id, category_id)
+    for hopper_id, category_id in funnels:
+        if len(owned) >= share:
+            break
+        lock = funnel_locks[hopper_id]
+        if not lock.held and await lock.acquire():
+            # Воронку до этого мог обрабатывать другой процесс
+            forget_funnel(hopper_id, category_id)
+            owned.append((hopper_id, category_id))
+
+    owned = [funnel for funnel in funnels if funnel in owned]
+    for hopper_id, _ in funnels:
+        funnel_owned.set(int(funnel_locks[hopper_id].held), hopper=str(hopper_id))
+        funnel_lock_seconds.set(funnel_locks[hopper_id].held_seconds(), hopper=str(hopper_id))
+    held = ", ".join(f"{hopper_id} ({funnel_locks[hopper_id].held_seconds():.0f} с)" for hopper_id, _ in owned)
+    logging.info(f"Воронки процесса {bunch.services.config.WORKER_ID} ({len(owned)} из {len(funnels)}, "
+                 f"процессов: {workers}): {held or 'нет'}.")
+    return owned
+
+
+async def shutdown():
+    """Завершение записи листов, снятие блокировок воронок и остановка пула построения строк."""
+    global lock_connection, row_executor
+    await asyncio.gather(*sheet_tasks.values(), return_exceptions=True)
+    for lock in funnel_locks.values():
+        await lock.release()
+    if lock_connection is not None:
+        await lock_connection.close()
+        lock_connection = None
+    if row_executor is not None:
+        row_executor.shutdown(cancel_futures=True)
+        row_executor = None
+
+
+async def funnel_layout(engine: AsyncEngine, hopper_id, stages) -> SheetLayout:
+    """
+    Колонки листа воронки по стадиям Bitrix24.
+
+    Колонки строятся из стадий заново (стадии берутся из кэша), но в БД сохраняются
+    только при изменении версии; прежний объект переиспользуется, пока версия та же.
+    """
+    layout = SheetLayout(stages)
+    cached = sheet_layouts.get(hopper_id)
+    if cached is not None and cached.version == layout.version:
+        return cached
+
+    repo = SheetLayoutRepo(engine)
+    stored = cached.version if cached is not None else await repo.get_version(hopper_id)
+    if stored != layout.version:
+        logging.info(f"Колонки листа {hopper_id} изменились: {stored} -> {layout.version}.")
+        await repo.save(hopper_id, layout)
+    sheet_layouts[hopper_id] = layout
+    return layout
+
+
+async def rechunk(pages, size: int):
+    """Асинхронный генератор пачек сделок фиксированного размера из страниц Bitrix24."""
+    chunk = []
+    async for page in pages:
+        chunk.extend(page)
+        while len(chunk) >= size:
+            yield chunk[:size]
+            chunk = chunk[size:]
+    if chunk:
+        yield chunk
+
+
+async def render_rows(deals, context: RenderContext, now) -> dict:
+    """
+    Построение строк в процессе планировщика или, при ROW_WORKERS, в пуле процессов.
+
+    Сроки стадий всегда считаются здесь: кэш SlaDeadlines живет в процессе планировщика,
+    а копия в дочернем процессе терялась бы после каждой пачки.
+    """
+    global row_executor
+    if not bunch.services.config.ROW_WORKERS:
+        return generate_rows(deals, context, now)
+    if row_executor is None:
+        row_executor = ProcessPoolExecutor(max_workers=bunch.services.config.ROW_WORKERS)
+    moved_times = [datetime.fromisoformat(deal["MOVED_TIME"]) for deal in deals]
+    deadlines = bunch.services.sla_deadlines.get(deals, moved_times, context)
+    return await asyncio.get_running_loop().run_in_executor(row_executor, generate_rows, deals, context, now,
+                                                            bunch.services.working_calendar, deadlines)
+
+
+async def build_matrix(engine: AsyncEngine, hopper_id, category_id, deal_pages, context: RenderContext, now):
+    """
+    Построение строк таблицы пачками по мере получения страниц сделок.
+
+    Каждая пачка сразу записывается в БД; в памяти остаются только компактные
+    строки DealRow для листа, а не сделки и словари со всеми стадиями.
+    Ожидание страниц, построение строк и запись в БД замеряются как отдельные этапы.
+
+    :return: Словарь {ID сделки: DealRow}, упорядоченный по ID сделки.
+    """
+    matrix = {}
+    chunks = rechunk(deal_pages, bunch.services.config.SYNC_CHUNK_SIZE)
+    while True:
+        with phase("fetch_deals", hopper_id) as record:
+            deals = await anext(chunks, None)
+            if deals is None:
+                break
+            record.add_rows(len(deals))
+        with phase("generate_matrix", hopper_id) as record:
+            rows = await render_rows(deals, context, now)
+            record.add_rows(len(rows))
+        with phase("db_write", hopper_id) as record:
+            dirty = await store_rows(engine, category_id, rows)
+            record.add_rows(dirty)
+            dirty_rows.inc(dirty, hopper=str(hopper_id))
+        matrix.update(rows)
+    return dict(sorted(matrix.items(), key=lambda item: int(item[0])))
+
+
+async def sync_funnel(engine: AsyncEngine, deal_sync: DealSync, sheet_manager: AsyncGoogleSheetManager,
+                      hopper_id, category_id, users, stages, deal_pages, now):
+    """
+    Обработка одной воронки: пачки сделок проходят построение строк и запись в БД,
+    затем таблица в фоне записывается на лист.
+
+    Отметка синхронизации сохраняется только после записи всех сделок в БД. Если справочники получить не удалось
+    (Bitrix24 недоступен и в кэше ничего нет), воронка пропускает цикл: лист и БД
+    остаются с последними успешными данными.
+    """
+    if stages is None or users is None:
+        logging.warning(f"Нет справочников Bitrix24, таблица {hopper_id} оставлена с последними данными.")
+        await deal_pages.aclose()
+        return 0
+
+    logging.info(f"Составляю таблицу {hopper_id}...")
+    layout = await funnel_layout(engine, hopper_id, stages)
+    context = RenderContext(stages, users, layout=layout)
+    matrix = await build_matrix(engine, hopper_id, category_id, deal_pages, context, now)
+
+    await deal_sync.commit(category_id)
+    await schedule_sheet_write(hopper_id, sheet_manager, matrix, layout)
+    return len(matrix)
+
+
+async def store_rows(engine: AsyncEngine, category_id, rows: dict):
+    """
+    Запись измененных строк сделок (DealRow) в БД и смен стадий в историю deal_stage_events.
+
+    Строки, хэш которых совпадает с записанным, пропускаются: без изменений запросов на запись нет.
+    Смены стадий записываются раньше строк: хэш сохраняется только после истории, и при ошибке
+    записи истории строки остаются измененными до следующего цикла (повторная запись истории
+    тех же переходов ничего не добавляет).
+
+    :param category_id: ID воронки, к которой относятся строки.
+    :return: Количество измененных строк.
+    """
+    deal_repo = DealRepo(engine)
+    fingerprints = {deal_id: row.fingerprint() for deal_id, row in rows.items()}
+    dirty = await deal_repo.changed(category_id, fingerprints)
+    if not dirty:
+        return 0
+
+    data = {deal_id: rows[deal_id].to_data() for deal_id in dirty}
+    events = await StageEventRepo(engine).record(data)
+    await deal_repo.bulk_upsert(data, chunk_size=bunch.services.config.DB_UPSERT_CHUNK_SIZE,
+                                fingerprints={deal_id: fingerprints[deal_id] for deal_id in dirty})
+    if events:
+        logging.info(f"Записано переходов по стадиям: {events}.")
+    return len(dirty)
+
+
+async def schedule_sheet_write(hopper_id, sheet_manager: AsyncGoogleSheetManager, matrix: dict,
+                               layout: SheetLayout):
+    # Записи одного листа идут строго по очереди: писатель сравнивает с предыдущей таблицей
+    async with sheet_locks.setdefault(hopper_id, asyncio.Lock()):
+        previous_task = sheet_tasks.get(hopper_id)
+        if previous_task is not None and not previous_task.done():
+            await previous_task
+        sheet_writer = sheet_writers.setdefault(hopper_id, SheetDiffWriter(hopper_id, "A1"))
+        previous = sheet_matrices.get(hopper_id)
+        if (sheet_writer.previous is not None and previous is not None
+                and previous[1].version == layout.version and previous[0] == matrix):
+            # Последняя запись прошла успешно и таблица та же: запросов к Google Sheets нет
+            logging.info(f"Таблица {hopper_id} не изменилась, запись на лист не нужна.")
+            return
+        sheet_matrices[hopper_id] = (matrix, layout)
+        sheet_tasks[hopper_id] = asyncio.create_task(write_sheet(sheet_writer, sheet_manager, matrix, layout))
+
+
+async def write_sheet(sheet_writer: SheetDiffWriter, sheet_manager: AsyncGoogleSheetManager, matrix: dict,
+                      layout: SheetLayout):
+    """Запись таблицы на лист в фоне; ошибка записи не прерывает следующие циклы."""
+    try:
+        # Запись идет в фоне и может завершиться после итогов цикла; этап виден в метриках
+        with phase("sheets_write", sheet_writer.worksheet_name) as record:
+            await sheet_writer.write(sheet_manager, matrix, layout)
+            record.add_rows(len(matrix))
+        logging.info(f"Данные листа {sheet_writer.worksheet_name} успешно обновлены в Google Sheets "
+                     f"за {record.seconds:.1f} с.")
+    except Exception as e:
+        logging.exception(f"Не удалось обновить лист {sheet_writer.worksheet_name}: {e}")
+        # Состояние листа неизвестно — при следующей записи перечитываем его
+        sheet_writer.previous = None
+
+
+async def run_cycle(engine: AsyncEngine, funnels: list = None):
+    """
+    Один цикл синхронизации всех воронок.
+
+    Справочники и первые страницы запрашиваются общим batch-запросом, дальше воронки
+    обрабатываются параллельно; ошибка одной воронки не прерывает остальные.
+    В режиме WORKER_MODE обрабатываются только воронки, блокировки которых удерживает процесс.
+
+    :param engine: Асинхронный движок БД.
+    :param funnels: Пары (лист, воронка); по умолчанию из настройки FUNNELS.
+    """
+    with trace_cycle("cycle") as trace:
+        funnels = funnels or bunch.services.config.FUNNELS
+        if bunch.services.config.WORKER_MODE:
+            funnels = await owned_funnels(engine, funnels)
+            if not funnels:
+                # Сделки пишут другие процессы: версия данных API все равно обновляется
+                if bunch.services.config.API_ENABLED:
+                    await refresh_version(DealRepo(engine))
+                return
+        # Регулярный цикл и события вебхука не обрабатывают одну воронку одновременно
+        async with holding_funnels(funnels):
+            if bunch.services.config.BITRIX_CACHE_PERSIST and bunch.services.bitrix_cache.store is None:
+                bunch.services.bitrix_cache.store = BitrixCacheRepo(engine)
+            config = bunch.services.config
+            deal_sync = DealSync(bunch.services.bitrix_manager, engine, bunch.services.working_calendar.tz,
+                                 full_sweep_interval=timedelta(minutes=config.SYNC_FULL_SWEEP_MINUTES),
+                                 chunk_size=config.SYNC_CHUNK_SIZE)
+            sheet_manager = get_sheet_manager()
+
+            with phase("fetch_data"):
+                categories = [category_id for _, category_id in funnels]
+                users, streams = await fetch_data(bunch.services.bitrix_manager, deal_sync, categories)
+            now = datetime.now(tz=bunch.services.working_calendar.tz)
+            results = await asyncio.gather(*(
+                sync_funnel(engine, deal_sync, sheet_manager, hopper_id, category_id, users, *streams[category_id],
+                            now)
+                for hopper_id, category_id in funnels
+            ), return_exceptions=True)
+
+            for (hopper_id, _), result in zip(funnels, results):
+                if isinstance(result, BaseException):
+                    trace.status = "error"
+                    logging.error(f"Ошибка синхронизации воронки {hopper_id}", exc_info=result)
+                else:
+                    logging.info(f"Воронка {hopper_id}: строк {result}.")
+        logging.info(f"Кэш Bitrix24: {bunch.services.bitrix_cache.stats()}")
+        if bunch.services.config.API_ENABLED:
+            await refresh_version(DealRepo(engine))
+
+
+async def sync_deals(engine: AsyncEngine, deal_ids: list, funnels: list = None):
+    """
+    Обновление отдельных сделок по событиям Bitrix24 без полной выгрузки воронок.
+
+    Сделки запрашиваются через crm.deal.get, их строки записываются в БД и заменяют
+    строки в последней таблице листа; сделки, ушедшие из воронки, удаляются с листа.
+    Отметка синхронизации не меняется: полный набор сверяет регулярный цикл.
+
+    :param engine: Асинхронный движок БД.
+    :param deal_ids: ID измененных сделок.
+    :param funnels: Пары (лист, воронка); по умолчанию из настройки FUNNELS.
+    """
+    funnels = funnels or bunch.services.config.FUNNELS
+    if bunch.services.config.WORKER_MODE:
+        # Сделки воронок других процессов обновит их регулярный цикл
+        funnels = [(hopper_id, category_id) for hopper_id, category_id in funnels if owns_funnel(hopper_id)]
+        if not funnels:
+            return
+    deal_repo = DealRepo(engine)
+    # Строки, построенные из более старых данных цикла, не перезапишут строки событий
+    async with holding_funnels(funnels):
+        deals = await bunch.services.bitrix_manager.get_deals(deal_ids)
+        if deals is None:
+            logging.error(f"Не удалось получить сделки {deal_ids}, их обновит регулярный цикл.")
+            return
+        logging.info(f"Обновляю по событиям сделки: {', '.join(deal['ID'] for deal in deals)}.")
+
+        sheet_manager = get_sheet_manager()
+        users = await bunch.services.bitrix_manager.get_all_users()
+        if users is None:
+            logging.error(f"Нет списка сотрудников, сделки {deal_ids} обновит регулярный цикл.")
+            return
+        now = datetime.now(tz=bunch.services.working_calendar.tz)
+
+        for hopper_id, category_id in funnels:
+            funnel_deals = [deal for deal in deals if str(deal.get("CATEGORY_ID")) == str(category_id)]
+            left = [deal["ID"] for deal in deals if deal not in funnel_deals]
+            rows, layout = {}, None
+            if funnel_deals:
+                stages = await bunch.services.bitrix_manager.get_stages_for_category(category_id)
+                if stages is None:
+                    logging.error(f"Нет стадий воронки {hopper_id}, сделки обновит регулярный цикл.")
+                    continue
+                layout = await funnel_layout(engine, hopper_id, stages)
+                rows = generate_rows(funnel_deals, RenderContext(stages, users, layout=layout), now)
+                await store_rows(engine, category_id, rows)
+            # Снимаются только сделки, которые были в этой воронке; хэши строк других воронок остаются
+            await deal_repo.detach_from_category(category_id, left)
+
+            if hopper_id not in sheet_matrices:
+                # Лист еще не записывался в этом процессе — его заполнит регулярный цикл
+                continue
+            previous, previous_layout = sheet_matrices[hopper_id]
+            if layout is not None and layout.version != previous_layout.version:
+                # Строки прежней таблицы построены по другим колонкам — лист перестроит регулярный цикл
+                continue
+            matrix = {deal_id: row for deal_id, row in previous.items() if deal_id not in left}
+            if rows or len(matrix) != len(previous):
+                matrix.update(rows)
+                matrix = dict(sorted(matrix.items(), key=lambda item: int(item[0])))
+                await schedule_sheet_write(hopper_id, sheet_manager, matrix, previous_layout)
+
+    if bunch.services.config.API_ENABLED:
+        await refresh_version(deal_repo)
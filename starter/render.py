@@ -0,0 +1,212 @@
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+
+from sheet.layout import SheetLayout
+from starter.config import deal_stages
+from starter.formatting import timedelta_formatter
+
+# Колонки таблицы перед стадиями
+BASE_FIELDS = ("deal_id", "doc_name", "delay")
+# Служебные поля строки, которые хранятся в БД, но не выводятся в таблицу,
+# и соответствующие им поля сделки Bitrix24
+META_FIELDS = {
+    "stage_id": "STAGE_ID",
+    "category_id": "CATEGORY_ID",
+    "assigned_by_id": "ASSIGNED_BY_ID",
+    "moved_time": "MOVED_TIME",
+    "date_modify": "DATE_MODIFY",
+}
+
+
+def deal_from_row(data: dict):
+    """
+    Восстановление сделки в формате Bitrix24 из сохраненной в БД строки.
+
+    :param data: Данные строки из Deal.data.
+    :return: Сделка или None, если строка сохранена без служебных полей.
+    """
+    if not data.get("moved_time") or not data.get("stage_id"):
+        return None
+    deal = {field: data.get(key) for key, field in META_FIELDS.items()}
+    deal["ID"] = data["deal_id"]
+    return deal
+
+
+class DealRow:
+    """
+    Строка таблицы в компактном виде: базовые и служебные поля и единственная
+    заполненная ячейка стадии (с номером ее колонки по SheetLayout) вместо словаря
+    со всеми стадиями воронки.
+    """
+    __slots__ = ("deal_id", "doc_name", "delay", "stage_name", "stage_column", "stage_value",
+                 "overdue_at") + tuple(META_FIELDS)
+
+    def __init__(self, deal_id, doc_name="", delay="", stage_name=None, stage_column=None, stage_value="",
+                 overdue_at="", **meta):
+        self.deal_id = deal_id
+        self.doc_name = doc_name
+        self.delay = delay
+        self.stage_name = stage_name
+        self.stage_column = stage_column
+        self.stage_value = stage_value
+        # Момент просрочки на текущей стадии (ISO) или "", если допустимое время не задано
+        self.overdue_at = overdue_at
+        for key in META_FIELDS:
+            setattr(self, key, meta.get(key) or "")
+
+    def to_data(self) -> dict:
+        """Данные для Deal.data: базовые и служебные поля, срок стадии и время на текущей стадии."""
+        data = {key: getattr(self, key) for key in BASE_FIELDS + tuple(META_FIELDS) + ("overdue_at",)}
+        if self.stage_name is not None:
+            data[self.stage_name] = self.stage_value
+        return data
+
+    def fingerprint(self) -> str:
+        """
+        Хэш содержимого строки: данные для БД и значения ячеек листа.
+
+        Номер колонки не учитывается — смену колонок отслеживает версия SheetLayout.
+        """
+        keys = BASE_FIELDS + ("stage_name", "stage_value", "overdue_at") + tuple(META_FIELDS)
+        values = tuple(getattr(self, key) for key in keys)
+        return hashlib.blake2b(repr(values).encode(), digest_size=8).hexdigest()
+
+    def cells(self) -> tuple:
+        """
+        Непустые ячейки строки листа.
+
+        :return: Кортеж пар (номер колонки, значение) по возрастанию номера.
+        """
+        cells = tuple((index, str(value)) for index, value in
+                      enumerate((self.deal_id, self.doc_name, self.delay)) if value != "")
+        if self.stage_column is not None and self.stage_value != "":
+            cells += ((self.stage_column, str(self.stage_value)),)
+        return cells
+
+    def __eq__(self, other):
+        return isinstance(other, DealRow) and all(
+            getattr(self, key) == getattr(other, key) for key in self.__slots__
+        )
+
+    def __repr__(self):
+        return f"DealRow({self.to_data()!r})"
+
+
+class RenderContext:
+    def __init__(self, stages, users, sla=None, layout: SheetLayout = None):
+        """
+        Контекст построения строк таблицы, собираемый один раз за цикл.
+
+        :param stages: Стадии воронки (crm.dealcategory.stage.list).
+        :param users: Сотрудники (user.get).
+        :param sla: Допустимое время на стадиях по названию стадии (по умолчанию deal_stages).
+        :param layout: Колонки листа воронки; по умолчанию строятся по stages.
+        """
+        sla = deal_stages if sla is None else sla
+        self.layout = layout or SheetLayout(stages)
+
+        # ID сотрудника -> ФИО врача
+        self.user_names = {
+            user["ID"]: f"{user.get('NAME', '')} {user.get('LAST_NAME', '')}"
+            for user in users
+        }
+        # STATUS_ID стадии -> (название, допустимое время или None)
+        self.stage_table = {
+            stage["STATUS_ID"]: (stage["NAME"], sla.get(stage["NAME"]) or None)
+            for stage in stages
+        }
+        # STATUS_ID стадии -> (название, допустимое время, номер колонки): один поиск на строку
+        self._stages = {
+            stage_id: (stage_name, limit, self.layout.columns.get(stage_id))
+            for stage_id, (stage_name, limit) in self.stage_table.items()
+        }
+
+    def render_row(self, deal, working_delta, overdue_at: datetime = None, now: datetime = None):
+        """
+        Строка таблицы для сделки.
+
+        :param deal: Сделка из Bitrix24.
+        :param working_delta: Рабочее время, проведенное на текущей стадии.
+        :param overdue_at: Момент просрочки на стадии (см. SlaDeadlines); если передан,
+            просрочка определяется сравнением с now, а не пересчетом рабочего времени.
+        :param now: Текущий момент, обязателен вместе с overdue_at.
+        :return: Строка DealRow.
+        """
+        # Для неизвестного сотрудника имя остается пустым (" "), как и раньше
+        row = DealRow(deal["ID"], self.user_names.get(deal["ASSIGNED_BY_ID"], " "),
+                      **{key: deal.get(field) for key, field in META_FIELDS.items()})
+
+        stage = self._stages.get(deal["STAGE_ID"])
+        if stage:
+            stage_name, limit, row.stage_column = stage
+            # Проверка, просрочена ли стадия с учетом рабочих часов
+            if overdue_at is not None:
+                row.overdue_at = overdue_at.isoformat()
+                overdue = now > overdue_at
+            else:
+                overdue = limit and working_delta > limit
+            if overdue:
+                row.delay = "Просрочено"
+            # Запись времени, проведенного на стадии
+            row.stage_name = stage_name
+            row.stage_value = timedelta_formatter.format(working_delta)
+
+        return row
+
+
+class SlaDeadlines:
+    def __init__(self, calendar, maxsize: int = 100_000):
+        """
+        Моменты просрочки сделок на текущих стадиях: допустимое время стадии,
+        отложенное от MOVED_TIME по рабочему календарю.
+
+        Срок считается один раз на переход: для каждой сделки запоминаются стадия,
+        время перехода и допустимое время, по которым он посчитан, и пересчитываются
+        только сделки, у которых что-то из этого изменилось (переход или правка deal_stages).
+        Сроки сделок, давно не приходивших из Bitrix24, вытесняются по LRU.
+
+        :param calendar: Рабочий календарь (WorkingCalendar).
+        :param maxsize: Максимальное количество запомненных сделок.
+        """
+        self.calendar = calendar
+        self.maxsize = maxsize
+        # ID сделки -> ((стадия, время перехода, допустимое время), момент просрочки)
+        self._deadlines = OrderedDict()
+
+    def get(self, deals, moved_times, context: RenderContext) -> list:
+        """
+        Моменты просрочки для пачки сделок; новые сроки считаются одним проходом NumPy.
+
+        :param deals: Сделки из Bitrix24.
+        :param moved_times: MOVED_TIME сделок (datetime).
+        :param context: Контекст с допустимым временем стадий.
+        :return: Список datetime или None для стадий без допустимого времени.
+        """
+        deadlines = [None] * len(deals)
+        missing = []
+        for index, (deal, moved) in enumerate(zip(deals, moved_times)):
+            _, limit = context.stage_table.get(deal["STAGE_ID"], (None, None))
+            if not limit:
+                # Стадия без допустимого времени: прежний срок больше не нужен
+                self._deadlines.pop(deal["ID"], None)
+                continue
+            key = (deal["STAGE_ID"], moved, limit)
+            cached = self._deadlines.get(deal["ID"])
+            if cached is not None and cached[0] == key:
+                self._deadlines.move_to_end(deal["ID"])
+                deadlines[index] = cached[1]
+            else:
+                missing.append((index, key))
+
+        if missing:
+            epochs = self.calendar.add_working_seconds_batch([key[1] for _, key in missing],
+                                                             [key[2].total_seconds() for _, key in missing])
+            for (index, key), epoch in zip(missing, epochs):
+                deadline = datetime.fromtimestamp(float(epoch), tz=self.calendar.tz)
+                self._deadlines[deals[index]["ID"]] = (key, deadline)
+                self._deadlines.move_to_end(deals[index]["ID"])
+                deadlines[index] = deadline
+            while len(self._deadlines) > self.maxsize:
+                self._deadlines.popitem(last=False)
+        return deadlines
@@ -0,0 +1,153 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from bitrix_.manager import BitrixManager
+from database.repo.deal import DealRepo
+from database.repo.sync_state import SyncStateRepo
+from starter.render import deal_from_row
+
+
+class DealSync:
+    def __init__(self, bitrix_manager: BitrixManager, engine: AsyncEngine, portal_tz: timezone,
+                 days_ago: int = 1, full_sweep_interval: timedelta = timedelta(hours=1), chunk_size: int = 500,
+                 deal_repo: DealRepo = None, state_repo: SyncStateRepo = None):
+        """
+        Инкрементальная синхронизация сделок по отметке DATE_MODIFY.
+
+        Каждый цикл из Bitrix24 запрашиваются только сделки, измененные с последней отметки,
+        остальные отслеживаемые сделки берутся из таблицы deals. Раз в full_sweep_interval
+        выполняется полная сверка за последние days_ago дней.
+
+        :param bitrix_manager: Менеджер Bitrix24.
+        :param engine: Асинхронный движок БД.
+        :param portal_tz: Часовой пояс портала для фильтра по DATE_MODIFY.
+        :param days_ago: Сделки, измененные за это количество дней, выводятся в таблицу.
+        :param full_sweep_interval: Период полной сверки с Bitrix24.
+        :param chunk_size: Количество сделок из БД в одной пачке.
+        :param deal_repo: Репозиторий сделок (по умолчанию по engine).
+        :param state_repo: Репозиторий отметок (по умолчанию по engine).
+        """
+        self.bitrix_manager = bitrix_manager
+        self.deal_repo = deal_repo or DealRepo(engine)
+        self.state_repo = state_repo or SyncStateRepo(engine)
+        self.portal_tz = portal_tz
+        self.days_ago = days_ago
+        self.full_sweep_interval = full_sweep_interval
+        self.chunk_size = chunk_size
+        # Выбранные запросы и новые отметки, которые сохраняются только после записи сделок
+        self._plans = {}
+        self._pending = {}
+
+    async def prepare(self, category_id: int):
+        """
+        Выбор запроса сделок воронки на этот цикл: полная сверка или изменения с отметки.
+
+        :param category_id: ID воронки.
+        :return: Параметры crm.deal.list (например, для первой страницы в batch).
+        """
+        now = datetime.now(timezone.utc)
+        state = await self.state_repo.get(category_id)
+        full_sweep = (state is None or state.watermark is None or state.full_sync_at is None
+                      or now - state.full_sync_at >= self.full_sweep_interval)
+
+        if full_sweep:
+            # Окно сверки в Bitrix24 и выборка из БД в stream отсчитываются от одного момента now:
+            # иначе сделки между границами окон ошибочно снимались бы с воронки
+            since = (now - timedelta(days=self.days_ago)).astimezone(self.portal_tz)
+            logging.info(f"Полная сверка сделок воронки {category_id} с {since}...")
+            params = self.bitrix_manager.deals_modified_since_params(category_id, since)
+        else:
+            since = state.watermark.astimezone(self.portal_tz)
+            logging.info(f"Получаем сделки воронки {category_id}, измененные с {since}...")
+            params = self.bitrix_manager.deals_modified_since_params(category_id, since)
+
+        self._plans[category_id] = (now, state, full_sweep, params)
+        return params
+
+    async def stream(self, category_id: int, first_page: list = None):
+        """
+        Асинхронный генератор текущего набора отслеживаемых сделок воронки.
+
+        Сначала по мере получения отдаются страницы измененных сделок из Bitrix24,
+        затем пачками по chunk_size — остальные отслеживаемые сделки из БД. От страниц
+        Bitrix24 остаются только ID и DATE_MODIFY: в памяти не больше одной страницы или пачки.
+
+        :param category_id: ID воронки.
+        :param first_page: Первая страница запроса из prepare, если она уже получена.
+        :return: Генератор списков сделок в формате Bitrix24.
+        """
+        if category_id not in self._plans:
+            await self.prepare(category_id)
+        now, state, full_sweep, params = self._plans.pop(category_id)
+        pages = self.bitrix_manager.iter_deals(params, first_page=first_page)
+
+        # (ID, DATE_MODIFY) измененных сделок для сдвига отметки
+        changed = []
+        seen = set(state.last_ids) if state and not full_sweep else set()
+        try:
+            async for page in pages:
+                # Сделки на самой отметке уже обработаны в прошлом цикле
+                page = [
+                    deal for deal in page
+                    if not (int(deal["ID"]) in seen and datetime.fromisoformat(deal["DATE_MODIFY"]) == state.watermark)
+                ]
+                changed.extend((int(deal["ID"]), datetime.fromisoformat(deal["DATE_MODIFY"])) for deal in page)
+                if page:
+                    yield page
+        except Exception as e:
+            # Bitrix24 недоступен: дополняем тем, что уже сохранено, и не сдвигаем отметку
+            logging.warning(f"Не удалось получить сделки воронки {category_id}, используем данные из БД: {e}")
+            full_sweep = False
+        else:
+            pending = self._advance(state, changed, now if full_sweep else None)
+            if state is None or pending != (state.watermark, sorted(state.last_ids), None):
+                # Отметка сохраняется, только если сдвинулась
+                self._pending[category_id] = pending
+
+        changed_ids = {deal_id for deal_id, _ in changed}
+        stored_count = 0
+        tracked = self.deal_repo.iter_tracked(category_id, now - timedelta(days=self.days_ago), self.chunk_size)
+        async for chunk in tracked:
+            stored = [deal for deal in map(deal_from_row, chunk)
+                      if deal and int(deal["ID"]) not in changed_ids]
+            stored_count += len(stored)
+            if not stored:
+                continue
+            if full_sweep:
+                # Сделки, которых нет в полной выборке, ушли из воронки или удалены
+                await self.deal_repo.detach_from_category(category_id, [deal["ID"] for deal in stored])
+            else:
+                yield stored
+
+        logging.info(f"Изменено сделок: {len(changed)}, из БД: {0 if full_sweep else stored_count}.")
+
+    async def fetch(self, category_id: int):
+        """
+        Получение текущего набора отслеживаемых сделок воронки.
+
+        :param category_id: ID воронки.
+        :return: Список сделок в формате Bitrix24, упорядоченный по ID.
+        """
+        deals = [deal async for page in self.stream(category_id) for deal in page]
+        return sorted(deals, key=lambda deal: int(deal["ID"]))
+
+    async def commit(self, category_id: int):
+        """Сохранение новой отметки воронки после записи сделок."""
+        pending = self._pending.pop(category_id, None)
+        if pending:
+            await self.state_repo.save(category_id, *pending)
+
+    @staticmethod
+    def _advance(state, changed, full_sync_at):
+        watermark = state.watermark if state else None
+        last_ids = set(state.last_ids) if state else set()
+
+        for deal_id, modified in changed:
+            if watermark is None or modified > watermark:
+                watermark, last_ids = modified, set()
+            if modified == watermark:
+                last_ids.add(deal_id)
+
+        return watermark, sorted(last_ids), full_sync_at
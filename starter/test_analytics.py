@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from starter.analytics import stage_stats
+from starter.working_hours import WorkingCalendar
+
+calendar = WorkingCalendar(working_start=10, working_end=20, tz_offset=300)
+
+
+def at(day, hour):
+    return datetime(2024, 11, day, hour, tzinfo=calendar.tz)
+
+
+def event(stage_id, doctor, entered_at, left_at=None):
+    return SimpleNamespace(stage_id=stage_id, assigned_by_id=doctor, entered_at=entered_at, left_at=left_at)
+
+
+def test_stage_stats_per_stage_and_doctor():
+    events = [
+        event("C16:NEW", 7, at(4, 10), at(4, 11)),
+        event("C16:NEW", 7, at(4, 10), at(4, 15)),
+        event("C16:NEW", 7, at(4, 19), at(5, 11)),
+        event("C16:NEW", 8, at(5, 10)),
+        event("C16:OPD", 7, at(4, 12), at(4, 13)),
+    ]
+    stage_table = {"C16:NEW": ("Новая заявка", timedelta(hours=3)), "C16:OPD": ("ОПД", None)}
+
+    stats = {(row["stage_id"], row["assigned_by_id"]): row
+             for row in stage_stats(events, stage_table, calendar, now=at(5, 16))}
+
+    new = stats[("C16:NEW", 7)]
+    assert new["count"] == 3 and new["stage_name"] == "Новая заявка"
+    # Рабочие часы: 1, 5 и 2 (19-20 и 10-11 следующего дня)
+    assert new["p50"] == 2 * 3600
+    assert new["breach_rate"] == 1 / 3
+    # Текущее пребывание без перцентилей, но уже просрочено (6 рабочих часов)
+    assert stats[("C16:NEW", 8)]["p50"] is None
+    assert stats[("C16:NEW", 8)]["breach_rate"] == 1.0
+    assert stats[("C16:OPD", 7)]["breach_rate"] is None
+    assert stage_stats([], stage_table, calendar, now=at(5, 16)) == []
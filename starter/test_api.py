@@ -0,0 +1,69 @@
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from bitrix_.enums import DealCategory, Hopper
+from starter import api
+
+
+class FakeDealRepo:
+    def __init__(self, deals):
+        self.deals = deals
+        self.version = "v1"
+        self.pages = []
+
+    async def get_version(self):
+        return self.version
+
+    async def get_page(self, limit, after=0, category_id=None, stage_id=None, assigned_by_id=None, overdue=None):
+        self.pages.append((after, category_id, stage_id, assigned_by_id, overdue))
+        rows = [(deal["deal_id"], deal) for deal in self.deals
+                if deal["deal_id"] > after and category_id in (None, deal["category_id"])
+                and (overdue is None or (deal["delay"] == "Просрочено") == overdue)]
+        return rows[:limit]
+
+
+def deal(deal_id, category_id=16, delay=""):
+    return {"deal_id": deal_id, "category_id": category_id, "stage_id": f"C{category_id}:NEW", "delay": delay}
+
+
+@pytest.mark.asyncio
+async def test_keyset_pages_etag_and_cache():
+    repo = FakeDealRepo([deal(1), deal(2, delay="Просрочено"), deal(3, 17), deal(4), deal(5)])
+    app = api.create_app(repo, [(Hopper.OVK, DealCategory.OVK), (Hopper.OK, DealCategory.OK)])
+    async with TestClient(TestServer(app)) as client:
+        response = await client.get("/api/deals", params={"hopper": "ОВК", "limit": 2})
+        page = await response.json()
+        assert [item["deal_id"] for item in page["items"]] == [1, 2]
+        etag = response.headers["ETag"]
+
+        response = await client.get("/api/deals", params={"hopper": "OVK", "limit": 2, "after": page["next_after"]})
+        page = await response.json()
+        assert ([item["deal_id"] for item in page["items"]], page["next_after"]) == ([4, 5], 5)
+        response = await client.get("/api/deals", params={"hopper": "OVK", "limit": 2, "after": 5})
+        assert await response.json() == {"items": [], "next_after": None}
+
+        response = await client.get("/api/deals", params={"overdue": "true"})
+        assert [item["deal_id"] for item in (await response.json())["items"]] == [2]
+
+        # Та же версия: 304 без обращения к БД, повторный запрос — из кэша
+        pages = len(repo.pages)
+        response = await client.get("/api/deals", params={"hopper": "ОВК", "limit": 2}, headers={"If-None-Match": etag})
+        assert response.status == 304
+        response = await client.get("/api/deals", params={"hopper": "ОВК", "limit": 2})
+        assert response.status == 200 and len(repo.pages) == pages
+
+        # Цикл синхронизации записал сделки: новая версия, кэш сброшен
+        repo.version = "v2"
+        await api.refresh_version(repo)
+        response = await client.get("/api/deals", params={"hopper": "ОВК", "limit": 2}, headers={"If-None-Match": etag})
+        assert response.status == 200 and response.headers["ETag"] != etag
+        assert len(repo.pages) == pages + 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("params", [{"limit": 0}, {"limit": "x"}, {"hopper": "нет"}, {"overdue": "maybe"}])
+async def test_bad_parameters(params):
+    app = api.create_app(FakeDealRepo([]), [(Hopper.OVK, DealCategory.OVK)])
+    async with TestClient(TestServer(app)) as client:
+        response = await client.get("/api/deals", params=params)
+        assert response.status == 400
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+import pytest
+from babel.dates import TIMEDELTA_UNITS, format_timedelta
+
+from starter.formatting import TimedeltaFormatter, timedelta_formatter
+
+
+def sweep():
+    # Равномерно до трех суток, затем с растущим шагом до нескольких лет
+    seconds = list(range(0, 3 * 86400, 37))
+    step = 600
+    while seconds[-1] < 5 * 365 * 86400:
+        seconds.append(seconds[-1] + step)
+        step = int(step * 1.01) + 1
+    # Окрестности границ корзин: порог перехода к единице и половины при округлении
+    for _, seconds_per_unit in TIMEDELTA_UNITS:
+        for boundary in (0.85 * seconds_per_unit, 1.5 * seconds_per_unit, 2.5 * seconds_per_unit):
+            seconds.extend(range(int(boundary) - 3, int(boundary) + 4))
+    return seconds
+
+
+def test_same_as_babel():
+    for seconds in sweep():
+        delta = timedelta(seconds=seconds)
+        assert timedelta_formatter.format(delta) == format_timedelta(delta, locale="ru", format="long"), seconds
+        assert timedelta_formatter.format(-delta) == format_timedelta(-delta, locale="ru", format="long"), seconds
+
+
+@pytest.mark.parametrize("options", [
+    {"format": "short"},
+    {"format": "narrow", "threshold": 1.1},
+    {"granularity": "day"},
+])
+def test_same_as_babel_with_options(options):
+    formatter = TimedeltaFormatter(locale="ru", cache_size=16, **options)
+    for seconds in sweep()[::7]:
+        assert formatter.format(seconds) == format_timedelta(seconds, locale="ru", **options), seconds
+    assert formatter.cache_info().currsize <= 16
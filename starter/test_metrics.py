@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from starter import metrics
+from starter.metrics import Counter, MetricsRegistry, Summary, phase, record_call, trace_cycle
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    calls = Counter("calls_total", "Запросы", ("service",), registry=registry)
+    seconds = Summary("phase_seconds", "Длительность", ("phase",), registry=registry)
+    calls.inc(service='bit"rix')
+    calls.inc(2, service='bit"rix')
+    seconds.observe(0.5, phase="db")
+    seconds.observe(1.5, phase="db")
+
+    assert registry.render().splitlines() == [
+        "# HELP calls_total Запросы",
+        "# TYPE calls_total counter",
+        'calls_total{service="bit\\"rix"} 3.0',
+        "# HELP phase_seconds Длительность",
+        "# TYPE phase_seconds summary",
+        'phase_seconds_sum{phase="db"} 2.0',
+        'phase_seconds_count{phase="db"} 2.0',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_phases_accumulate_calls_from_child_tasks():
+    before = metrics.api_calls.value(service="bitrix", method="crm.deal.list")
+
+    async def request():
+        await asyncio.sleep(0)
+        record_call("bitrix", "crm.deal.list", 50)
+
+    with trace_cycle("test") as trace:
+        for _ in range(2):
+            with phase("fetch_deals", "ОВК") as record:
+                # Запросы из задач, созданных внутри этапа, засчитываются этому этапу
+                await asyncio.gather(*(asyncio.create_task(request()) for _ in range(3)))
+                record.add_rows(150)
+        with phase("db_write", "ОВК"):
+            pass
+        record_call("sheets", "batch_update", 10)
+
+    summary = trace.summary()
+    assert summary["status"] == "ok"
+    fetch, write = summary["phases"]
+    assert (fetch["phase"], fetch["rows"], fetch["calls"], fetch["items"]) == \
+        ("fetch_deals", 300, {"bitrix": 6}, {"bitrix": 300})
+    assert (write["phase"], write["calls"]) == ("db_write", {})
+    assert metrics.api_calls.value(service="bitrix", method="crm.deal.list") == before + 6
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    metrics.cycles_skipped.inc()
+    async with TestClient(TestServer(metrics.create_app())) as client:
+        response = await client.get("/metrics")
+        assert response.status == 200
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert "dh_sync_cycles_skipped_total" in await response.text()
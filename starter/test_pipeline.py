@@ -0,0 +1,350 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.fakes import RecordedBitrix24
+from benchmarks.synthetic import generate_funnel
+from bitrix_.enums import DealCategory, Hopper
+from bitrix_.manager import BitrixManager
+from database.repo.deal import DealRepo
+from sheet.layout import SheetLayout
+from starter import bunch, pipeline
+from starter.render import RenderContext, SlaDeadlines
+from starter.sync import DealSync
+from starter.working_hours import WorkingCalendar
+
+FUNNELS = [(Hopper.OVK, DealCategory.OVK), (Hopper.OK, DealCategory.OK)]
+NOW = datetime(2024, 10, 1, 15, 0).astimezone()
+
+
+class FakeDealRepo:
+    """DealRepo в памяти: хэши строк сравниваются так же, как в DealRepo.changed."""
+
+    def __init__(self):
+        self.fingerprints = {}
+        self.writes = []
+        self.detached = []
+
+    async def changed(self, category_id, fingerprints):
+        return [id for id, fingerprint in fingerprints.items() if self.fingerprints.get(int(id)) != fingerprint]
+
+    async def bulk_upsert(self, rows, chunk_size=500, fingerprints=None):
+        self.writes.append(dict(rows))
+        self.fingerprints.update((int(id), fingerprint) for id, fingerprint in (fingerprints or {}).items())
+        return len(rows)
+
+    async def iter_tracked(self, category_id, since, chunk_size):
+        return
+        yield
+
+    async def detach_from_category(self, category_id, ids):
+        self.detached.append((category_id, list(ids)))
+        return [int(id) for id in ids]
+
+
+class FakeStageEventRepo:
+    def __init__(self):
+        self.records = []
+        self.fail = False
+
+    async def record(self, rows):
+        if self.fail:
+            raise ConnectionError("БД недоступна")
+        self.records.append(dict(rows))
+        return len(rows)
+
+
+class FakeLock:
+    """AdvisoryLock без БД: holders — ключ блокировки -> процесс, который ее держит (общие для всех процессов)."""
+    holders = {}
+
+    def __init__(self, connection, key, name):
+        self.connection = connection
+        self.key = key
+        self.held = False
+
+    def held_seconds(self):
+        return 0.0
+
+    async def acquire(self):
+        self.held = self.holders.setdefault(self.key, self.connection.owner) == self.connection.owner
+        return self.held
+
+    async def check(self):
+        # Соединение могло оборваться, и блокировку взял другой процесс
+        self.held = self.holders.get(self.key) == self.connection.owner
+        return self.held
+
+    async def release(self):
+        if self.held:
+            del self.holders[self.key]
+        self.held = False
+
+
+class FakeLockConnection:
+    """LockConnection без БД: живые процессы — все, кто обращался к соединению."""
+    workers = set()
+
+    def __init__(self, engine, owner):
+        self.owner = owner
+
+    async def live_workers(self):
+        self.workers.add(self.owner)
+        return len(self.workers)
+
+
+class FakeStateRepo:
+    def __init__(self):
+        self.saved = []
+
+    async def get(self, category_id):
+        return None
+
+    async def save(self, category_id, *args):
+        self.saved.append(category_id)
+
+
+class FakeLayoutRepo:
+    async def get_version(self, worksheet):
+        return None
+
+    async def save(self, worksheet, layout):
+        pass
+
+
+def funnel_responses(ovk_deals=10, ok_deals=5):
+    ovk = generate_funnel(ovk_deals, users=20, category_id=16, now=NOW)
+    ok = generate_funnel(ok_deals, users=20, category_id=17, now=NOW)
+    # ID сделок второй воронки продолжают первую
+    for offset, item in enumerate(ok.deals, start=ovk_deals + 1):
+        item["ID"] = str(offset)
+    return ovk, ok, {
+        "crm.deal.list": ovk.deals + ok.deals,
+        "user.get": ovk.users,
+        "crm.dealcategory.stage.list": {"16": ovk.stages, "17": ok.stages},
+    }
+
+
+def clear_state():
+    for state in (pipeline.sheet_writers, pipeline.sheet_tasks, pipeline.sheet_locks, pipeline.sheet_matrices,
+                  pipeline.sheet_layouts, pipeline.sync_locks, pipeline.funnel_locks):
+        state.clear()
+
+
+@pytest.fixture
+def env(monkeypatch):
+    """Общие объекты процесса и репозитории, подмененные фейками; состояние листов очищено."""
+    calendar = WorkingCalendar()
+    config = SimpleNamespace(FUNNELS=FUNNELS, WORKER_MODE=False, WORKER_ID="test", API_ENABLED=False,
+                             BITRIX_CACHE_PERSIST=False, SYNC_FULL_SWEEP_MINUTES=60, SYNC_CHUNK_SIZE=500,
+                             DB_UPSERT_CHUNK_SIZE=500, ROW_WORKERS=0)
+    services = bunch.Services(config=config, working_calendar=calendar, sla_deadlines=SlaDeadlines(calendar),
+                              bitrix_cache=SimpleNamespace(store=None, stats=lambda: {}))
+    monkeypatch.setattr(bunch, "services", services)
+    clear_state()
+
+    deals, events, states, writes = FakeDealRepo(), FakeStageEventRepo(), FakeStateRepo(), []
+    monkeypatch.setattr(pipeline, "DealRepo", lambda engine: deals)
+    monkeypatch.setattr(pipeline, "StageEventRepo", lambda engine: events)
+    monkeypatch.setattr(pipeline, "SheetLayoutRepo", lambda engine: FakeLayoutRepo())
+    monkeypatch.setattr(pipeline, "DealSync", lambda manager, engine, tz, **kwargs: DealSync(
+        manager, engine, tz, deal_repo=deals, state_repo=states, **kwargs))
+    monkeypatch.setattr(pipeline, "get_sheet_manager", lambda: None)
+
+    async def write_sheet(sheet_writer, sheet_manager, matrix, layout):
+        writes.append((sheet_writer.worksheet_name, list(matrix)))
+    monkeypatch.setattr(pipeline, "write_sheet", write_sheet)
+
+    def use_bitrix(responses):
+        manager = BitrixManager("https://example.bitrix24.ru/rest/1/test/")
+        manager.bitrix = manager.paginator.bitrix = RecordedBitrix24(responses)
+        services.bitrix_manager = manager
+        return manager
+
+    yield SimpleNamespace(deals=deals, events=events, states=states, writes=writes, use_bitrix=use_bitrix)
+    clear_state()
+
+
+async def settle():
+    await asyncio.gather(*pipeline.sheet_tasks.values())
+
+
+@pytest.mark.asyncio
+async def test_store_rows_keeps_rows_dirty_until_events_are_recorded(env):
+    ovk = funnel_responses(ovk_deals=3)[0]
+    context = RenderContext(ovk.stages, ovk.users)
+    rows = {item["ID"]: context.render_row(item, timedelta(0)) for item in ovk.deals}
+
+    env.events.fail = True
+    with pytest.raises(ConnectionError):
+        await pipeline.store_rows(None, 16, rows)
+    # История не записана — хэши не сохранены, строки повторятся в следующем цикле
+    assert env.deals.writes == [] and env.deals.fingerprints == {}
+
+    env.events.fail = False
+    assert await pipeline.store_rows(None, 16, rows) == 3
+    assert await pipeline.store_rows(None, 16, rows) == 0
+    assert len(env.deals.writes) == len(env.events.records) == 1
+
+
+@pytest.mark.asyncio
+async def test_run_cycle_fetches_all_funnels_in_one_batch(env):
+    manager = env.use_bitrix(funnel_responses()[2])
+
+    await pipeline.run_cycle(None)
+    await settle()
+
+    # Первые страницы сделок обеих воронок, стадии и сотрудники — один batch-запрос
+    assert manager.bitrix.requests == 1
+    assert sorted(env.writes) == sorted([(Hopper.OVK, [str(id) for id in range(1, 11)]),
+                                         (Hopper.OK, [str(id) for id in range(11, 16)])])
+    assert sum(len(rows) for rows in env.deals.writes) == 15
+    assert sorted(env.states.saved) == [16, 17]
+
+
+@pytest.mark.asyncio
+async def test_run_cycle_skips_funnels_without_users(env):
+    manager = env.use_bitrix(funnel_responses()[2])
+
+    async def no_users(first_page=None):
+        return None
+    manager.get_all_users = no_users
+
+    await pipeline.run_cycle(None)
+
+    # Лист и БД остаются с последними данными, отметка не сдвигается
+    assert env.writes == [] and env.deals.writes == [] and env.states.saved == []
+    assert pipeline.sheet_matrices == {}
+
+
+@pytest.mark.asyncio
+async def test_sync_deals_updates_only_the_deals_funnels(env):
+    ovk, ok, responses = funnel_responses(ovk_deals=3, ok_deals=1)
+    # Сделка 2 перешла из ОВК в ОК
+    moved = dict(ovk.deals[1], CATEGORY_ID="17", STAGE_ID=ok.stages[0]["STATUS_ID"])
+    responses["crm.deal.list"][1] = moved
+    env.use_bitrix(responses)
+
+    for hopper_id, funnel, deals in [(Hopper.OVK, ovk, ovk.deals), (Hopper.OK, ok, ok.deals)]:
+        layout = SheetLayout(funnel.stages)
+        context = RenderContext(funnel.stages, funnel.users, layout=layout)
+        pipeline.sheet_matrices[hopper_id] = ({item["ID"]: context.render_row(item, timedelta(0)) for item in deals},
+                                              layout)
+
+    await pipeline.sync_deals(None, ["2"])
+    await settle()
+
+    assert sorted(env.writes) == sorted([(Hopper.OVK, ["1", "3"]), (Hopper.OK, ["2", "4"])])
+    assert (16, ["2"]) in env.deals.detached
+    assert [list(rows) for rows in env.deals.writes] == [["2"]]
+
+
+@pytest.mark.asyncio
+async def test_sync_deals_waits_for_the_running_cycle(env):
+    manager = env.use_bitrix(funnel_responses(ovk_deals=3, ok_deals=1)[2])
+
+    async with pipeline.holding_funnels(FUNNELS):
+        task = asyncio.create_task(pipeline.sync_deals(None, ["2"]))
+        await asyncio.sleep(0.05)
+        # Пока цикл обрабатывает воронки, события не запрашивают сделки и не пишут строки
+        assert not task.done() and manager.bitrix.requests == 0
+    await task
+    assert [list(rows) for rows in env.deals.writes] == [["2"]]
+
+
+@pytest.fixture
+def workers(env, monkeypatch):
+    """Процессы WORKER_MODE в одном тесте: у каждого свои блокировки воронок и соединение."""
+    monkeypatch.setattr(pipeline, "AdvisoryLock", FakeLock)
+    monkeypatch.setattr(pipeline, "LockConnection", FakeLockConnection)
+    monkeypatch.setattr(FakeLock, "holders", {})
+    monkeypatch.setattr(FakeLockConnection, "workers", set())
+    forgotten = []
+    monkeypatch.setattr(pipeline, "forget_funnel", lambda hopper_id, category_id: forgotten.append(hopper_id))
+    states = {}
+
+    async def owned_by(worker_id, funnels=FUNNELS):
+        locks, connection = states.setdefault(worker_id, ({}, None))
+        monkeypatch.setattr(pipeline, "funnel_locks", locks)
+        monkeypatch.setattr(pipeline, "lock_connection", connection)
+        monkeypatch.setattr(bunch.services.config, "WORKER_ID", worker_id)
+        owned = await pipeline.owned_funnels(None, funnels)
+        states[worker_id] = (locks, pipeline.lock_connection)
+        return owned
+
+    return SimpleNamespace(owned_by=owned_by, forgotten=forgotten)
+
+
+@pytest.mark.asyncio
+async def test_owned_funnels_takes_free_funnels_and_forgets_their_sheets(workers):
+    FakeLock.holders[int(DealCategory.OK)] = "other"
+
+    assert await workers.owned_by("a") == FUNNELS[:1]
+    assert workers.forgotten == [Hopper.OVK]
+
+    # Другой процесс остановился, а соединение с блокировкой ОВК оборвалось, и ее взял другой процесс
+    FakeLock.holders = {int(DealCategory.OVK): "other"}
+    assert await workers.owned_by("a") == FUNNELS[1:]
+    assert workers.forgotten == [Hopper.OVK, Hopper.OVK, Hopper.OK]
+    assert pipeline.owns_funnel(Hopper.OK) and not pipeline.owns_funnel(Hopper.OVK)
+
+    # Удерживаемая блокировка не берется заново, и состояние листа сохраняется
+    assert await workers.owned_by("a") == FUNNELS[1:]
+    assert workers.forgotten == [Hopper.OVK, Hopper.OVK, Hopper.OK]
+
+
+@pytest.mark.asyncio
+async def test_two_workers_split_the_funnels(workers):
+    funnels = FUNNELS + [(Hopper.CHE, DealCategory.CHE)]
+    # Первый процесс запущен один и берет все воронки
+    assert await workers.owned_by("a", funnels) == funnels
+
+    # Второй процесс: доля каждого — две воронки из трех; первый отпускает лишнюю
+    assert await workers.owned_by("b", funnels) == []
+    assert await workers.owned_by("a", funnels) == funnels[:2]
+    assert await workers.owned_by("b", funnels) == funnels[2:]
+    assert workers.forgotten[-2:] == [Hopper.CHE, Hopper.CHE]
+
+    # Набор устоялся: блокировки не переходят между процессами
+    assert await workers.owned_by("a", funnels) == funnels[:2]
+    assert await workers.owned_by("b", funnels) == funnels[2:]
+    assert sorted(FakeLock.holders.items()) == [(14, "b"), (16, "a"), (17, "a")]
+
+
+def test_forget_funnel_drops_sheet_state(monkeypatch):
+    for state in (pipeline.sheet_writers, pipeline.sheet_matrices, pipeline.sheet_layouts):
+        for hopper_id in (Hopper.OVK, Hopper.OK):
+            monkeypatch.setitem(state, hopper_id, object())
+    for category_id, deal_id in ((DealCategory.OVK, 1), (DealCategory.OK, 2)):
+        monkeypatch.setitem(DealRepo._fingerprints, int(category_id), {deal_id: "abc"})
+
+    pipeline.forget_funnel(Hopper.OVK, DealCategory.OVK)
+
+    for state in (pipeline.sheet_writers, pipeline.sheet_matrices, pipeline.sheet_layouts):
+        assert list(state) == [Hopper.OK]
+    # Хэши воронки, которую процесс по-прежнему обрабатывает, не перечитываются из БД
+    assert DealRepo._fingerprints == {int(DealCategory.OK): {2: "abc"}}
+
+
+@pytest.mark.asyncio
+async def test_row_workers_keep_the_deadline_cache_in_the_scheduler(env, monkeypatch):
+    ovk = funnel_responses(ovk_deals=20)[0]
+    context = RenderContext(ovk.stages, ovk.users)
+    monkeypatch.setattr(bunch.services.config, "ROW_WORKERS", 1)
+    calendar = bunch.services.working_calendar
+    computed = []
+    batch = calendar.add_working_seconds_batch
+    monkeypatch.setattr(calendar, "add_working_seconds_batch",
+                        lambda starts, seconds: computed.append(len(starts)) or batch(starts, seconds))
+
+    try:
+        rows = await pipeline.render_rows(ovk.deals, context, NOW)
+        assert await pipeline.render_rows(ovk.deals, context, NOW) == rows
+    finally:
+        await pipeline.shutdown()
+
+    # Сроки посчитаны один раз в этом процессе; второй пачке хватило кэша
+    assert rows == bunch.generate_rows(ovk.deals, context, NOW)
+    assert len(computed) == 1 and computed[0] > 0
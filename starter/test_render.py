@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+
+from pytz import FixedOffset
+
+from starter.render import RenderContext, SlaDeadlines
+from starter.working_hours import WorkingCalendar
+
+MOVED = datetime(2024, 10, 1, 11, 0, tzinfo=FixedOffset(300))
+STAGES = [{"STATUS_ID": "C16:NEW", "NAME": "Новая"}, {"STATUS_ID": "C16:WON", "NAME": "Завершена"}]
+
+
+class CountingCalendar(WorkingCalendar):
+    """Календарь, запоминающий, сколько сроков посчитано."""
+
+    def __init__(self):
+        super().__init__()
+        self.computed = 0
+
+    def add_working_seconds_batch(self, starts, seconds):
+        self.computed += len(starts)
+        return super().add_working_seconds_batch(starts, seconds)
+
+
+def deal(deal_id, stage_id="C16:NEW"):
+    return {"ID": str(deal_id), "STAGE_ID": stage_id}
+
+
+def context(hours=2):
+    return RenderContext(STAGES, [], sla={"Новая": timedelta(hours=hours)})
+
+
+def test_deadline_is_cached_until_the_transition_changes():
+    calendar = CountingCalendar()
+    sla_deadlines = SlaDeadlines(calendar)
+
+    first = sla_deadlines.get([deal(1), deal(2, "C16:WON")], [MOVED, MOVED], context())
+    assert first == [MOVED + timedelta(hours=2), None]
+    assert sla_deadlines.get([deal(1)], [MOVED], context()) == first[:1]
+    assert calendar.computed == 1
+
+    # Новый переход и правка допустимого времени пересчитывают срок
+    later = MOVED + timedelta(hours=1)
+    assert sla_deadlines.get([deal(1)], [later], context()) == [later + timedelta(hours=2)]
+    assert sla_deadlines.get([deal(1)], [later], context(hours=3)) == [later + timedelta(hours=3)]
+    assert calendar.computed == 3
+
+
+def test_deadlines_are_evicted_by_lru():
+    sla_deadlines = SlaDeadlines(CountingCalendar(), maxsize=2)
+
+    sla_deadlines.get([deal(1), deal(2)], [MOVED, MOVED], context())
+    sla_deadlines.get([deal(1), deal(3)], [MOVED, MOVED], context())
+    assert list(sla_deadlines._deadlines) == ["1", "3"]
+
+    # Сделка ушла на стадию без допустимого времени — срок не хранится
+    sla_deadlines.get([deal(1, "C16:WON")], [MOVED], context())
+    assert list(sla_deadlines._deadlines) == ["3"]
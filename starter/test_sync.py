@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from bitrix_.manager import BitrixManager
+from starter.sync import DealSync
+
+PORTAL_TZ = timezone(timedelta(hours=5))
+WATERMARK = datetime(2024, 10, 1, 12, 0, tzinfo=PORTAL_TZ)
+
+
+def deal(deal_id, modified=WATERMARK):
+    return {"ID": str(deal_id), "CATEGORY_ID": "16", "STAGE_ID": "C16:NEW", "ASSIGNED_BY_ID": "1",
+            "MOVED_TIME": "2024-10-01T10:00:00+05:00", "DATE_MODIFY": modified.isoformat()}
+
+
+def stored(deal_id):
+    return {"deal_id": str(deal_id), "stage_id": "C16:NEW", "category_id": "16", "assigned_by_id": "1",
+            "moved_time": "2024-10-01T10:00:00+05:00", "date_modify": WATERMARK.isoformat()}
+
+
+class FakeBitrixManager:
+    deals_modified_since_params = staticmethod(BitrixManager.deals_modified_since_params)
+
+    def __init__(self, pages, fail=False):
+        self.pages = pages
+        self.fail = fail
+        self.params = []
+
+    def iter_deals(self, params, first_page=None):
+        self.params.append(params)
+
+        async def pages():
+            for page in self.pages:
+                yield page
+            if self.fail:
+                raise ConnectionError("Bitrix24 недоступен")
+        return pages()
+
+
+class FakeStateRepo:
+    def __init__(self, state=None):
+        self.state = state
+        self.saved = []
+
+    async def get(self, category_id):
+        return self.state
+
+    async def save(self, category_id, watermark, last_ids, full_sync_at=None):
+        self.saved.append((watermark, list(last_ids), full_sync_at))
+
+
+class FakeDealRepo:
+    def __init__(self, tracked=()):
+        self.tracked = list(tracked)
+        self.since = None
+        self.detached = []
+
+    async def iter_tracked(self, category_id, since, chunk_size):
+        self.since = since
+        for start in range(0, len(self.tracked), chunk_size):
+            yield self.tracked[start:start + chunk_size]
+
+    async def detach_from_category(self, category_id, ids):
+        self.detached.append((category_id, list(ids)))
+        return [int(id) for id in ids]
+
+
+def incremental_state(last_ids=(1,)):
+    return SimpleNamespace(watermark=WATERMARK, last_ids=list(last_ids),
+                           full_sync_at=datetime.now(timezone.utc))
+
+
+async def run(deal_sync):
+    pages = [page async for page in deal_sync.stream(16)]
+    await deal_sync.commit(16)
+    return pages
+
+
+def test_advance_keeps_ids_on_the_watermark():
+    later = WATERMARK + timedelta(minutes=5)
+    state = incremental_state(last_ids=[1])
+    assert DealSync._advance(state, [(2, WATERMARK)], None) == (WATERMARK, [1, 2], None)
+    assert DealSync._advance(state, [(3, later), (2, WATERMARK)], None) == (later, [3], None)
+    assert DealSync._advance(None, [], None) == (None, [], None)
+
+
+@pytest.mark.asyncio
+async def test_incremental_skips_deals_already_seen_on_the_watermark():
+    later = WATERMARK + timedelta(minutes=5)
+    bitrix = FakeBitrixManager([[deal(1), deal(2)], [deal(3, later)]])
+    states, deals = FakeStateRepo(incremental_state()), FakeDealRepo([stored(1), stored(5)])
+    deal_sync = DealSync(bitrix, None, PORTAL_TZ, chunk_size=1, deal_repo=deals, state_repo=states)
+
+    pages = await run(deal_sync)
+
+    # Сделка 1 на отметке обработана в прошлом цикле и приходит из БД вместе с остальными пачками по chunk_size
+    assert [[item["ID"] for item in page] for page in pages] == [["2"], ["3"], ["1"], ["5"]]
+    assert bitrix.params[0]["filter"][">=DATE_MODIFY"] == "2024-10-01 12:00:00"
+    assert states.saved == [(later, [3], None)]
+    assert deals.detached == []
+
+
+@pytest.mark.asyncio
+async def test_full_sweep_detaches_missing_deals_with_one_window():
+    bitrix = FakeBitrixManager([[deal(1)]])
+    states, deals = FakeStateRepo(), FakeDealRepo([stored(1), stored(2)])
+    deal_sync = DealSync(bitrix, None, PORTAL_TZ, deal_repo=deals, state_repo=states)
+
+    pages = await run(deal_sync)
+
+    assert [[item["ID"] for item in page] for page in pages] == [["1"]]
+    assert deals.detached == [(16, ["2"])]
+    # Окно Bitrix24 в поясе портала совпадает с окном выборки из БД
+    since = deals.since.astimezone(PORTAL_TZ)
+    assert bitrix.params[0]["filter"][">=DATE_MODIFY"] == since.strftime("%Y-%m-%d %H:%M:%S")
+    watermark, last_ids, full_sync_at = states.saved[0]
+    assert (watermark, last_ids) == (WATERMARK, [1]) and full_sync_at == deals.since + timedelta(days=1)
+
+
+@pytest.mark.asyncio
+async def test_bitrix_failure_uses_stored_deals_and_keeps_watermark():
+    bitrix = FakeBitrixManager([[deal(2)]], fail=True)
+    states, deals = FakeStateRepo(), FakeDealRepo([stored(2), stored(5)])
+    deal_sync = DealSync(bitrix, None, PORTAL_TZ, deal_repo=deals, state_repo=states)
+
+    pages = await run(deal_sync)
+
+    # Полная сверка не удалась: с воронки ничего не снимается, отметка не сохраняется
+    assert [[item["ID"] for item in page] for page in pages] == [["2"], ["5"]]
+    assert deals.detached == []
+    assert states.saved == []
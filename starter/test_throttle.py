@@ -0,0 +1,83 @@
+import pytest
+from bitrix24.exceptions import BitrixError
+
+from bitrix_.paginator import classify_error
+from starter.throttle import CircuitBreaker, CircuitOpenError, RetryPolicy, ServiceGuard, TokenBucket
+
+
+class Clock:
+    """Время, которое идет только при ожидании."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_spreads_requests():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+
+    for _ in range(6):
+        await bucket.acquire()
+
+    # Два запроса сразу, остальные четыре — по два в секунду
+    assert clock.now == pytest.approx(2.0)
+
+    bucket.penalize(5)
+    await bucket.acquire()
+    assert clock.now == pytest.approx(7.5)
+
+
+@pytest.mark.asyncio
+async def test_guard_retries_rate_limit_and_opens_breaker():
+    clock = Clock()
+    guard = ServiceGuard('Bitrix24', TokenBucket(100, 100, clock=clock, sleep=clock.sleep),
+                         RetryPolicy(attempts=3, base_delay=0.1),
+                         CircuitBreaker(failure_threshold=2, reset_timeout=60, clock=clock),
+                         classify=classify_error, sleep=clock.sleep)
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise BitrixError("HTTP error: 503")
+        return "ok"
+
+    assert await guard.call(flaky) == "ok"
+    assert len(calls) == 3
+    # Пауза по превышению лимита действует на корзину
+    assert clock.now >= 2.0
+
+    async def down():
+        raise BitrixError("HTTP error: 502")
+
+    for _ in range(2):
+        with pytest.raises(BitrixError):
+            await guard.call(down)
+    with pytest.raises(CircuitOpenError):
+        await guard.call(flaky)
+
+    clock.now += 60
+    assert await guard.call(flaky) == "ok"
+    assert guard.breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_guard_does_not_retry_request_errors():
+    guard = ServiceGuard('Bitrix24', TokenBucket(100, 100), classify=classify_error)
+    calls = []
+
+    async def not_found():
+        calls.append(1)
+        raise BitrixError("Not found", "NOT_FOUND")
+
+    with pytest.raises(BitrixError):
+        await guard.call(not_found)
+    assert len(calls) == 1
+    assert guard.breaker.failures == 0
@@ -0,0 +1,46 @@
+import asyncio
+from urllib.parse import urlencode
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from starter.webhook import DealEventQueue, create_app, parse_event
+
+
+def event(name, deal_id, token="secret"):
+    """Тело исходящего вебхука в том виде, в котором его отправляет Bitrix24."""
+    return urlencode({"event": name, "data[FIELDS][ID]": deal_id, "ts": "1700000000",
+                      "auth[domain]": "example.bitrix24.ru", "auth[application_token]": token})
+
+
+def test_parse_event():
+    assert parse_event(event("ONCRMDEALUPDATE", 5)) == ("ONCRMDEALUPDATE", "5", "secret")
+    assert parse_event("") == ("", None, None)
+
+
+@pytest.mark.asyncio
+async def test_fake_bitrix_events_are_debounced():
+    batches = []
+
+    async def handler(ids):
+        batches.append(ids)
+
+    queue = DealEventQueue(handler, debounce=0.05)
+    async with TestClient(TestServer(create_app(queue, token="secret"))) as client:
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        for name, deal_id in [("ONCRMDEALUPDATE", 5), ("ONCRMDEALADD", 7), ("ONCRMDEALUPDATE", 5),
+                              ("ONCRMLEADUPDATE", 9)]:
+            response = await client.post("/bitrix/events", data=event(name, deal_id), headers=headers)
+            assert response.status == 200
+
+        response = await client.post("/bitrix/events", data=event("ONCRMDEALUPDATE", 8, token="wrong"),
+                                     headers=headers)
+        assert response.status == 403
+
+        await asyncio.sleep(0.2)
+        assert batches == [["5", "7"]]
+
+
+def test_token_is_required():
+    with pytest.raises(ValueError):
+        create_app(DealEventQueue(None), token=None)
@@ -0,0 +1,139 @@
+import pickle
+import random
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+from pytz import FixedOffset
+
+from starter.working_hours import WorkingCalendar
+
+TZ = FixedOffset(300)
+
+
+def legacy_calculate_working_hours(delta, start_time, working_start=10, working_end=20):
+    """Прежняя посуточная реализация из starter.bunch (для сравнения)."""
+    total_hours = 0
+    current_time = start_time
+
+    for day in range(delta.days + 1):
+        day_start = datetime(current_time.year, current_time.month, current_time.day, working_start,
+                             tzinfo=FixedOffset(300))
+        day_end = datetime(current_time.year, current_time.month, current_time.day, working_end,
+                           tzinfo=FixedOffset(300))
+
+        if current_time < day_start:
+            current_time = day_start
+        if current_time > day_end:
+            continue
+
+        if current_time < day_end:
+            total_hours += min(delta.total_seconds() / 3600, (day_end - current_time).total_seconds() / 3600)
+
+        current_time = day_start + timedelta(days=1)
+        delta -= timedelta(days=1)
+
+    return timedelta(hours=total_hours)
+
+
+def reference_working_seconds(start, end, calendar):
+    """Эталон: пересечение [start, end) с рабочим окном каждого дня."""
+    start = start.astimezone(calendar.tz)
+    end = end.astimezone(calendar.tz)
+    total = 0.0
+    day = start.date()
+    while day <= end.date():
+        if day.weekday() not in calendar.weekend_days and day not in calendar.holidays:
+            day_start = datetime(day.year, day.month, day.day, calendar.working_start, tzinfo=calendar.tz)
+            day_end = datetime(day.year, day.month, day.day, calendar.working_end, tzinfo=calendar.tz)
+            overlap = (min(end, day_end) - max(start, day_start)).total_seconds()
+            total += max(overlap, 0.0)
+        day += timedelta(days=1)
+    return total
+
+
+def random_moment(rng):
+    base = datetime(2024, 9, 1, tzinfo=TZ)
+    return base + timedelta(seconds=rng.randrange(0, 120 * 86400))
+
+
+def corpus(seed, size=500):
+    rng = random.Random(seed)
+    for _ in range(size):
+        start = random_moment(rng)
+        end = start + timedelta(seconds=rng.randrange(0, 40 * 86400))
+        yield start, end
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_reference(seed):
+    calendar = WorkingCalendar()
+    for start, end in corpus(seed):
+        assert calendar.working_seconds(start, end) == pytest.approx(reference_working_seconds(start, end, calendar))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_reference_with_weekends_and_holidays(seed):
+    calendar = WorkingCalendar(9, 18, weekend_days=(5, 6), holidays=(date(2024, 10, 25), date(2024, 12, 16)))
+    for start, end in corpus(seed):
+        assert calendar.working_seconds(start, end) == pytest.approx(reference_working_seconds(start, end, calendar))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_legacy(seed):
+    # Прежняя реализация точна, когда сделка перешла на стадию в начале рабочего дня
+    calendar = WorkingCalendar()
+    rng = random.Random(seed)
+    for _ in range(500):
+        moved = random_moment(rng).replace(hour=10, minute=0, second=0)
+        delta = timedelta(seconds=rng.randrange(0, 40 * 86400))
+        expected = legacy_calculate_working_hours(delta, moved)
+        assert calendar.working_time(moved, moved + delta).total_seconds() == pytest.approx(expected.total_seconds())
+
+
+def test_batch_matches_scalar():
+    calendar = WorkingCalendar(weekend_days=(6,))
+    now = datetime(2024, 12, 31, 15, 30, tzinfo=TZ)
+    rng = random.Random(42)
+    starts = [random_moment(rng) for _ in range(1000)]
+    batch = calendar.working_seconds_batch(starts, now)
+    assert batch.tolist() == pytest.approx([calendar.working_seconds(start, now) for start in starts])
+
+    utc = np.array([start.replace(tzinfo=None) - timedelta(hours=5) for start in starts], dtype='datetime64[us]')
+    assert calendar.working_seconds_batch(utc, now).tolist() == pytest.approx(batch.tolist())
+
+
+def test_end_before_start_is_zero():
+    calendar = WorkingCalendar()
+    start = datetime(2024, 10, 1, 12, tzinfo=TZ)
+    assert calendar.working_seconds(start, start - timedelta(days=3)) == 0
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_add_working_time_is_first_moment_over_limit(seed):
+    calendar = WorkingCalendar(9, 18, weekend_days=(5, 6), holidays=(date(2024, 10, 25),))
+    rng = random.Random(seed)
+    second = timedelta(seconds=1)
+    for _ in range(300):
+        start = random_moment(rng)
+        limit = timedelta(seconds=rng.choice([0, 3600, 9 * 3600, rng.randrange(0, 10 * 86400)]))
+        deadline = calendar.add_working_time(start, limit)
+        assert calendar.working_seconds(start, deadline) == pytest.approx(limit.total_seconds())
+        assert calendar.working_seconds(start, deadline + second) > limit.total_seconds()
+        if deadline - second >= start:
+            assert calendar.working_seconds(start, deadline - second) <= limit.total_seconds()
+
+
+def test_add_working_time_at_end_of_window_moves_to_next_working_day():
+    calendar = WorkingCalendar(10, 20, weekend_days=(5, 6))
+    # Пятница, 18:00: два часа до конца окна, третий — в понедельник
+    start = datetime(2024, 10, 4, 18, tzinfo=TZ)
+    assert calendar.add_working_time(start, timedelta(hours=2)) == datetime(2024, 10, 7, 10, tzinfo=TZ)
+    assert calendar.add_working_time(start, timedelta(hours=3)) == datetime(2024, 10, 7, 11, tzinfo=TZ)
+
+
+def test_calendar_is_picklable():
+    calendar = WorkingCalendar(9, 18, weekend_days=(5, 6), holidays=(date(2024, 11, 4),))
+    copy = pickle.loads(pickle.dumps(calendar))
+    start = datetime(2024, 11, 1, 17, tzinfo=TZ)
+    assert copy.add_working_time(start, timedelta(hours=2)) == calendar.add_working_time(start, timedelta(hours=2))
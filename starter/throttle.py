@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+
+
+class CircuitOpenError(RuntimeError):
+    """Сервис временно считается недоступным, запрос не отправлялся."""
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, clock=time.monotonic, sleep=asyncio.sleep):
+        """
+        Ограничение частоты запросов к сервису (token bucket).
+
+        :param rate: Пополнение в токенах (запросах) в секунду.
+        :param burst: Емкость корзины — сколько запросов можно отправить подряд без ожидания.
+        :param clock: Источник монотонного времени.
+        :param sleep: Корутинная функция ожидания.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = burst
+        self.updated_at = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, tokens: float = 1):
+        """Ожидание свободного токена; запросы обслуживаются по очереди."""
+        async with self._lock:
+            self._refill()
+            # Допуск на погрешность float, иначе ожидание может стать бесконечно малым
+            while self.tokens < tokens - 1e-9:
+                await self.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+    def penalize(self, seconds: float):
+        """Пауза для всех запросов сервиса, например после ответа о превышении лимита."""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+@dataclass
+class RetryPolicy:
+    attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+
+    def delay(self, attempt: int) -> float:
+        """
+        Пауза перед повтором: экспоненциальная с полным разбросом (full jitter).
+
+        :param attempt: Номер неудачной попытки, начиная с 1.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60, clock=time.monotonic):
+        """
+        Размыкатель: после failure_threshold неудачных вызовов подряд запросы к сервису
+        не отправляются reset_timeout секунд. Затем запросы снова пропускаются;
+        первая же неудача размыкает цепь еще на reset_timeout, успех замыкает.
+
+        :param failure_threshold: Количество неудач подряд до размыкания.
+        :param reset_timeout: Время в разомкнутом состоянии в секундах.
+        :param clock: Источник монотонного времени.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+
+
+class ServiceGuard:
+    def __init__(self, name: str, limiter: TokenBucket, retry: RetryPolicy = None,
+                 breaker: CircuitBreaker = None, classify=None, sleep=asyncio.sleep):
+        """
+        Вызовы внешнего сервиса с ограничением частоты, повторами и размыкателем.
+
+        :param name: Имя сервиса для журнала.
+        :param limiter: Корзина токенов сервиса, общая для всех его вызовов.
+        :param retry: Политика повторов.
+        :param breaker: Размыкатель.
+        :param classify: Функция ошибки -> (повторять ли, пауза от сервиса или None).
+        :param sleep: Корутинная функция ожидания.
+        """
+        self.name = name
+        self.limiter = limiter
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.classify = classify or (lambda error: (False, None))
+        self.sleep = sleep
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Вызов корутинной функции func(*args, **kwargs).
+
+        :raises CircuitOpenError: Если размыкатель разомкнут.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name} временно недоступен, запрос пропущен")
+
+        for attempt in range(1, self.retry.attempts + 1):
+            await self.limiter.acquire()
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                retryable, hint = self.classify(e)
+                if not retryable:
+                    # Ошибка запроса, а не сервиса: размыкатель не учитывает
+                    raise
+                if attempt == self.retry.attempts:
+                    self.breaker.record_failure()
+                    raise
+                delay = self.retry.delay(attempt)
+                if hint:
+                    # Пауза, запрошенная сервисом (Retry-After), действует на все его запросы
+                    self.limiter.penalize(hint)
+                logging.warning(f"{self.name}: {e!r}, повтор {attempt}/{self.retry.attempts - 1} "
+                                f"через {delay:.1f} с.")
+                await self.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
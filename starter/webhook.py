@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+# События Bitrix24, по которым сделка перезапрашивается
+DEAL_EVENTS = frozenset({"ONCRMDEALADD", "ONCRMDEALUPDATE"})
+
+
+def parse_event(body: str):
+    """
+    Разбор исходящего вебхука Bitrix24 (application/x-www-form-urlencoded).
+
+    :param body: Тело запроса, например "event=ONCRMDEALUPDATE&data[FIELDS][ID]=5&auth[application_token]=...".
+    :return: Имя события, ID сделки (или None) и токен приложения.
+    """
+    fields = dict(parse_qsl(body, keep_blank_values=True))
+    return (fields.get("event", "").upper(), fields.get("data[FIELDS][ID]") or None,
+            fields.get("auth[application_token]"))
+
+
+class DealEventQueue:
+    def __init__(self, handler, debounce: float = 2.0, max_batch: int = 200):
+        """
+        Очередь ID измененных сделок с объединением частых событий.
+
+        После первого события очередь ждет debounce секунд, собирая остальные,
+        и передает накопленные ID в handler одним вызовом. Повторные события одной
+        сделки за это время схлопываются.
+
+        :param handler: Корутинная функция, принимающая список ID сделок.
+        :param debounce: Время ожидания следующих событий в секундах.
+        :param max_batch: Максимальное количество ID в одном вызове handler.
+        """
+        self.handler = handler
+        self.debounce = debounce
+        self.max_batch = max_batch
+        self._pending = {}
+        self._ready = asyncio.Event()
+        self._worker = None
+
+    def put(self, deal_id):
+        self._pending[str(deal_id)] = None
+        self._ready.set()
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка обработчика; накопленные ID обрабатываются перед выходом."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self.flush()
+
+    async def flush(self):
+        while self._pending:
+            ids = list(self._pending)[:self.max_batch]
+            for deal_id in ids:
+                del self._pending[deal_id]
+            try:
+                await self.handler(ids)
+            except Exception as e:
+                # Сделки догонит сверка по расписанию
+                logging.exception(f"Ошибка обработки событий сделок {ids}: {e}")
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            await asyncio.sleep(self.debounce)
+            self._ready.clear()
+            await self.flush()
+
+
+def create_app(queue: DealEventQueue, token: str) -> web.Application:
+    """
+    Приложение aiohttp, принимающее исходящие вебхуки Bitrix24 на POST /bitrix/events.
+
+    :param queue: Очередь ID сделок.
+    :param token: application_token исходящего вебхука; события с другим токеном отклоняются.
+    """
+    if not token:
+        raise ValueError("Не задан токен вебхука (WEBHOOK_TOKEN): события принимались бы от кого угодно")
+
+    async def receive(request: web.Request):
+        event, deal_id, application_token = parse_event(await request.text())
+        if application_token != token:
+            logging.warning(f"Событие Bitrix24 {event} с неверным токеном отклонено.")
+            return web.Response(status=403)
+        if event in DEAL_EVENTS and deal_id:
+            logging.debug(f"Событие {event} по сделке {deal_id}.")
+            queue.put(deal_id)
+        return web.Response(text="OK")
+
+    async def on_startup(app):
+        queue.start()
+
+    async def on_cleanup(app):
+        await queue.stop()
+
+    app = web.Application()
+    app.router.add_post("/bitrix/events", receive)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+async def start_server(app: web.Application, host: str, port: int) -> web.AppRunner:
+    """Запуск приложения в текущем цикле событий рядом с планировщиком."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    urls = ", ".join(f"http://{host}:{port}{resource.canonical}" for resource in app.router.resources())
+    logging.info(f"HTTP-сервер запущен: {urls}")
+    return runner
@@ -0,0 +1,127 @@
+import datetime
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+
+
+class WorkingCalendar:
+    def __init__(self, working_start: int = 10, working_end: int = 20, tz_offset: int = 300,
+                 weekend_days=(), holidays=()):
+        """
+        Календарь рабочего времени: рабочее окно, часовой пояс, выходные и праздники.
+
+        :param working_start: Начало рабочего дня (часы).
+        :param working_end: Конец рабочего дня (часы).
+        :param tz_offset: Смещение часового пояса в минутах (300 = UTC+5).
+        :param weekend_days: Выходные дни недели (0 — понедельник, 6 — воскресенье).
+        :param holidays: Праздничные дни (datetime.date).
+        """
+        if not 0 <= working_start < working_end <= 24:
+            raise ValueError(f"Некорректное рабочее окно: {working_start}-{working_end}")
+
+        self.working_start = working_start
+        self.working_end = working_end
+        self.tz_offset = tz_offset
+        self.tz = datetime.timezone(datetime.timedelta(minutes=tz_offset))
+        self.weekend_days = tuple(sorted(set(weekend_days)))
+        self.holidays = tuple(sorted(set(holidays)))
+
+        self._window_start = working_start * 3600
+        self._window = (working_end - working_start) * 3600
+        self._offset = tz_offset * 60
+        weekmask = [0 if day in self.weekend_days else 1 for day in range(7)]
+        self._busdaycal = np.busdaycalendar(weekmask=weekmask,
+                                            holidays=np.array(self.holidays, dtype='datetime64[D]'))
+
+    def __reduce__(self):
+        # np.busdaycalendar не сериализуется: в пул процессов календарь передается параметрами
+        return type(self), (self.working_start, self.working_end, self.tz_offset, self.weekend_days, self.holidays)
+
+    @classmethod
+    def from_config(cls, config):
+        """Создание календаря из настроек DotEnv."""
+        return cls(
+            working_start=config.WORKING_START,
+            working_end=config.WORKING_END,
+            tz_offset=config.TZ_OFFSET,
+            weekend_days=config.WEEKEND_DAYS,
+            holidays=config.HOLIDAYS,
+        )
+
+    def _epoch(self, moment: datetime.datetime) -> float:
+        """Unix-время; наивные даты считаются заданными в часовом поясе календаря."""
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=self.tz)
+        return moment.timestamp()
+
+    def _epochs(self, moments) -> np.ndarray:
+        if isinstance(moments, np.ndarray) and np.issubdtype(moments.dtype, np.datetime64):
+            # Массивы datetime64 трактуются как UTC
+            return moments.astype('datetime64[us]').astype(np.int64) / 1e6
+        return np.fromiter((self._epoch(moment) for moment in moments), dtype=np.float64)
+
+    def _locate(self, epochs: np.ndarray):
+        """
+        Раскладывает моменты времени на локальную дату и число рабочих секунд,
+        отработанных в этот день до указанного момента.
+        """
+        local = epochs + self._offset
+        days = np.floor(local / SECONDS_PER_DAY)
+        seconds_of_day = local - days * SECONDS_PER_DAY
+        dates = days.astype(np.int64).astype('datetime64[D]')
+        partial = np.clip(seconds_of_day - self._window_start, 0, self._window)
+        partial = np.where(np.is_busday(dates, busdaycal=self._busdaycal), partial, 0.0)
+        return dates, partial
+
+    def working_seconds_batch(self, starts, end: datetime.datetime) -> np.ndarray:
+        """
+        Рабочее время (в секундах) от каждого момента starts до end за один проход NumPy.
+
+        Для каждого интервала: полные рабочие дни между датами умножаются на длину окна,
+        к ним добавляется остаток последнего дня и вычитается отработанная часть первого.
+
+        :param starts: Моменты перехода на стадию (datetime или массив datetime64 в UTC).
+        :param end: Момент, до которого считается время (обычно «сейчас»),
+            или последовательность концов той же длины, что и starts.
+        :return: Массив длительностей в секундах; интервалы с концом раньше начала дают 0.
+        """
+        start_dates, start_partial = self._locate(self._epochs(starts))
+        ends = [end] if isinstance(end, datetime.datetime) else end
+        end_dates, end_partial = self._locate(self._epochs(ends))
+        full_days = np.busday_count(start_dates, end_dates, busdaycal=self._busdaycal)
+        seconds = full_days * self._window + end_partial - start_partial
+        return np.maximum(seconds, 0.0)
+
+    def add_working_seconds_batch(self, starts, seconds) -> np.ndarray:
+        """
+        Моменты, после которых рабочее время от starts превышает seconds (обратная к working_seconds_batch).
+
+        От рабочего дня начала (или следующего рабочего, если начало в выходной) откладывается
+        отработанная до начала часть окна плюс seconds: целые окна дают число рабочих дней,
+        остаток — время внутри окна. Если остаток нулевой, результатом будет начало окна
+        следующего рабочего дня: до него рабочее время равно seconds, но не превышает его.
+
+        :param starts: Моменты начала (datetime или массив datetime64 в UTC).
+        :param seconds: Рабочее время в секундах: число или массив той же длины.
+        :return: Массив Unix-времени.
+        """
+        dates, partial = self._locate(self._epochs(starts))
+        total = partial + np.maximum(np.asarray(seconds, dtype=np.float64), 0.0)
+        full_days = np.floor(total / self._window)
+        remainder = total - full_days * self._window
+        days = np.busday_offset(dates, full_days.astype(np.int64), roll='forward', busdaycal=self._busdaycal)
+        return days.astype(np.int64) * SECONDS_PER_DAY + self._window_start + remainder - self._offset
+
+    def add_working_time(self, start: datetime.datetime, delta: datetime.timedelta) -> datetime.datetime:
+        """Момент, после которого рабочее время от start превышает delta, в часовом поясе календаря."""
+        epoch = self.add_working_seconds_batch([start], delta.total_seconds())[0]
+        return datetime.datetime.fromtimestamp(float(epoch), tz=self.tz)
+
+    def working_seconds(self, start: datetime.datetime, end: datetime.datetime) -> float:
+        """Рабочее время (в секундах) между start и end."""
+        return float(self.working_seconds_batch([start], end)[0])
+
+    def working_time(self, start: datetime.datetime, end: datetime.datetime) -> datetime.timedelta:
+        """Рабочее время между start и end в виде timedelta."""
+        return datetime.timedelta(seconds=self.working_seconds(start, end))